@@ -22,8 +22,11 @@ import requests
 import pandas as pd
 import json
 import io
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Union, Any
+import math
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple, Union, Any
 from urllib.parse import urljoin
 import logging
 
@@ -31,6 +34,22 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Fallback request durations (seconds) used by the retrieval planner until
+# enough calls have been observed to use measured values instead.
+DEFAULT_REQUEST_SECONDS = {
+    "/time-series/get": 1.0,
+    "/time-slice/get": 4.0,
+}
+
+# pandas frequency aliases matching the API time aggregations
+AGGREGATION_FREQUENCIES = {
+    "MINUTES_5": "5min",
+    "MINUTES_15": "15min",
+    "MINUTES_30": "30min",
+    "HOURS_1": "1h",
+    "DAYS_1": "1D",
+}
+
 
 class HdaApiError(Exception):
     """Custom exception for HDA API errors."""
@@ -41,6 +60,131 @@ class HdaApiError(Exception):
         super().__init__(self.message)
 
 
+class IntervalCache:
+    """
+    In-memory cache for time-ranged HDA results with interval tracking.
+    
+    Results are stored per key (e.g. street or KPI) as one time-indexed
+    DataFrame together with the list of time ranges it covers. A request for
+    a partially covered range only needs the missing sub-ranges, which are
+    fetched and merged into the stored frame.
+    
+    Ranges ending within `settle` of the current time are merged but not
+    marked as covered, so recent data is fetched again until it is final.
+    """
+    
+    def __init__(self, settle: timedelta = timedelta(minutes=30)):
+        """
+        Initialize an empty cache.
+        
+        Args:
+            settle (timedelta): Delay after which data is considered final (default: 30 minutes)
+        """
+        self.settle = settle
+        self._entries: Dict[Tuple, Dict[str, Any]] = {}
+    
+    def covered_ranges(self, key: Tuple) -> List[Tuple[datetime, datetime]]:
+        """Return the sorted, non-overlapping ranges stored for a key."""
+        entry = self._entries.get(key)
+        return list(entry['intervals']) if entry else []
+    
+    def missing_ranges(self, key: Tuple, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+        """
+        Work out which sub-ranges of [start, end) are not cached yet.
+        
+        Args:
+            key (tuple): Cache key
+            start (datetime): Range start (naive UTC)
+            end (datetime): Range end (naive UTC, exclusive)
+            
+        Returns:
+            List of (start, end) ranges that still have to be fetched
+        """
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in self.covered_ranges(key):
+            if covered_end <= cursor:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start))
+            cursor = covered_end
+            if cursor >= end:
+                break
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+    
+    def store(self, key: Tuple, start: datetime, end: datetime, frame: pd.DataFrame, time_column: str):
+        """
+        Merge freshly fetched results for [start, end) into the cache.
+        
+        Rows already cached inside the range are replaced by the new rows.
+        
+        Args:
+            key (tuple): Cache key
+            start (datetime): Fetched range start (naive UTC)
+            end (datetime): Fetched range end (naive UTC, exclusive)
+            frame (DataFrame): Results of the fetch
+            time_column (str): Name of the timestamp column in frame
+        """
+        entry = self._entries.setdefault(key, {'intervals': [], 'frame': None, 'time_column': time_column})
+        frame = self._within(frame, time_column, start, end)
+        
+        cached = entry['frame']
+        if cached is not None:
+            times = cached[time_column]
+            outside = (times < self._timestamp(start)) | (times >= self._timestamp(end))
+            # Empty ranges (nights, new KPIs) only extend the covered intervals
+            frame = pd.concat([cached[outside], frame], ignore_index=True) if len(frame) else cached[outside]
+        entry['frame'] = frame.sort_values(time_column, kind='stable', ignore_index=True)
+        
+        covered_end = min(end, datetime.now(timezone.utc).replace(tzinfo=None) - self.settle)
+        if covered_end > start:
+            entry['intervals'] = self._merge_intervals(entry['intervals'] + [(start, covered_end)])
+    
+    def get(self, key: Tuple, start: datetime, end: datetime) -> pd.DataFrame:
+        """Return the cached rows of a key that fall into [start, end)."""
+        entry = self._entries.get(key)
+        if not entry or entry['frame'] is None:
+            return pd.DataFrame()
+        return self._within(entry['frame'], entry['time_column'], start, end)
+    
+    def invalidate(self, key: Optional[Tuple] = None):
+        """Drop one key, or the whole cache when no key is given."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+    
+    @classmethod
+    def _within(cls, frame: pd.DataFrame, time_column: str, start: datetime, end: datetime) -> pd.DataFrame:
+        """Rows of frame with start <= time_column < end, with the column parsed to UTC timestamps."""
+        frame = frame.copy()
+        if time_column not in frame.columns:
+            # Empty responses may come without any columns
+            frame[time_column] = pd.Series(dtype='datetime64[ns, UTC]')
+        frame[time_column] = pd.to_datetime(frame[time_column], utc=True)
+        times = frame[time_column]
+        mask = (times >= cls._timestamp(start)) & (times < cls._timestamp(end))
+        return frame[mask].reset_index(drop=True)
+    
+    @staticmethod
+    def _timestamp(value: datetime) -> pd.Timestamp:
+        return pd.Timestamp(value, tz='UTC')
+    
+    @staticmethod
+    def _merge_intervals(intervals: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+
 class HdaClient:
     """
     PTV Flows Historical Data API Client
@@ -54,7 +198,7 @@ class HdaClient:
     """
     
     def __init__(self, api_key: str, base_url: str = "https://api.ptvgroup.tech/hda/v1", 
-                 timeout: int = 30, debug: bool = False):
+                 timeout: int = 30, debug: bool = False, range_cache: Optional[IntervalCache] = None):
         """
         Initialize the HDA API client.
         
@@ -63,12 +207,19 @@ class HdaClient:
             base_url (str): Base URL for the HDA API (default: production endpoint)
             timeout (int): Request timeout in seconds (default: 30)
             debug (bool): Enable debug logging (default: False)
+            range_cache (IntervalCache, optional): Cache used by the *_range methods (default: no caching)
         """
         self.api_key = api_key
         self.base_url = base_url.rstrip('/')
         self.timeout = timeout
         self.debug = debug
         
+        # Recent request durations per endpoint, used for cost estimation
+        self.request_metrics: Dict[str, deque] = defaultdict(lambda: deque(maxlen=50))
+        self.last_request_seconds: Optional[float] = None
+        self._network_size: Optional[Dict[str, int]] = None
+        self.range_cache = range_cache
+        
         if debug:
             logger.setLevel(logging.DEBUG)
             
@@ -79,7 +230,7 @@ class HdaClient:
         logger.info(f"HDA Client initialized with base URL: {self.base_url}")
         
     def _make_request(self, endpoint: str, params: Dict[str, Any] = None, 
-                     accept_header: str = "application/json") -> requests.Response:
+                     accept_header: str = "application/json", record: bool = True) -> requests.Response:
         """
         Make an authenticated request to the HDA API.
         
@@ -87,6 +238,8 @@ class HdaClient:
             endpoint (str): API endpoint path
             params (dict): Query parameters
             accept_header (str): Accept header for response format
+            record (bool): Add the duration to request_metrics (the duration of the
+                           latest call is always kept in last_request_seconds)
             
         Returns:
             requests.Response: Raw HTTP response
@@ -107,7 +260,9 @@ class HdaClient:
             logger.debug(f"Params: {params}")
             
         try:
+            started = time.perf_counter()
             response = requests.get(url, headers=headers, params=params, timeout=self.timeout)
+            elapsed = time.perf_counter() - started
             
             if self.debug:
                 logger.debug(f"Response status: {response.status_code}")
@@ -133,6 +288,9 @@ class HdaClient:
                 raise HdaApiError(f"API request failed with status {response.status_code}", 
                                 response.status_code, response.text)
                 
+            self.last_request_seconds = elapsed
+            if record:
+                self.request_metrics['/' + endpoint.lstrip('/')].append(elapsed)
             return response
             
         except requests.exceptions.Timeout:
@@ -199,17 +357,24 @@ class HdaClient:
         
         logger.info(f"Fetching time slice data from {params['fromTime']} to {params.get('toTime', 'auto')}")
         
-        response = self._make_request("/time-slice/get", params, accept_header)
+        response = self._make_request("/time-slice/get", params, accept_header, record=False)
+        elapsed = self.last_request_seconds
         
         # Process response based on format
         if output_format == "json":
-            return response.json()
+            data = response.json()
+            rows = len(data.get('results') or []) if isinstance(data, dict) else len(data)
         elif output_format == "parquet":
-            return pd.read_parquet(io.BytesIO(response.content))
-        elif output_format == "csv":
-            return pd.read_csv(io.BytesIO(response.content), compression='gzip')
+            data = pd.read_parquet(io.BytesIO(response.content))
+            rows = len(data)
         else:
-            return response.content
+            data = pd.read_csv(io.BytesIO(response.content), compression='gzip')
+            rows = len(data)
+        
+        # Only pages with data are representative of a time slice download (see estimate_retrieval_costs)
+        if rows:
+            self.request_metrics['/time-slice/get'].append(elapsed)
+        return data
 
     # =============================================================================
     # TIME SERIES DATA ENDPOINTS  
@@ -542,6 +707,306 @@ class HdaClient:
         else:
             return response.content
 
+    # =============================================================================
+    # CACHED RANGE RETRIEVAL
+    # =============================================================================
+    
+    def get_time_series_range(self, street_code: str, from_time: Union[str, datetime],
+                              to_time: Union[str, datetime], time_aggregation: str = "HOURS_1",
+                              value_type: str = "speed") -> pd.DataFrame:
+        """
+        Get time series values for one street, reusing cached sub-ranges.
+        
+        With a range_cache configured, only the parts of the window that are
+        not cached yet are requested. The window is widened to whole
+        time_aggregation buckets so cached and fetched ranges line up.
+        
+        Args:
+            street_code (str): Internal street code identifier
+            from_time (str|datetime): Start time
+            to_time (str|datetime): End time (exclusive)
+            time_aggregation (str): Time aggregation (MINUTES_5|15|30, HOURS_1, DAYS_1)
+            value_type (str): Value type (speed|probeCount|travelTime)
+            
+        Returns:
+            DataFrame: Columns fdat (UTC timestamps) and <value_type>
+        """
+        from_dt, to_dt = self._bucket_window(from_time, to_time, time_aggregation)
+        
+        def fetch(start: datetime, end: datetime) -> pd.DataFrame:
+            data = self.get_time_series_data(from_time=start, to_time=end, street_code=street_code,
+                                             time_aggregation=time_aggregation, value_type=value_type)
+            series = data.get('timeSeries') or {}
+            return pd.DataFrame({'fdat': series.get('fdat') or [],
+                                 value_type: series.get(value_type) or []})
+        
+        key = ("time-series", street_code, time_aggregation, value_type)
+        return self._get_range(key, from_dt, to_dt, fetch, 'fdat')
+    
+    def get_kpi_range(self, kpi_id: str, from_time: Union[str, datetime], to_time: Union[str, datetime],
+                      detailed: bool = False) -> pd.DataFrame:
+        """
+        Get KPI results for a time range, reusing cached sub-ranges.
+        
+        Missing sub-ranges are split to respect the API interval limits
+        (1 day for detailed results, 1 year for overall results).
+        
+        Args:
+            kpi_id (str): KPI identifier from KPI engineering API
+            from_time (str|datetime): Start time
+            to_time (str|datetime): End time (exclusive)
+            detailed (bool): Use /kpi/detailed/get instead of /kpi/overall/get
+            
+        Returns:
+            DataFrame: One row per KPI result, timestamp as UTC timestamps
+        """
+        get_data = self.get_kpi_detailed_data if detailed else self.get_kpi_overall_data
+        max_span = timedelta(days=1) if detailed else timedelta(days=365)
+        
+        def fetch(start: datetime, end: datetime) -> pd.DataFrame:
+            return pd.DataFrame.from_records(get_data(kpi_id, start, end).get('data') or [])
+        
+        key = ("kpi/detailed" if detailed else "kpi/overall", kpi_id)
+        return self._get_range(key, self._parse_datetime(from_time), self._parse_datetime(to_time),
+                               fetch, 'timestamp', max_span)
+    
+    def _bucket_window(self, from_time: Union[str, datetime], to_time: Union[str, datetime],
+                       time_aggregation: str) -> Tuple[datetime, datetime]:
+        """Widen [from_time, to_time) to whole time_aggregation buckets (naive UTC)."""
+        if time_aggregation not in AGGREGATION_FREQUENCIES:
+            raise ValueError(f"Invalid time_aggregation. Must be one of: {list(AGGREGATION_FREQUENCIES)}")
+        frequency = AGGREGATION_FREQUENCIES[time_aggregation]
+        from_dt = pd.Timestamp(self._parse_datetime(from_time)).floor(frequency).to_pydatetime()
+        to_dt = pd.Timestamp(self._parse_datetime(to_time)).ceil(frequency).to_pydatetime()
+        return from_dt, to_dt
+    
+    def _get_range(self, key: Tuple, from_dt: datetime, to_dt: datetime,
+                   fetch: Callable[[datetime, datetime], pd.DataFrame], time_column: str,
+                   max_span: Optional[timedelta] = None) -> pd.DataFrame:
+        """Fetch the missing sub-ranges of [from_dt, to_dt) and return the merged result."""
+        cache = self.range_cache if self.range_cache is not None else IntervalCache()
+        gaps = cache.missing_ranges(key, from_dt, to_dt)
+        
+        if self.debug:
+            logger.debug(f"Range cache {key}: {len(gaps)} missing sub-range(s) in {from_dt} - {to_dt}")
+        
+        for gap_start, gap_end in gaps:
+            chunk_start = gap_start
+            while chunk_start < gap_end:
+                chunk_end = min(chunk_start + max_span, gap_end) if max_span else gap_end
+                cache.store(key, chunk_start, chunk_end, fetch(chunk_start, chunk_end), time_column)
+                chunk_start = chunk_end
+        
+        return cache.get(key, from_dt, to_dt)
+
+    # =============================================================================
+    # RETRIEVAL PLANNING
+    # =============================================================================
+    
+    def get_network_size(self, from_time: Union[str, datetime], refresh: bool = False) -> Dict[str, int]:
+        """
+        Get the number of network elements served by the time slice endpoint.
+        
+        The time slice metadata is requested once (a single-row page) and cached
+        on the client. The probe is not recorded in request_metrics, so it does
+        not lower the observed cost of full time slice pages.
+        
+        Args:
+            from_time (str|datetime): Any start time with available data
+            refresh (bool): Ignore the cached value and query the API again
+            
+        Returns:
+            dict: 'total_elements' and 'max_elements_per_request'
+        """
+        if self._network_size is None or refresh:
+            from_dt = self._parse_datetime(from_time)
+            params = {'fromTime': self.format_datetime(from_dt),
+                      'toTime': self.format_datetime(from_dt + timedelta(hours=1)), 'fromRow': 1, 'toRow': 2}
+            response = self._make_request("/time-slice/get", params, record=False)
+            metadata = response.json().get('metadata') or {}
+            total = int(metadata.get('totalElements') or 0)
+            self._network_size = {
+                'total_elements': total,
+                'max_elements_per_request': int(metadata.get('maxElementsPerRequest') or total or 1),
+            }
+        return self._network_size
+    
+    def estimate_retrieval_costs(self, street_codes: List[str], from_time: Union[str, datetime],
+                                 to_time: Union[str, datetime], time_aggregation: str = "HOURS_1",
+                                 value_type: str = "speed") -> Dict[str, Any]:
+        """
+        Estimate the cost of retrieving history for a set of streets.
+        
+        Compares one /time-series/get call per street against downloading
+        every hourly network time slice and filtering it locally. Request
+        durations come from the calls already made by this client, falling
+        back to DEFAULT_REQUEST_SECONDS. With a range_cache configured, only
+        the time series sub-ranges that are not cached yet are counted.
+        
+        time_aggregation is deliberately not part of the cost model: time slices
+        always arrive at the native resolution and are aggregated locally, and
+        a time series request covers the whole window for any aggregation, so
+        the request counts do not depend on it.
+        
+        Args:
+            street_codes (List[str]): Street codes to retrieve
+            from_time (str|datetime): Start time
+            to_time (str|datetime): End time
+            time_aggregation (str): Time aggregation of the time series requests
+            value_type (str): Value type of the time series requests
+            
+        Returns:
+            dict: Request counts and estimated seconds for each strategy,
+                  plus the cheaper 'strategy' ("time_series" or "time_slice")
+        """
+        from_dt = self._parse_datetime(from_time)
+        to_dt = self._parse_datetime(to_time)
+        if to_dt <= from_dt:
+            raise ValueError("to_time must be after from_time")
+        
+        network = self.get_network_size(from_dt)
+        hours = math.ceil((to_dt - from_dt).total_seconds() / 3600)
+        pages = max(1, math.ceil(network['total_elements'] / network['max_elements_per_request']))
+        
+        if self.range_cache is not None:
+            # Same bucket-aligned window as get_time_series_range queries and stores
+            series_from, series_to = self._bucket_window(from_dt, to_dt, time_aggregation)
+            series_requests = sum(
+                len(self.range_cache.missing_ranges(("time-series", code, time_aggregation, value_type),
+                                                    series_from, series_to))
+                for code in set(street_codes))
+        else:
+            series_requests = len(set(street_codes))
+        slice_requests = hours * pages
+        costs = {
+            'time_series_requests': series_requests,
+            'time_series_seconds': series_requests * self._observed_request_seconds("/time-series/get"),
+            'time_slice_requests': slice_requests,
+            'time_slice_seconds': slice_requests * self._observed_request_seconds("/time-slice/get"),
+        }
+        costs['strategy'] = "time_series" if costs['time_series_seconds'] <= costs['time_slice_seconds'] else "time_slice"
+        return costs
+    
+    def get_streets_history(self, street_codes: List[str], from_time: Union[str, datetime],
+                            to_time: Union[str, datetime], time_aggregation: str = "HOURS_1",
+                            value_type: str = "speed", strategy: str = "auto") -> pd.DataFrame:
+        """
+        Get historical values for several streets using the cheaper retrieval strategy.
+        
+        Args:
+            street_codes (List[str]): Street codes to retrieve
+            from_time (str|datetime): Start time
+            to_time (str|datetime): End time
+            time_aggregation (str): Time aggregation (MINUTES_5|15|30, HOURS_1, DAYS_1)
+            value_type (str): Value type (speed|probeCount|travelTime)
+            strategy (str): "auto", "time_series" or "time_slice"
+            
+        Returns:
+            DataFrame: Long format with columns streetCode, fdat and <value_type>
+            
+        Example:
+            history = client.get_streets_history(
+                ["ABC123", "DEF456"],
+                from_time="2024-10-21T00:00:00Z",
+                to_time="2024-10-22T00:00:00Z"
+            )
+        """
+        if strategy not in ("auto", "time_series", "time_slice"):
+            raise ValueError("Invalid strategy. Must be one of: ['auto', 'time_series', 'time_slice']")
+        if time_aggregation not in AGGREGATION_FREQUENCIES:
+            raise ValueError(f"Invalid time_aggregation. Must be one of: {list(AGGREGATION_FREQUENCIES)}")
+        
+        street_codes = list(dict.fromkeys(street_codes))
+        from_dt = self._parse_datetime(from_time)
+        to_dt = self._parse_datetime(to_time)
+        
+        if strategy == "auto":
+            costs = self.estimate_retrieval_costs(street_codes, from_dt, to_dt, time_aggregation, value_type)
+            strategy = costs['strategy']
+            logger.info(f"Retrieval plan for {len(street_codes)} streets: {strategy} "
+                        f"(time series ~{costs['time_series_seconds']:.1f}s, "
+                        f"time slice ~{costs['time_slice_seconds']:.1f}s)")
+        
+        if strategy == "time_series":
+            records = self._history_records_by_time_series(street_codes, from_dt, to_dt,
+                                                           time_aggregation, value_type)
+        else:
+            records = self._history_records_by_time_slice(street_codes, from_dt, to_dt, value_type)
+        
+        return self._to_long_format(records, time_aggregation, value_type)
+    
+    def _history_records_by_time_series(self, street_codes: List[str], from_dt: datetime, to_dt: datetime,
+                                        time_aggregation: str, value_type: str) -> List[Dict[str, Any]]:
+        """Collect (streetCode, fdat, value) records with one time series range per street."""
+        records = []
+        for street_code in street_codes:
+            frame = self.get_time_series_range(street_code, from_dt, to_dt, time_aggregation, value_type)
+            for fdat, value in zip(frame.get('fdat', []), frame.get(value_type, [])):
+                records.append({'streetCode': street_code, 'fdat': fdat, value_type: value})
+        return records
+    
+    def _history_records_by_time_slice(self, street_codes: List[str], from_dt: datetime, to_dt: datetime,
+                                       value_type: str) -> List[Dict[str, Any]]:
+        """Collect (streetCode, fdat, value) records by filtering hourly network time slices."""
+        wanted = set(street_codes)
+        network = self.get_network_size(from_dt)
+        page_size = network['max_elements_per_request']
+        records = []
+        
+        window_start = from_dt
+        while window_start < to_dt:
+            window_end = min(window_start + timedelta(hours=1), to_dt)
+            from_row = 1
+            while True:
+                data = self.get_time_slice_data(window_start, window_end, from_row=from_row,
+                                                to_row=from_row + page_size)
+                results = data.get('results') or []
+                for street in results:
+                    street_code = street.get('streetCode')
+                    if street_code not in wanted:
+                        continue
+                    for value in street.get('values') or []:
+                        records.append({'streetCode': street_code, 'fdat': value.get('fdat'),
+                                        value_type: value.get(value_type)})
+                
+                total = (data.get('metadata') or {}).get('totalElements') or network['total_elements']
+                from_row += page_size
+                if not results or from_row > total:
+                    break
+            window_start = window_end
+        return records
+    
+    def _to_long_format(self, records: List[Dict[str, Any]], time_aggregation: str,
+                        value_type: str) -> pd.DataFrame:
+        """Aggregate raw records to time_aggregation buckets in a common long format."""
+        columns = ['streetCode', 'fdat', value_type]
+        if not records:
+            return pd.DataFrame(columns=columns)
+        
+        df = pd.DataFrame.from_records(records, columns=columns)
+        df['fdat'] = pd.to_datetime(df['fdat'], utc=True).dt.floor(AGGREGATION_FREQUENCIES[time_aggregation])
+        df[value_type] = pd.to_numeric(df[value_type], errors='coerce')
+        return (df.groupby(['streetCode', 'fdat'], as_index=False)[value_type].mean()
+                  .sort_values(['streetCode', 'fdat'], ignore_index=True))
+    
+    def _observed_request_seconds(self, endpoint: str) -> float:
+        """Mean duration of recent calls to an endpoint, or its default estimate."""
+        durations = self.request_metrics.get(endpoint)
+        if durations:
+            return sum(durations) / len(durations)
+        return DEFAULT_REQUEST_SECONDS[endpoint]
+    
+    @staticmethod
+    def _parse_datetime(value: Union[str, datetime]) -> datetime:
+        """Parse an API time value into a naive UTC datetime."""
+        if isinstance(value, datetime):
+            dt = value
+        else:
+            dt = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        return dt
+
     # =============================================================================
     # UTILITY METHODS
     # =============================================================================
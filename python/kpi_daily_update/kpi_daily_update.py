@@ -14,6 +14,7 @@ Authentication:
 Output:
 - One CSV per run, containing rows for each KPI/timeStamp.
 - Includes both overallResult and (optionally) partial results (progressive) per timeStamp.
+- Optionally (--format parquet, needs pyarrow) a Parquet dataset partitioned by date (and template).
 
 Notes:
 - The script queries the *last 24 hours* relative to the time of execution (UTC by default).
@@ -23,10 +24,18 @@ Notes:
 import argparse
 import csv
 import datetime as dt
+import json
 import os
+import shutil
+import signal
 import sys
+import threading
 import time
-from typing import Dict, Any, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional
+from urllib.parse import quote
 
 try:
     import requests
@@ -39,10 +48,19 @@ try:
 except Exception:
     ZoneInfo = None
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for --format parquet
+    pa = None
+
 
 BASE_URL_DEFAULT = "https://api.ptvgroup.tech/kpieng/v1"
 INSTANCE_ALL_PATH = "/instance/all"
 RESULT_BY_IDS_PATH = "/result/by-kpi-ids"
+# Batches in a row that failed with service errors before the run is aborted as an API outage
+OUTAGE_BATCHES = 3
 
 
 def iso_z(dt_utc: dt.datetime) -> str:
@@ -50,35 +68,144 @@ def iso_z(dt_utc: dt.datetime) -> str:
     return dt_utc.replace(tzinfo=dt.timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
 
 
+class RateLimiter:
+    """Spaces out requests shared by several threads to at most max_rps per second."""
+
+    def __init__(self, max_rps: float):
+        self.interval = 1.0 / max_rps if max_rps and max_rps > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def create_session(pool_size: int = 1) -> "requests.Session":
+    """One keep-alive session whose connection pool is large enough for all workers."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def http_request(method: str, url: str, headers: Dict[str, str], json_body=None,
-                 timeout: int = 60, retries: int = 3, backoff: float = 1.7):
-    """HTTP request with retries and basic error surfacing."""
+                 timeout: int = 60, retries: int = 3, backoff: float = 1.7,
+                 session: Optional["requests.Session"] = None, rate_limiter: Optional[RateLimiter] = None,
+                 retry_if: Optional[Callable[[Exception], bool]] = None):
+    """HTTP request with retries and basic error surfacing.
+
+    Uses `session` (connection reuse) when given and waits on `rate_limiter` before every attempt.
+    Errors for which `retry_if` returns False are raised without retrying.
+    """
     last_exc = None
+    sender = session or requests
     for attempt in range(1, retries + 1):
         try:
-            resp = requests.request(method, url, headers=headers, json=json_body, timeout=timeout)
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            resp = sender.request(method, url, headers=headers, json=json_body, timeout=timeout)
             if resp.status_code >= 400:
                 raise RuntimeError(f"HTTP {resp.status_code} for {url}: {resp.text[:800]}")
             return resp
         except Exception as exc:
             last_exc = exc
-            if attempt < retries:
+            if attempt < retries and (retry_if is None or retry_if(exc)):
                 time.sleep(backoff ** attempt)
             else:
                 raise last_exc
 
 
-def get_instances(base_url: str, api_key: str) -> List[Dict[str, Any]]:
+def get_instances(base_url: str, api_key: str, session=None, rate_limiter=None) -> List[Dict[str, Any]]:
     url = base_url.rstrip("/") + INSTANCE_ALL_PATH
     headers = {"apiKey": api_key}
-    return http_request("GET", url, headers=headers).json()
+    return http_request("GET", url, headers=headers, session=session, rate_limiter=rate_limiter).json()
 
 
-def post_results_by_ids(base_url: str, api_key: str, kpi_ids: List[str], from_time_z: str, to_time_z: str):
+def post_results_response(base_url: str, api_key: str, kpi_ids: List[str], from_time_z: str, to_time_z: str,
+                          session=None, rate_limiter=None, retries: int = 3, retry_if=None):
     url = base_url.rstrip("/") + RESULT_BY_IDS_PATH
     headers = {"apiKey": api_key}
     payload = {"kpiIds": kpi_ids, "fromTime": from_time_z, "toTime": to_time_z}
-    return http_request("POST", url, headers=headers, json_body=payload).json()
+    return http_request("POST", url, headers=headers, json_body=payload, retries=retries,
+                        session=session, rate_limiter=rate_limiter, retry_if=retry_if)
+
+
+def post_results_by_ids(base_url: str, api_key: str, kpi_ids: List[str], from_time_z: str, to_time_z: str,
+                        session=None, rate_limiter=None):
+    return post_results_response(base_url, api_key, kpi_ids, from_time_z, to_time_z,
+                                 session, rate_limiter).json()
+
+
+def is_timeout_error(exc: Exception) -> bool:
+    """True for client-side timeouts and gateway/server timeout responses."""
+    if isinstance(exc, requests.exceptions.Timeout):
+        return True
+    return isinstance(exc, RuntimeError) and str(exc).startswith(("HTTP 408", "HTTP 413", "HTTP 504"))
+
+
+def is_auth_error(exc: Exception) -> bool:
+    """True for errors that affect every request (invalid or unauthorized API key)."""
+    return isinstance(exc, RuntimeError) and str(exc).startswith(("HTTP 401", "HTTP 403"))
+
+
+class ApiUnavailableError(RuntimeError):
+    """Raised when consecutive batches fail with connection errors or 5xx (API outage)."""
+
+
+def is_batch_error(exc: Exception) -> bool:
+    """True for errors the batch contents can cause (timeouts, 4xx other than auth); splitting may help."""
+    if is_timeout_error(exc):
+        return True
+    return isinstance(exc, RuntimeError) and str(exc).startswith("HTTP 4") and not is_auth_error(exc)
+
+
+class AdaptiveBatchSizer:
+    """Chooses how many KPI IDs go into the next request from observed response sizes and durations.
+
+    Each completed request gives a per-KPI cost (seconds and bytes). The next batch size aims at the
+    latency and payload budget, changing by at most a factor 2 per observation. Thread-safe.
+    """
+
+    def __init__(self, initial: int, target_seconds: float, target_bytes: int,
+                 min_size: int = 1, max_size: int = 500):
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.size = min(max(initial, self.min_size), self.max_size)
+        self._lock = threading.Lock()
+
+    def observe(self, n_ids: int, seconds: float, nbytes: int):
+        if n_ids <= 0:
+            return
+        per_id_seconds = max(seconds, 1e-3) / n_ids
+        per_id_bytes = max(nbytes, 1) / n_ids
+        ideal = min(self.target_seconds / per_id_seconds, self.target_bytes / per_id_bytes)
+        with self._lock:
+            new_size = int(min(max(ideal, self.size / 2), self.size * 2))
+            self.size = min(max(new_size, self.min_size), self.max_size)
+
+    def shrink(self, n_ids: int):
+        """A request with n_ids timed out: never send that many again."""
+        with self._lock:
+            self.size = max(self.min_size, min(self.size, n_ids // 2))
+
+    def iter_batches(self, ids: List[str]) -> Iterator[List[str]]:
+        """Slice ids lazily, so every batch uses the size learned so far."""
+        i = 0
+        while i < len(ids):
+            with self._lock:
+                n = self.size
+            yield ids[i:i + n]
+            i += n
 
 
 def safe_get(d: Dict[str, Any], *keys, default=None):
@@ -90,6 +217,17 @@ def safe_get(d: Dict[str, Any], *keys, default=None):
     return cur
 
 
+@lru_cache(maxsize=None)
+def get_zone(tz_name: str) -> dt.tzinfo:
+    """Timezone lookup, cached so each name is resolved only once per run."""
+    if ZoneInfo is None:
+        return dt.timezone.utc
+    try:
+        return ZoneInfo(tz_name)
+    except Exception:
+        return dt.timezone.utc
+
+
 def to_local(ts: str, tz_name: str) -> str:
     """Convert ISO timestamp to local ISO (best effort)."""
     try:
@@ -104,15 +242,16 @@ def to_local(ts: str, tz_name: str) -> str:
     except Exception:
         return ts
 
-    if ZoneInfo is None:
-        return dt_obj.astimezone(dt.timezone.utc).isoformat(timespec='seconds')
+    return dt_obj.astimezone(get_zone(tz_name)).isoformat(timespec='seconds')
 
-    try:
-        tz = ZoneInfo(tz_name)
-    except Exception:
-        tz = dt.timezone.utc
 
-    return dt_obj.astimezone(tz).isoformat(timespec='seconds')
+def to_local_batch(timestamps: Iterable[Optional[str]], tz_name: str) -> Dict[str, str]:
+    """Convert many ISO timestamps at once; returns {timestamp: local ISO}.
+
+    KPIs of one batch share the same timestamps, so each distinct value is converted only once.
+    Malformed values map to themselves, like to_local().
+    """
+    return {ts: to_local(ts, tz_name) for ts in set(timestamps) if ts}
 
 
 def chunked(lst: List[str], n: int):
@@ -120,7 +259,355 @@ def chunked(lst: List[str], n: int):
         yield lst[i:i+n]
 
 
-def main():
+FIELDNAMES = [
+    "run_timestamp_utc", "fromTime_utc", "toTime_utc",
+    "kpiId", "kpiName", "template", "unitOfMeasure", "direction",
+    "timeStamp_utc", "timeStamp_local",
+    "result_type", "progressive",
+    "value", "defaultValue", "unusualValue", "averageValue",
+]
+
+def parse_iso_z(ts: str) -> dt.datetime:
+    """Parse an ISO timestamp (with optional trailing Z) as an aware UTC datetime."""
+    dt_obj = dt.datetime.fromisoformat(ts[:-1] + "+00:00" if ts.endswith("Z") else ts)
+    if dt_obj.tzinfo is None:
+        dt_obj = dt_obj.replace(tzinfo=dt.timezone.utc)
+    return dt_obj.astimezone(dt.timezone.utc)
+
+
+def flatten_result(item: Dict[str, Any], inst_by_id: Dict[str, Dict[str, Any]], run_ts_utc: str,
+                   from_z: str, to_z: str, tz_name: str, include_partials: bool,
+                   local_by_ts: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+    """Yield the overall row and (optionally) the partial rows of one /result/by-kpi-ids item.
+
+    `local_by_ts` (from to_local_batch) provides pre-converted local timestamps.
+    """
+    kpi_id = item.get("kpiId")
+    ts = item.get("timeStamp")
+    inst = inst_by_id.get(kpi_id, {})
+    if not ts:
+        local_ts = None
+    elif local_by_ts is not None and ts in local_by_ts:
+        local_ts = local_by_ts[ts]
+    else:
+        local_ts = to_local(ts, tz_name)
+
+    base = {
+        "run_timestamp_utc": run_ts_utc,
+        "fromTime_utc": from_z,
+        "toTime_utc": to_z,
+
+        "kpiId": kpi_id,
+        "kpiName": inst.get("name"),
+        "template": inst.get("template"),
+        "unitOfMeasure": inst.get("unitOfMeasure"),
+        "direction": inst.get("direction"),
+
+        "timeStamp_utc": ts,
+        "timeStamp_local": local_ts,
+    }
+
+    overall = item.get("overallResult") or {}
+    yield {
+        **base,
+        "result_type": "overall",
+        "progressive": safe_get(overall, "progressive"),
+        "value": safe_get(overall, "value"),
+        "defaultValue": safe_get(overall, "defaultValue"),
+        "unusualValue": safe_get(overall, "unusualValue"),
+        "averageValue": safe_get(overall, "averageValue"),
+    }
+
+    if include_partials:
+        for r in (item.get("results") or []):
+            yield {
+                **base,
+                "result_type": "partial",
+                "progressive": r.get("progressive"),
+                "value": r.get("value"),
+                "defaultValue": r.get("defaultValue"),
+                "unusualValue": r.get("unusualValue"),
+                "averageValue": r.get("averageValue"),
+            }
+
+
+class CsvSink:
+    """Streams rows into a ';' separated CSV through a temp file, so readers never see a partial file."""
+
+    def __init__(self, out_path: str, tmp_path: Optional[str] = None):
+        self.out_path = out_path
+        self.tmp_path = tmp_path or out_path + ".tmp"
+        self.rows = 0
+        self._file = open(self.tmp_path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=FIELDNAMES, delimiter=";")
+        self._writer.writeheader()
+
+    def write(self, rows: Iterable[Dict[str, Any]]):
+        for row in rows:
+            self._writer.writerow(row)
+            self.rows += 1
+
+    def close(self):
+        """Close the temp file without publishing it."""
+        if not self._file.closed:
+            self._file.close()
+
+    def commit(self):
+        self.close()
+        os.replace(self.tmp_path, self.out_path)
+
+    def abort(self):
+        self.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def merge_into_partition(out_path: str, spool_path: str, refetched_from: Dict[str, dt.datetime]) -> int:
+    """Merge freshly fetched rows (spooled CSV) into a daily partition, streaming both files.
+
+    `refetched_from[kpiId]` is the earliest timestamp returned for that KPI in this run. Existing rows of
+    that KPI at or after it are superseded (late-arriving results) and dropped. Returns the number of
+    dropped rows.
+    """
+    sink = CsvSink(out_path)
+    dropped = 0
+    try:
+        if os.path.exists(out_path):
+            with open(out_path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f, delimiter=";"):
+                    since = refetched_from.get(row.get("kpiId"))
+                    ts = row.get("timeStamp_utc")
+                    if since is not None and ts and parse_iso_z(ts) >= since:
+                        dropped += 1
+                        continue
+                    sink.write((row,))
+        with open(spool_path, newline="", encoding="utf-8") as f:
+            sink.write(csv.DictReader(f, delimiter=";"))
+    except Exception:
+        sink.abort()
+        raise
+    sink.commit()
+    os.remove(spool_path)
+    return dropped
+
+
+def iter_in_order(executor: ThreadPoolExecutor, fn, jobs: Iterable, max_pending: int) -> Iterator:
+    """Like executor.map, but keeps at most max_pending jobs in flight so results cannot pile up."""
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(fn, job))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# Parquet column types: dictionary-encoded strings for repetitive labels, float32 for values
+PARQUET_TIMESTAMP_COLUMNS = {"run_timestamp_utc", "fromTime_utc", "toTime_utc", "timeStamp_utc"}
+PARQUET_DICTIONARY_COLUMNS = {"kpiId", "kpiName", "template", "unitOfMeasure", "direction", "result_type"}
+PARQUET_FLOAT32_COLUMNS = {"value", "defaultValue", "unusualValue", "averageValue"}
+HIVE_DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+class ParquetSink:
+    """Streams rows into a Hive-partitioned Parquet dataset: <root>/date=YYYY-MM-DD[/template=...]/.
+
+    Rows are buffered per partition and written as row groups of `row_group_size`, so memory stays
+    bounded. Files are written below `<root>.tmp` and only published by commit() or merge_into().
+    """
+
+    def __init__(self, root: str, partition_by_template: bool = False, row_group_size: int = 50000,
+                 part_name: str = "part-0.parquet"):
+        self.root = root
+        self.staging = root + ".tmp"
+        self.partition_by_template = partition_by_template
+        self.row_group_size = row_group_size
+        self.part_name = part_name
+        self.rows = 0
+        self.columns = [c for c in FIELDNAMES if not (partition_by_template and c == "template")]
+        self.schema = pa.schema([(c, self._column_type(c)) for c in self.columns])
+        self._buffers: Dict[str, Dict[str, list]] = {}
+        self._writers: Dict[str, Any] = {}
+        if os.path.exists(self.staging):
+            shutil.rmtree(self.staging)
+
+    @staticmethod
+    def _column_type(name: str):
+        if name in PARQUET_TIMESTAMP_COLUMNS:
+            return pa.timestamp("ms", tz="UTC")
+        if name in PARQUET_DICTIONARY_COLUMNS:
+            return pa.dictionary(pa.int32(), pa.string())
+        if name in PARQUET_FLOAT32_COLUMNS:
+            return pa.float32()
+        if name == "progressive":
+            return pa.float64()
+        return pa.string()
+
+    def _partition_of(self, row: Dict[str, Any]) -> str:
+        ts = row.get("timeStamp_utc")
+        try:
+            day = iso_z(parse_iso_z(ts))[:10] if ts else HIVE_DEFAULT_PARTITION
+        except ValueError:
+            day = HIVE_DEFAULT_PARTITION
+        parts = [f"date={day}"]
+        if self.partition_by_template:
+            template = row.get("template")
+            parts.append("template=" + (quote(str(template), safe="") if template else HIVE_DEFAULT_PARTITION))
+        return os.path.join(*parts)
+
+    def write(self, rows: Iterable[Dict[str, Any]]):
+        for row in rows:
+            partition = self._partition_of(row)
+            buf = self._buffers.get(partition)
+            if buf is None:
+                buf = self._buffers[partition] = {c: [] for c in self.columns}
+            for c in self.columns:
+                buf[c].append(row.get(c))
+            self.rows += 1
+            if len(buf["kpiId"]) >= self.row_group_size:
+                self._flush(partition)
+
+    def _to_table(self, buf: Dict[str, list]):
+        arrays = []
+        for field in self.schema:
+            values = buf[field.name]
+            if field.name in PARQUET_TIMESTAMP_COLUMNS:
+                arrays.append(self._timestamps(values, field.type))
+            elif field.name in PARQUET_DICTIONARY_COLUMNS:
+                strings = [None if v is None else str(v) for v in values]
+                arrays.append(pa.array(strings, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    @staticmethod
+    def _timestamps(values: list, ts_type):
+        strings = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+        try:
+            return strings.cast(ts_type)
+        except pa.ArrowInvalid:
+            parsed = []
+            for v in values:
+                try:
+                    parsed.append(parse_iso_z(v) if v else None)
+                except ValueError:
+                    parsed.append(None)
+            return pa.array(parsed, type=ts_type)
+
+    def _flush(self, partition: str):
+        buf = self._buffers.get(partition)
+        if not buf or not buf["kpiId"]:
+            return
+        writer = self._writers.get(partition)
+        if writer is None:
+            part_dir = os.path.join(self.staging, partition)
+            os.makedirs(part_dir, exist_ok=True)
+            writer = self._writers[partition] = pq.ParquetWriter(
+                os.path.join(part_dir, self.part_name), self.schema, compression="snappy")
+        writer.write_table(self._to_table(buf))
+        self._buffers[partition] = {c: [] for c in self.columns}
+
+    @property
+    def partitions(self) -> int:
+        return len(self._writers)
+
+    def close(self):
+        """Flush all buffers and close the staged files without publishing them."""
+        for partition in list(self._buffers):
+            self._flush(partition)
+        for writer in self._writers.values():
+            writer.close()
+        self._buffers.clear()
+
+    def commit(self):
+        """Publish the staged dataset as <root>, replacing a previous dataset with the same name."""
+        self.close()
+        os.makedirs(self.staging, exist_ok=True)
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.replace(self.staging, self.root)
+
+    def abort(self):
+        for writer in self._writers.values():
+            try:
+                writer.close()
+            except Exception:
+                pass
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    def merge_into(self, refetched_from: Dict[str, dt.datetime]) -> int:
+        """Merge the staged partitions into the dataset at <root> (incremental mode).
+
+        Existing rows of a KPI at or after `refetched_from[kpiId]` are superseded and dropped. Only the
+        partitions touched by this run are rewritten. Returns the number of dropped rows.
+        """
+        self.close()
+        dropped = 0
+        kpis = pa.array(list(refetched_from), type=pa.string())
+        thresholds = pa.array(list(refetched_from.values()), type=pa.timestamp("ms", tz="UTC"))
+
+        for partition in sorted(self._writers):
+            new_path = os.path.join(self.staging, partition, self.part_name)
+            new_table = pq.ParquetFile(new_path).read().cast(self.schema)
+            part_dir = os.path.join(self.root, partition)
+            old_files = sorted(os.path.join(part_dir, f) for f in os.listdir(part_dir)
+                               if f.endswith(".parquet")) if os.path.isdir(part_dir) else []
+            tables = []
+            for path in old_files:
+                old = pq.ParquetFile(path).read().cast(self.schema)
+                since = pc.take(thresholds, pc.index_in(old["kpiId"].cast(pa.string()), value_set=kpis))
+                superseded = pc.fill_null(pc.greater_equal(old["timeStamp_utc"], since), False)
+                dropped += pc.sum(superseded).as_py() or 0
+                tables.append(old.filter(pc.invert(superseded)))
+            tables.append(new_table)
+
+            os.makedirs(part_dir, exist_ok=True)
+            tmp_path = os.path.join(part_dir, self.part_name + ".tmp")
+            pq.write_table(pa.concat_tables(tables).unify_dictionaries(), tmp_path, compression="snappy")
+            for path in old_files:
+                os.remove(path)
+            os.replace(tmp_path, os.path.join(part_dir, self.part_name))
+
+        shutil.rmtree(self.staging, ignore_errors=True)
+        return dropped
+
+
+def write_failure_report(path: str, report: Dict[str, Any]):
+    """Write the JSON list of KPIs that could not be fetched, or remove a stale report."""
+    if not report["failed"]:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_failure_report(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    report.setdefault("failed", [])
+    return report
+
+
+def load_state(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {"watermarks": {}}
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+    state.setdefault("watermarks", {})
+    return state
+
+
+def save_state(path: str, state: Dict[str, Any]):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog="kpi daily update",
         description="Export last 24 hours of ALL KPI data from PTV Flows KPI API to ';' separated CSV."
@@ -137,123 +624,427 @@ def main():
                         help="Lookback window in hours (default: 24)")
     parser.add_argument("--batch-size", type=int, default=50,
                         help="How many KPI IDs per /result/by-kpi-ids request (default: 50)")
+    parser.add_argument("--adaptive-batch", action="store_true",
+                        help="Adapt KPI IDs per request to --target-seconds/--target-mb, starting at "
+                             "--batch-size; batches that time out are split")
+    parser.add_argument("--target-seconds", type=float, default=10.0,
+                        help="Adaptive batching: latency budget per request in seconds (default: 10)")
+    parser.add_argument("--target-mb", type=float, default=8.0,
+                        help="Adaptive batching: response size budget per request in MB (default: 8)")
+    parser.add_argument("--max-batch-size", type=int, default=500,
+                        help="Adaptive batching: upper limit of KPI IDs per request (default: 500)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Concurrent /result/by-kpi-ids requests over one pooled connection (default: 1)")
+    parser.add_argument("--max-rps", type=float, default=10.0,
+                        help="Maximum requests per second shared by all workers, 0 = unlimited (default: 10)")
     parser.add_argument("--include-partials", action="store_true",
                         help="Also export partial results (the 'results' array with progressive) in addition to overallResult")
     parser.add_argument("--filename", default=None,
-                        help="Optional output filename. Default: kpi_daily_update_<YYYY-MM-DD>_<HHmm>.csv")
+                        help="Optional output filename. Default: kpi_daily_update_<YYYY-MM-DD>_<HHmm>.csv "
+                             "(for parquet: dataset directory name without extension)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="Output format (default: csv). parquet writes a dataset partitioned by date")
+    parser.add_argument("--partition-by-template", action="store_true",
+                        help="Parquet only: also partition the dataset by KPI template")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch results newer than each KPI's watermark and merge them into "
+                             "per-day files kpi_daily_update_<YYYY-MM-DD>.csv (UTC date of timeStamp)")
+    parser.add_argument("--overlap-minutes", type=int, default=60,
+                        help="Incremental mode: re-fetch this much before the watermark to catch "
+                             "late-arriving results (default: 60)")
+    parser.add_argument("--state-file", default=None,
+                        help="Incremental mode: watermark file (default: <outdir>/kpi_daily_update_state.json)")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Like --incremental, but re-fetch the whole --hours lookback for every KPI and "
+                             "replace what is on disk")
+    parser.add_argument("--failure-report", default=None,
+                        help="JSON report of KPIs that failed after retries "
+                             "(default: <outdir>/kpi_daily_update_failures.json)")
+    parser.add_argument("--retry-failed", metavar="REPORT", default=None,
+                        help="Only fetch the KPIs listed in a failure report (full mode reuses its time window)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running and export on the --schedule entries, reusing the process and "
+                             "connection pool")
+    parser.add_argument("--schedule", action="append", default=[],
+                        help="Daemon mode: MODE@WHEN, MODE = full|incremental|reconcile, WHEN = interval "
+                             "(30s, 5m, 1h) or daily local time (HH:MM). Repeatable. "
+                             "Default: incremental@5m and reconcile@02:30")
+    parser.add_argument("--instances-ttl-minutes", type=float, default=60.0,
+                        help="Daemon mode: refresh the /instance/all list after this many minutes (default: 60)")
 
-    args = parser.parse_args()
+    return parser
 
-    if not args.api_key:
-        print("ERROR: API key missing. Provide --api-key or set env var PTV_API_KEY.", file=sys.stderr)
-        sys.exit(2)
 
+def run_export(args: argparse.Namespace, mode: str, session, rate_limiter: RateLimiter,
+               instances: List[Dict[str, Any]], sizer: Optional[AdaptiveBatchSizer] = None,
+               retry_report: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Run one export.
+
+    mode: "full" (one new file/dataset for the --hours lookback), "incremental" (from each KPI's
+    watermark, merged into the daily partitions) or "reconcile" (whole --hours lookback, merged into
+    the daily partitions).
+
+    A batch that still fails after its retries with a timeout or a 4xx error is bisected until the
+    failing KPIs are isolated; all other KPIs are exported and the failed ones are written to the
+    failure report. Connection errors and 5xx fail the whole batch without splitting, and
+    OUTAGE_BATCHES such batches in a row abort the run. With retry_report
+    (a previous failure report) only its KPIs are fetched; full mode reuses the reported time window.
+
+    Returns the failed KPIs.
+    """
     # Compute window in UTC
     to_dt = dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc)
     from_dt = to_dt - dt.timedelta(hours=args.hours)
+    if retry_report is not None and mode == "full":
+        from_dt = parse_iso_z(retry_report["fromTime_utc"])
+        to_dt = parse_iso_z(retry_report["toTime_utc"])
     from_z = iso_z(from_dt)
     to_z = iso_z(to_dt)
 
-    # List active KPIs
-    instances = get_instances(args.base_url, args.api_key) or []
+    workers = max(1, args.workers)
+    incremental = mode in ("incremental", "reconcile")
 
     # Build instance lookup
     inst_by_id: Dict[str, Dict[str, Any]] = {}
     kpi_ids: List[str] = []
+    retry_ids = {f.get("kpiId") for f in retry_report["failed"]} if retry_report is not None else None
     for inst in instances:
         kid = inst.get("kpiId")
-        if kid:
+        if kid and (retry_ids is None or kid in retry_ids):
             inst_by_id[kid] = inst
             kpi_ids.append(kid)
 
     if not kpi_ids:
         print("No active KPI instances found (instance/all returned none). Nothing to export.")
-        sys.exit(0)
+        return []
 
-    # Pull results in batches
-    all_results: List[Dict[str, Any]] = []
-    for batch in chunked(kpi_ids, max(1, args.batch_size)):
-        res = post_results_by_ids(args.base_url, args.api_key, batch, from_z, to_z) or []
+    os.makedirs(args.outdir, exist_ok=True)
+
+    # Request windows: one shared window, or per-KPI windows starting at watermark - overlap
+    state_path = args.state_file or os.path.join(args.outdir, "kpi_daily_update_state.json")
+    state = load_state(state_path) if incremental else {"watermarks": {}}
+    watermarks: Dict[str, str] = state["watermarks"]
+    overlap = dt.timedelta(minutes=max(0, args.overlap_minutes))
+
+    ids_by_from: Dict[str, List[str]] = {}
+    for kid in kpi_ids:
+        start = from_dt
+        if mode == "incremental" and kid in watermarks:
+            start = parse_iso_z(watermarks[kid]) - overlap
+        ids_by_from.setdefault(iso_z(start), []).append(kid)
+
+    def iter_jobs():
+        for batch_from in sorted(ids_by_from):
+            ids = ids_by_from[batch_from]
+            batches = sizer.iter_batches(ids) if sizer else chunked(ids, max(1, args.batch_size))
+            for batch in batches:
+                yield batch_from, batch
+
+    # Pull results in batches and stream each one straight to disk. Results are consumed in
+    # submission order (deterministic output) with a bounded number of batches in flight, so peak
+    # memory depends on --batch-size and --workers, not on the number of KPIs or the lookback.
+    failures: List[Dict[str, Any]] = []
+    failures_lock = threading.Lock()
+    service_failures = [0]   # batches in a row that failed with connection errors or 5xx
+
+    def record_failures(batch_from: str, batch: List[str], exc: Exception):
+        label = f"KPI {batch[0]}" if len(batch) == 1 else f"{len(batch)} KPIs ({batch[0]} .. {batch[-1]})"
+        print(f"FAILED {label}: {exc}", file=sys.stderr)
+        with failures_lock:
+            failures.extend({"kpiId": kid, "fromTime_utc": batch_from, "toTime_utc": to_z,
+                             "error": str(exc)[:500]} for kid in batch)
+
+    def fetch_ids(batch_from: str, batch: List[str]) -> List[Dict[str, Any]]:
+        started = time.monotonic()
+        try:
+            # Adaptive mode splits a batch that timed out instead of retrying it; other errors are retried
+            retry_if = (lambda exc: not is_timeout_error(exc)) if sizer and len(batch) > 1 else None
+            resp = post_results_response(args.base_url, args.api_key, batch, batch_from, to_z,
+                                         session, rate_limiter, retry_if=retry_if)
+        except Exception as exc:
+            if is_auth_error(exc):
+                raise
+            if not is_batch_error(exc):
+                # Connection errors and 5xx do not depend on the KPIs: splitting would only multiply the
+                # requests. Record the batch; several failed batches in a row mean the API is down.
+                record_failures(batch_from, batch, exc)
+                with failures_lock:
+                    service_failures[0] += 1
+                    outage = service_failures[0] >= OUTAGE_BATCHES
+                if outage:
+                    raise ApiUnavailableError(f"KPI API unavailable ({OUTAGE_BATCHES} batches in a row failed), "
+                                       f"aborting: {exc}") from exc
+                return []
+            if len(batch) == 1:
+                record_failures(batch_from, batch, exc)
+                return []
+            if sizer is not None and is_timeout_error(exc):
+                sizer.shrink(len(batch))
+            half = len(batch) // 2
+            reason = "Timeout" if is_timeout_error(exc) else "Rejected"
+            print(f"{reason} for {len(batch)} KPI IDs, splitting into {half} + {len(batch) - half}",
+                  file=sys.stderr)
+            return fetch_ids(batch_from, batch[:half]) + fetch_ids(batch_from, batch[half:])
+        with failures_lock:
+            service_failures[0] = 0
+        if sizer:
+            sizer.observe(len(batch), time.monotonic() - started, len(resp.content))
+        res = resp.json() or []
         # API returns a list of result objects
-        if isinstance(res, list):
-            all_results.extend(res)
-        else:
+        if not isinstance(res, list):
             # In unexpected case, keep it but avoid crash
-            all_results.append({"_unexpected": res, "kpiIds": batch})
+            res = [{"_unexpected": res, "kpiIds": batch}]
+        return res
+
+    def fetch_batch(job):
+        batch_from, batch = job
+        return batch_from, batch, fetch_ids(batch_from, batch)
 
-    # Prepare rows
     run_ts_utc = iso_z(to_dt)
-    rows = []
-
-    for item in all_results:
-        kpi_id = item.get("kpiId")
-        ts = item.get("timeStamp")
-        inst = inst_by_id.get(kpi_id, {})
-
-        base = {
-            "run_timestamp_utc": run_ts_utc,
-            "fromTime_utc": from_z,
-            "toTime_utc": to_z,
-
-            "kpiId": kpi_id,
-            "kpiName": inst.get("name"),
-            "template": inst.get("template"),
-            "unitOfMeasure": inst.get("unitOfMeasure"),
-            "direction": inst.get("direction"),
-
-            "timeStamp_utc": ts,
-            "timeStamp_local": to_local(ts, args.tz) if ts else None,
-        }
-
-        overall = item.get("overallResult") or {}
-        rows.append({
-            **base,
-            "result_type": "overall",
-            "progressive": safe_get(overall, "progressive"),
-            "value": safe_get(overall, "value"),
-            "defaultValue": safe_get(overall, "defaultValue"),
-            "unusualValue": safe_get(overall, "unusualValue"),
-            "averageValue": safe_get(overall, "averageValue"),
-        })
-
-        if args.include_partials:
-            for r in (item.get("results") or []):
-                rows.append({
-                    **base,
-                    "result_type": "partial",
-                    "progressive": r.get("progressive"),
-                    "value": r.get("value"),
-                    "defaultValue": r.get("defaultValue"),
-                    "unusualValue": r.get("unusualValue"),
-                    "averageValue": r.get("averageValue"),
-                })
+    report_path = args.failure_report or os.path.join(args.outdir, "kpi_daily_update_failures.json")
+
+    def failure_report() -> Dict[str, Any]:
+        failed = sorted(failures, key=lambda f: f["kpiId"])
+        return {"run_timestamp_utc": run_ts_utc, "mode": mode, "fromTime_utc": from_z, "toTime_utc": to_z,
+                "failed": failed}
+
+    def report_failures():
+        if failures:
+            print(f"WARNING - {len(failures)} KPI(s) failed, see {report_path} "
+                  f"(retry with --retry-failed {report_path})", file=sys.stderr)
+
+    def iter_batch_rows():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch_from, batch, res in iter_in_order(executor, fetch_batch, iter_jobs(), 2 * workers):
+                local_by_ts = to_local_batch((item.get("timeStamp") for item in res), args.tz)
+                for item in res:
+                    yield from flatten_result(item, inst_by_id, run_ts_utc, batch_from, to_z,
+                                              args.tz, args.include_partials, local_by_ts)
 
     # Output
-    os.makedirs(args.outdir, exist_ok=True)
-    if args.filename:
-        out_name = args.filename
+    if incremental:
+        refetched_from: Dict[str, dt.datetime] = {}
+
+        def iter_new_rows():
+            """Rows with a timestamp; tracks watermarks and the first re-fetched timestamp per KPI."""
+            for row in iter_batch_rows():
+                ts = row.get("timeStamp_utc")
+                if not ts:
+                    continue
+                ts_utc = parse_iso_z(ts)
+                kid = row.get("kpiId")
+                if kid and (kid not in refetched_from or ts_utc < refetched_from[kid]):
+                    refetched_from[kid] = ts_utc
+                if kid and (kid not in watermarks or ts_utc > parse_iso_z(watermarks[kid])):
+                    watermarks[kid] = iso_z(ts_utc)
+                yield ts_utc, row
+
+        if args.format == "parquet":
+            sink = ParquetSink(os.path.join(args.outdir, "kpi_daily_update"), args.partition_by_template)
+            try:
+                sink.write(row for _, row in iter_new_rows())
+            except Exception:
+                sink.abort()
+                raise
+            replaced = sink.merge_into(refetched_from)
+            total, parts, target = sink.rows, sink.partitions, sink.root
+        else:
+            spools: Dict[str, CsvSink] = {}
+            total = 0
+            try:
+                for ts_utc, row in iter_new_rows():
+                    day = iso_z(ts_utc)[:10]
+                    if day not in spools:
+                        day_path = os.path.join(args.outdir, f"kpi_daily_update_{day}.csv")
+                        spools[day] = CsvSink(day_path, day_path + ".new")
+                    spools[day].write((row,))
+                    total += 1
+            except Exception:
+                for spool in spools.values():
+                    spool.abort()
+                raise
+
+            replaced = 0
+            for day in sorted(spools):
+                spools[day].close()
+                replaced += merge_into_partition(spools[day].out_path, spools[day].tmp_path, refetched_from)
+            parts, target = len(spools), args.outdir
+
+        state["last_run_utc"] = run_ts_utc
+        save_state(state_path, state)
+        write_failure_report(report_path, failure_report())
+        print(f"OK - merged {total} rows ({total - replaced} new) for {len(kpi_ids) - len(failures)} KPIs into "
+              f"{parts} partition(s) in: {target}")
+        report_failures()
+        return failures
+
+    if retry_report is None:
+        default_name = f"kpi_daily_update_{dt.datetime.now():%Y-%m-%d_%H%M}"
     else:
-        local_now = dt.datetime.now().strftime("%Y-%m-%d_%H%M")
-        out_name = f"kpi_daily_update_{local_now}.csv"
+        # A retry only holds the failed KPIs and must not replace the export it completes
+        default_name = f"kpi_daily_update_{dt.datetime.now():%Y-%m-%d_%H%M%S}_retry"
+    if args.format == "parquet":
+        out_name = os.path.splitext(args.filename)[0] if args.filename else default_name
+    else:
+        out_name = args.filename or f"{default_name}.csv"
     out_path = os.path.join(args.outdir, out_name)
+    if retry_report is not None and os.path.exists(out_path):
+        print(f"ERROR: {out_path} already exists; choose another --filename for the retry.", file=sys.stderr)
+        sys.exit(2)
+    if args.format == "parquet":
+        sink = ParquetSink(out_path, args.partition_by_template)
+    else:
+        sink = CsvSink(out_path)
+
+    try:
+        sink.write(iter_batch_rows())
+    except Exception:
+        sink.abort()
+        raise
+    sink.commit()
+    write_failure_report(report_path, failure_report())
+    print(f"OK - exported {sink.rows} rows for {len(kpi_ids) - len(failures)} KPIs to: {out_path}")
+    report_failures()
+    return failures
+
+
+class InstanceCache:
+    """Keeps the /instance/all list and refreshes it once it is older than ttl_seconds."""
+
+    def __init__(self, args: argparse.Namespace, session, rate_limiter: RateLimiter, ttl_seconds: float):
+        self.args = args
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.ttl_seconds = ttl_seconds
+        self._instances: Optional[List[Dict[str, Any]]] = None
+        self._fetched_at = 0.0
+
+    def get(self) -> List[Dict[str, Any]]:
+        if self._instances is None or time.monotonic() - self._fetched_at >= self.ttl_seconds:
+            self._instances = get_instances(self.args.base_url, self.args.api_key,
+                                            self.session, self.rate_limiter) or []
+            self._fetched_at = time.monotonic()
+        return self._instances
+
+
+class Schedule:
+    """One daemon cadence: MODE@WHEN with WHEN an interval (30s, 5m, 1h) or a daily local time (HH:MM)."""
+
+    UNITS = {"s": 1, "m": 60, "h": 3600}
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        mode, sep, when = spec.partition("@")
+        if not sep or mode not in ("full", "incremental", "reconcile"):
+            raise ValueError(f"Invalid schedule '{spec}': expected MODE@WHEN with MODE full|incremental|reconcile")
+        self.mode = mode
+        self.interval: Optional[float] = None
+        self.at: Optional[dt.time] = None
+        try:
+            if ":" in when:
+                self.at = dt.datetime.strptime(when, "%H:%M").time()
+            else:
+                self.interval = float(when[:-1]) * self.UNITS[when[-1]]
+                if self.interval <= 0:
+                    raise ValueError
+        except (ValueError, KeyError, IndexError):
+            raise ValueError(f"Invalid schedule '{spec}': WHEN must look like 30s, 5m, 1h or HH:MM")
+        self.next_run = self._first_run(dt.datetime.now())
+
+    def _first_run(self, now: dt.datetime) -> dt.datetime:
+        if self.interval is not None:
+            return now
+        return self._next_daily(now)
+
+    def _next_daily(self, after: dt.datetime) -> dt.datetime:
+        candidate = dt.datetime.combine(after.date(), self.at)
+        return candidate if candidate > after else candidate + dt.timedelta(days=1)
+
+    def advance(self, now: dt.datetime):
+        """Plan the next run after now; interval slots stay on their grid (missed slots are skipped)."""
+        if self.interval is not None:
+            step = dt.timedelta(seconds=self.interval)
+            while self.next_run <= now:
+                self.next_run += step
+        else:
+            self.next_run = self._next_daily(now)
 
-    fieldnames = [
-        "run_timestamp_utc", "fromTime_utc", "toTime_utc",
-        "kpiId", "kpiName", "template", "unitOfMeasure", "direction",
-        "timeStamp_utc", "timeStamp_local",
-        "result_type", "progressive",
-        "value", "defaultValue", "unusualValue", "averageValue",
-    ]
-
-    tmp_path = out_path + ".tmp"
-    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=";")
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
 
-    os.replace(tmp_path, out_path)
-    print(f"OK - exported {len(rows)} rows for {len(kpi_ids)} KPIs to: {out_path}")
+def run_daemon(args: argparse.Namespace, session, rate_limiter: RateLimiter,
+               sizer: Optional[AdaptiveBatchSizer] = None):
+    """Run exports on all schedules in one warm process until interrupted (Ctrl+C or SIGTERM)."""
+    schedules = [Schedule(spec) for spec in (args.schedule or ["incremental@5m", "reconcile@02:30"])]
+    instances = InstanceCache(args, session, rate_limiter, args.instances_ttl_minutes * 60)
+    stop = threading.Event()
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    except ValueError:  # not in the main thread
+        pass
+
+    print(f"Daemon started with schedules: {', '.join(s.spec for s in schedules)}")
+    while not stop.is_set():
+        schedule = min(schedules, key=lambda s: s.next_run)
+        wait = (schedule.next_run - dt.datetime.now()).total_seconds()
+        if wait > 0:
+            stop.wait(wait)
+            continue
+
+        started = time.monotonic()
+        print(f"[{dt.datetime.now().isoformat(timespec='seconds')}] {schedule.spec}: starting")
+        try:
+            run_export(args, schedule.mode, session, rate_limiter, instances.get(), sizer)
+        except Exception as exc:
+            print(f"[{dt.datetime.now().isoformat(timespec='seconds')}] {schedule.spec}: FAILED - {exc}",
+                  file=sys.stderr)
+        print(f"[{dt.datetime.now().isoformat(timespec='seconds')}] {schedule.spec}: "
+              f"done in {time.monotonic() - started:.1f}s")
+        schedule.advance(dt.datetime.now())
+        sys.stdout.flush()
+    print("Daemon stopped")
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if not args.api_key:
+        print("ERROR: API key missing. Provide --api-key or set env var PTV_API_KEY.", file=sys.stderr)
+        sys.exit(2)
+
+    if args.format == "parquet" and pa is None:
+        print("Missing dependency for --format parquet: pyarrow. Install with: pip install pyarrow", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        for spec in args.schedule:
+            Schedule(spec)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    session = create_session(max(1, args.workers))
+    rate_limiter = RateLimiter(args.max_rps)
+    sizer = None
+    if args.adaptive_batch:
+        sizer = AdaptiveBatchSizer(args.batch_size, args.target_seconds, int(args.target_mb * 1024 * 1024),
+                                   max_size=args.max_batch_size)
+
+    try:
+        if args.daemon:
+            run_daemon(args, session, rate_limiter, sizer)
+        else:
+            mode = "reconcile" if args.reconcile else "incremental" if args.incremental else "full"
+            retry_report = load_failure_report(args.retry_failed) if args.retry_failed else None
+            # List active KPIs
+            instances = get_instances(args.base_url, args.api_key, session, rate_limiter) or []
+            if run_export(args, mode, session, rate_limiter, instances, sizer, retry_report):
+                sys.exit(3)
+    except KeyboardInterrupt:
+        print("Interrupted")
+    except ApiUnavailableError as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        session.close()
 
 
 if __name__ == "__main__":
@@ -16,10 +16,14 @@ import sys
 import os
 import json
 import csv
-from typing import Optional, List, Dict, Any
+import re
+import time
+from operator import attrgetter
+from typing import Optional, List, Dict, Any, Tuple
 import logging
 from datetime import datetime
 
+import numpy as np
 import requests
 import dataprv_traffic_realtime_data_pb2
 from google.protobuf.timestamp_pb2 import Timestamp
@@ -98,6 +102,97 @@ def fetch_realtime_data(api_key: str, endpoint: str, debug: bool = False) -> byt
         raise
 
 
+# Raw payloads saved by fetch_realtime_data(debug=True)
+RAW_RECORDING_PATTERN = re.compile(r'realtime_data_raw_(\d{8}_\d{6})\.bin$')
+
+
+def parse_replay_speed(text: str) -> float:
+    """Parses a replay speed: "1" (original pace), "10" (10x faster) or "max" (no waiting)."""
+    if text.strip().lower() == 'max':
+        return float('inf')
+    speed = float(text)
+    if speed <= 0:
+        raise ValueError("Replay speed must be positive or 'max'")
+    return speed
+
+
+class ReplaySource:
+    """
+    Replays recorded raw payloads (realtime_data_raw_<YYYYmmdd_HHMMSS>.bin) in recording order.
+    
+    The payloads are handed out at the pace they were recorded, scaled by speed: 1 is the
+    original pace, 10 is ten times faster and inf (see parse_replay_speed) does not wait.
+    Files with other names are ordered by their snapshot_date_time instead.
+    """
+    
+    def __init__(self, path: str, speed: float = 1.0):
+        if os.path.isdir(path):
+            names = [os.path.join(path, name) for name in os.listdir(path) if name.endswith('.bin')]
+        else:
+            names = [path]
+        recordings = ((self._recorded_at(name), name) for name in names)
+        self.recordings = sorted((recorded_at, name) for recorded_at, name in recordings if recorded_at is not None)
+        self.speed = speed
+        self._position = 0
+        self._started = None
+        if not self.recordings:
+            raise ValueError(f"No recorded payloads (*.bin) in {path}")
+        logger.info(f"Replaying {len(self.recordings)} recorded payloads from {path}")
+    
+    @staticmethod
+    def _recorded_at(path: str) -> Optional[datetime]:
+        """Recording time from the file name or the payload, None if the file cannot be read."""
+        match = RAW_RECORDING_PATTERN.search(os.path.basename(path))
+        if match:
+            return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+        try:
+            with open(path, 'rb') as f:
+                return read_snapshot_time(f.read()) or datetime.min
+        except Exception as e:
+            logger.error(f"Skipping unreadable recording {path}: {e}")
+            return None
+    
+    def __len__(self) -> int:
+        return len(self.recordings)
+    
+    def __iter__(self):
+        while True:
+            item = self.next()
+            if item is None:
+                return
+            yield item
+    
+    def next(self) -> Optional[Tuple[datetime, bytes]]:
+        """
+        Waits until the next payload is due and returns it. Recordings that cannot be read
+        are logged and skipped.
+        
+        Returns:
+            (recording time, raw protobuf data), or None when all payloads have been replayed
+        """
+        while self._position < len(self.recordings):
+            recorded_at, path = self.recordings[self._position]
+            if self._started is None:
+                self._started = time.monotonic()
+            elif self.speed != float('inf'):
+                offset = (recorded_at - self.recordings[0][0]).total_seconds() / self.speed
+                remaining = self._started + offset - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+            self._position += 1
+            try:
+                with open(path, 'rb') as f:
+                    return recorded_at, f.read()
+            except OSError as e:
+                logger.error(f"Skipping unreadable recording {path}: {e}")
+        return None
+    
+    def fetch(self) -> Optional[bytes]:
+        """Next payload (same contract as a download: raw bytes, None if nothing is left)."""
+        item = self.next()
+        return item[1] if item else None
+
+
 def parse_protobuf_data(data: bytes) -> dataprv_traffic_realtime_data_pb2.DataprvTrafficRealtimeDataProto:
     """
     Parses the protobuf message from binary data.
@@ -119,48 +214,554 @@ def parse_protobuf_data(data: bytes) -> dataprv_traffic_realtime_data_pb2.Datapr
         raise
 
 
-def filter_traffic_data(message, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+class TrafficColumns:
     """
-    Filters and extracts traffic data based on provided filters.
+    Street traffic of one snapshot stored column-wise, one NumPy array per field.
+    
+    olr_code is dictionary-encoded: olr_index holds, per street, the position of its
+    code in olr_codes. Snapshot time and timezone are stored once for the snapshot.
+    Columns that were not decoded (see scan_traffic_columns) are None.
+    """
+    
+    def __init__(self, ids: np.ndarray, from_node_ids: np.ndarray, speeds: np.ndarray,
+                 probe_counts: np.ndarray, olr_index: np.ndarray, olr_codes: List[str],
+                 snapshot_time: Optional[datetime] = None, timezone: Optional[str] = None):
+        self.ids = ids                      # int32
+        self.from_node_ids = from_node_ids  # int32
+        self.speeds = speeds                # float32, km/h
+        self.probe_counts = probe_counts    # int16
+        self.olr_index = olr_index          # int32, index into olr_codes
+        self.olr_codes = olr_codes
+        self.snapshot_time = snapshot_time
+        self.timezone = timezone
+    
+    def __len__(self) -> int:
+        for column in (self.ids, self.from_node_ids, self.speeds, self.probe_counts, self.olr_index):
+            if column is not None:
+                return len(column)
+        return 0
+    
+    def olr_code_array(self) -> np.ndarray:
+        """Returns the decoded olr_code of every street as an object array."""
+        return np.asarray(self.olr_codes, dtype=object)[self.olr_index]
+    
+    def take(self, selection: np.ndarray) -> 'TrafficColumns':
+        """
+        Returns the streets selected by a boolean mask or an index array.
+        
+        The olr_code dictionary is shared with this instance, not compacted.
+        """
+        def take(column):
+            return None if column is None else column[selection]
+        
+        return TrafficColumns(take(self.ids), take(self.from_node_ids), take(self.speeds),
+                              take(self.probe_counts), take(self.olr_index), self.olr_codes,
+                              self.snapshot_time, self.timezone)
+    
+    def to_records(self) -> List[Dict[str, Any]]:
+        """
+        Converts the columns to one dictionary per street (the format of filter_traffic_data).
+        
+        Returns:
+            List of street traffic records
+        """
+        timestamp = self.snapshot_time.isoformat() if self.snapshot_time else None
+        olr_codes = self.olr_codes
+        # float32 -> shortest decimal representation, so 43.7 stays 43.7 in CSV/JSON
+        speeds = self.speeds.astype(str).astype(np.float64).tolist()
+        return [
+            {
+                'street_id': street_id,
+                'from_node_id': from_node_id,
+                'speed_kmh': speed,
+                'olr_code': olr_codes[olr_index],
+                'timestamp': timestamp,
+                'timezone': self.timezone,
+                'probe_count': probe_count
+            }
+            for street_id, from_node_id, speed, olr_index, probe_count in zip(
+                self.ids.tolist(), self.from_node_ids.tolist(), speeds,
+                self.olr_index.tolist(), self.probe_counts.tolist())
+        ]
+
+
+def extract_traffic_columns(message) -> TrafficColumns:
+    """
+    Extracts the street traffic of a parsed message into preallocated NumPy arrays.
     
     Args:
         message: Parsed protobuf message
-        filters: Dictionary containing filter criteria
         
     Returns:
-        List of filtered street traffic data
+        TrafficColumns with one entry per street, in message order
     """
-    street_data = []
+    streets = list(message.street_traffic)
+    count = len(streets)
     
-    min_speed = filters.get('min_speed')
-    max_speed = filters.get('max_speed')
-    street_ids = filters.get('street_ids', [])
+    ids = np.fromiter(map(attrgetter('id'), streets), dtype=np.int32, count=count)
+    from_node_ids = np.fromiter(map(attrgetter('from_node_id'), streets), dtype=np.int32, count=count)
+    speeds = np.fromiter(map(attrgetter('speed_kmh'), streets), dtype=np.float32, count=count)
+    # probe_count is not reliable; clip instead of wrapping around in int16
+    probe_counts = np.fromiter(map(attrgetter('probe_count'), streets), dtype=np.int32, count=count)
+    probe_counts = np.clip(probe_counts, 0, np.iinfo(np.int16).max).astype(np.int16)
     
-    logger.info(f"Processing {len(message.street_traffic)} street records")
+    code_index: Dict[str, int] = {}
+    olr_index = np.fromiter((code_index.setdefault(code, len(code_index))
+                             for code in map(attrgetter('olr_code'), streets)),
+                            dtype=np.int32, count=count)
     
-    for street in message.street_traffic:
-        # Apply filters
-        if min_speed is not None and street.speed_kmh < min_speed:
-            continue
-        if max_speed is not None and street.speed_kmh > max_speed:
-            continue
-        if street_ids and street.id not in street_ids:
+    snapshot_time = message.snapshot_date_time.ToDatetime() if message.HasField('snapshot_date_time') else None
+    return TrafficColumns(ids, from_node_ids, speeds, probe_counts, olr_index, list(code_index),
+                          snapshot_time, message.timezone or None)
+
+
+# Field numbers of DataprvTrafficRealtimeDataProto and its StreetTraffic message
+_SNAPSHOT_FIELDS = {'timezone': 1, 'snapshot_date_time': 2, 'street_traffic': 3}
+STREET_FIELDS = {'id': 1, 'from_node_id': 2, 'speed_kmh': 3, 'probe_count': 5, 'olr_code': 6}
+DEFAULT_SCAN_FIELDS = ('id', 'from_node_id', 'speed_kmh')
+
+_WIRE_VARINT, _WIRE_FIXED64, _WIRE_LENGTH, _WIRE_FIXED32 = 0, 1, 2, 5
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Decodes one varint at pos; returns (value, position after it)."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+        if shift >= 70:
+            raise ValueError("Malformed varint in realtime payload")
+
+
+def _skip_field(data: bytes, pos: int, wire_type: int) -> int:
+    """Returns the position after a field value of the given wire type."""
+    if wire_type == _WIRE_VARINT:
+        return _read_varint(data, pos)[1]
+    if wire_type == _WIRE_FIXED64:
+        return pos + 8
+    if wire_type == _WIRE_LENGTH:
+        length, pos = _read_varint(data, pos)
+        return pos + length
+    if wire_type == _WIRE_FIXED32:
+        return pos + 4
+    raise ValueError(f"Unsupported wire type {wire_type} in realtime payload")
+
+
+def _gather_varints(buf: np.ndarray, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes one varint at each position of buf, vectorized over all positions.
+    
+    Returns:
+        (values as uint64, positions after each varint)
+    """
+    byte = buf[positions]
+    values = (byte & 0x7F).astype(np.uint64)
+    ends = positions + 1
+    # Most varints are a single byte; only continue with those that have more
+    pending = np.flatnonzero(byte >= 0x80)
+    shift = 7
+    while len(pending):
+        if shift >= 70:
+            raise ValueError("Malformed varint in realtime payload")
+        byte = buf[ends[pending]]
+        values[pending] |= (byte & 0x7F).astype(np.uint64) << np.uint64(shift)
+        ends[pending] += 1
+        pending = pending[byte >= 0x80]
+        shift += 7
+    return values, ends
+
+
+def _selection(mask: np.ndarray):
+    """Turns a boolean mask into an index for NumPy: None if empty, a full slice if all True."""
+    if mask.all():
+        return slice(None)
+    return mask if mask.any() else None
+
+
+def _scan_street_offsets(data: bytes) -> Tuple[np.ndarray, np.ndarray, str, Optional[datetime]]:
+    """
+    Walks the top level of a DataprvTrafficRealtimeDataProto without decoding the streets.
+    
+    Returns:
+        (start and end offset of every StreetTraffic body, timezone, snapshot time)
+    """
+    starts = []
+    append_start = starts.append
+    long_ends = {}
+    timezone = ''
+    snapshot_time = None
+    street_key = (_SNAPSHOT_FIELDS['street_traffic'] << 3) | _WIRE_LENGTH
+    pos = 0
+    size = len(data)
+    while pos < size:
+        key = data[pos]
+        if key == street_key:
+            # Fast path: street bodies are almost always shorter than 128 bytes (1-byte length)
+            length = data[pos + 1]
+            if length < 0x80:
+                pos += 2
+                append_start(pos)
+                pos += length
+            else:
+                length, pos = _read_varint(data, pos + 1)
+                long_ends[len(starts)] = pos + length
+                append_start(pos)
+                pos += length
             continue
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if field == _SNAPSHOT_FIELDS['timezone'] and wire_type == _WIRE_LENGTH:
+            length, pos = _read_varint(data, pos)
+            timezone = data[pos:pos + length].decode('utf-8')
+            pos += length
+        elif field == _SNAPSHOT_FIELDS['snapshot_date_time'] and wire_type == _WIRE_LENGTH:
+            length, pos = _read_varint(data, pos)
+            timestamp = Timestamp()
+            timestamp.ParseFromString(data[pos:pos + length])
+            snapshot_time = timestamp.ToDatetime()
+            pos += length
+        else:
+            pos = _skip_field(data, pos, wire_type)
+    if pos != size:
+        raise ValueError("Truncated realtime payload")
+    
+    starts = np.fromiter(starts, dtype=np.int64, count=len(starts))
+    # The 1-byte length sits right before each body; long lengths were recorded separately
+    ends = starts + np.frombuffer(data, dtype=np.uint8)[starts - 1]
+    for index, end in long_ends.items():
+        ends[index] = end
+    return starts, ends, timezone, snapshot_time
+
+
+def read_snapshot_time(data: bytes) -> Optional[datetime]:
+    """
+    Reads snapshot_date_time from a raw payload without walking the street list.
+    
+    The field is serialized before the streets, so this only looks at the first few bytes.
+    
+    Returns:
+        Snapshot time (naive UTC) or None if the payload has none
+    """
+    pos = 0
+    size = len(data)
+    while pos < size:
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if field == _SNAPSHOT_FIELDS['snapshot_date_time'] and wire_type == _WIRE_LENGTH:
+            length, pos = _read_varint(data, pos)
+            timestamp = Timestamp()
+            timestamp.ParseFromString(data[pos:pos + length])
+            return timestamp.ToDatetime()
+        pos = _skip_field(data, pos, wire_type)
+    return None
+
+
+def scan_traffic_columns(data: bytes, fields=DEFAULT_SCAN_FIELDS) -> TrafficColumns:
+    """
+    Decodes selected StreetTraffic fields straight from the protobuf wire format.
+    
+    Much faster than parse_protobuf_data + extract_traffic_columns: no protobuf objects
+    are created and the street bodies are decoded field by field for all streets at
+    once with NumPy. olr_code strings are only decoded when requested.
+    
+    Args:
+        data: Raw protobuf data (DataprvTrafficRealtimeDataProto)
+        fields: StreetTraffic fields to decode (see STREET_FIELDS)
+        
+    Returns:
+        TrafficColumns; columns of fields that were not requested are None
+    """
+    unknown = set(fields) - set(STREET_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown StreetTraffic field(s): {', '.join(sorted(unknown))}")
+    
+    starts, ends, timezone, snapshot_time = _scan_street_offsets(data)
+    count = len(starts)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    # proto3 omits fields with default values, so every column starts at its default
+    values = {name: np.zeros(count, dtype=np.uint64) for name in fields if name != 'olr_code'}
+    if 'speed_kmh' in fields:
+        values['speed_kmh'] = np.zeros(count, dtype=np.float64)
+    olr_starts = np.zeros(count, dtype=np.int64)
+    olr_lengths = np.zeros(count, dtype=np.int64)
+    
+    varint_fields = [(STREET_FIELDS[name], name) for name in values if name != 'speed_kmh']
+    # An all-default street is an empty body and keeps the default values
+    active = np.flatnonzero(starts < ends)
+    pos, ends = starts[active], ends[active]
+    # One pass per field position: every pass decodes the next field of all streets at once
+    while len(active):
+        keys, value_pos = _gather_varints(buf, pos)
+        numbers = keys >> np.uint64(3)
+        wire_types = keys & np.uint64(7)
+        next_pos = np.full_like(value_pos, -1)
+        
+        sel = _selection(wire_types == _WIRE_VARINT)
+        if sel is not None:
+            rows, of_number = active[sel], numbers[sel]
+            decoded, next_pos[sel] = _gather_varints(buf, value_pos[sel])
+            for number, name in varint_fields:
+                of_field = _selection(of_number == number)
+                if of_field is not None:
+                    values[name][rows[of_field]] = decoded[of_field]
+        
+        sel = _selection(wire_types == _WIRE_FIXED64)
+        if sel is not None:
+            at = value_pos[sel]
+            next_pos[sel] = at + 8
+            of_field = _selection(numbers[sel] == STREET_FIELDS['speed_kmh'])
+            if 'speed_kmh' in values and of_field is not None:
+                raw = buf[at[of_field][:, None] + np.arange(8)]
+                values['speed_kmh'][active[sel][of_field]] = raw.view('<f8').ravel()
+        
+        sel = _selection(wire_types == _WIRE_LENGTH)
+        if sel is not None:
+            lengths, body_pos = _gather_varints(buf, value_pos[sel])
+            lengths = lengths.astype(np.int64)
+            next_pos[sel] = body_pos + lengths
+            of_field = _selection(numbers[sel] == STREET_FIELDS['olr_code'])
+            if 'olr_code' in fields and of_field is not None:
+                rows = active[sel][of_field]
+                olr_starts[rows] = body_pos[of_field]
+                olr_lengths[rows] = lengths[of_field]
+        
+        sel = _selection(wire_types == _WIRE_FIXED32)
+        if sel is not None:
+            next_pos[sel] = value_pos[sel] + 4
+        
+        if (next_pos < 0).any():
+            raise ValueError("Unsupported wire type in realtime payload")
+        if (next_pos > ends).any():
+            raise ValueError("Truncated StreetTraffic record in realtime payload")
+        more = _selection(next_pos < ends)
+        if more is None:
+            break
+        active, pos, ends = active[more], next_pos[more], ends[more]
+    
+    def int32_column(name):
+        # int32 varints are sign-extended to 64 bits on the wire
+        return values[name].astype(np.int64).astype(np.int32) if name in values else None
+    
+    probe_counts = None
+    if 'probe_count' in values:
+        probe_counts = np.clip(values['probe_count'].astype(np.int64), 0, np.iinfo(np.int16).max).astype(np.int16)
+    
+    olr_index = None
+    olr_codes: List[str] = []
+    if 'olr_code' in fields:
+        code_index: Dict[bytes, int] = {}
+        olr_index = np.fromiter((code_index.setdefault(data[start:start + length], len(code_index))
+                                 for start, length in zip(olr_starts.tolist(), olr_lengths.tolist())),
+                                dtype=np.int32, count=count)
+        olr_codes = [code.decode('utf-8') for code in code_index]
+    
+    speeds = values['speed_kmh'].astype(np.float32) if 'speed_kmh' in values else None
+    return TrafficColumns(int32_column('id'), int32_column('from_node_id'), speeds, probe_counts,
+                          olr_index, olr_codes, snapshot_time, timezone or None)
+
+
+def make_street_keys(ids: np.ndarray, from_node_ids: np.ndarray) -> np.ndarray:
+    """
+    Combines (id, from_node_id) into one int64 key per street.
+    
+    A street id is shared by both directions of a road; together with from_node_id
+    it identifies one directed street.
+    """
+    return (ids.astype(np.int64) << 32) | (from_node_ids.astype(np.int64) & 0xFFFFFFFF)
+
+
+def split_street_keys(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse of make_street_keys: returns (ids, from_node_ids) as int32 arrays."""
+    return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.uint32).view(np.int32)
+
+
+class NetworkStreets:
+    """
+    Street attributes of the PTV Flows network needed by the realtime tools.
+    
+    Loaded from the CSV written by ptv_flows_downloader.py (network api folder):
+    the street key, free-flow speed and bounding box of every street.
+    """
+    
+    _NUMBER = re.compile(r'-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?')
+    
+    def __init__(self, keys: np.ndarray, free_flow_speeds: np.ndarray, bounds: np.ndarray):
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]                            # int64, sorted (see make_street_keys)
+        self.free_flow_speeds = free_flow_speeds[order]    # float32, km/h
+        self.bounds = bounds[order]                        # float64 (n, 4): min_lon, min_lat, max_lon, max_lat
+    
+    def __len__(self) -> int:
+        return len(self.keys)
+    
+    @classmethod
+    def from_csv(cls, path: str) -> 'NetworkStreets':
+        """
+        Loads the network CSV exported by ptv_flows_downloader.py.
+        
+        Args:
+            path: CSV with id, from_node_id, free_flow_speed_kmph and shape_wkt columns
             
-        street_record = {
-            'street_id': street.id,
-            'from_node_id': street.from_node_id,
-            'speed_kmh': street.speed_kmh,
-            'olr_code': street.olr_code,
-            'timestamp': message.snapshot_date_time.ToDatetime().isoformat() if message.snapshot_date_time else None,
-            'timezone': message.timezone if hasattr(message, 'timezone') else None
-        }
-        
-        # Add probe count if available
-        if hasattr(street, 'probe_count'):
-            street_record['probe_count'] = street.probe_count
-            
-        street_data.append(street_record)
+        Returns:
+            NetworkStreets
+        """
+        ids, from_node_ids, speeds, bounds = [], [], [], []
+        with open(path, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                coordinates = [float(value) for value in cls._NUMBER.findall(row.get('shape_wkt') or '')]
+                lons, lats = coordinates[0::2], coordinates[1::2]
+                if not lons:
+                    continue
+                ids.append(int(row['id']))
+                from_node_ids.append(int(row['from_node_id']))
+                speeds.append(float(row.get('free_flow_speed_kmph') or 0.0))
+                bounds.append((min(lons), min(lats), max(lons), max(lats)))
+        
+        logger.info(f"Loaded {len(ids)} network streets from {path}")
+        keys = make_street_keys(np.array(ids, dtype=np.int64), np.array(from_node_ids, dtype=np.int64))
+        return cls(keys, np.array(speeds, dtype=np.float32),
+                   np.array(bounds, dtype=np.float64).reshape(-1, 4))
+    
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Returns the network index of every street key, -1 for keys not in the network."""
+        index = np.searchsorted(self.keys, keys)
+        index[index == len(self.keys)] = 0
+        found = self.keys[index] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        return np.where(found, index, -1)
+    
+    def keys_in_bbox(self, bbox: Tuple[float, float, float, float]) -> np.ndarray:
+        """Returns the keys of all streets whose bounding box intersects bbox."""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        inside = ((self.bounds[:, 0] <= max_lon) & (self.bounds[:, 2] >= min_lon) &
+                  (self.bounds[:, 1] <= max_lat) & (self.bounds[:, 3] >= min_lat))
+        return self.keys[inside]
+
+
+def parse_street_selection(text: str) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """
+    Parses a comma-separated list of street ids and id:from_node_id pairs.
+    
+    Args:
+        text: e.g. "1234, 5678:91011"
+        
+    Returns:
+        (street ids, (id, from_node_id) pairs)
+    """
+    street_ids = []
+    street_keys = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if ':' in item:
+            street_id, from_node_id = item.split(':', 1)
+            street_keys.append((int(street_id), int(from_node_id)))
+        else:
+            street_ids.append(int(item))
+    return street_ids, street_keys
+
+
+def parse_street_key(text: str) -> Tuple[int, int]:
+    """
+    Parses one street given as id:from_node_id (both are needed to identify a direction).
+    
+    Args:
+        text: e.g. "1234:5678"
+        
+    Returns:
+        (id, from_node_id)
+    """
+    street_id, separator, from_node_id = text.strip().partition(':')
+    if not separator or not street_id.strip() or not from_node_id.strip():
+        raise ValueError(f"Street must be given as ID:FROM_NODE_ID, got '{text}'")
+    return int(street_id), int(from_node_id)
+
+
+def build_filter_mask(columns: TrafficColumns, filters: Dict[str, Any]) -> np.ndarray:
+    """
+    Evaluates all filters on the traffic columns in one vectorized pass.
+    
+    Supported filters (all optional; different filters are combined with AND):
+        min_speed, max_speed: speed bounds in km/h
+        speed_ranges: list of (min, max) km/h; the speed must be in at least one range
+        street_ids, street_keys: street ids and (id, from_node_id) pairs; a street must
+            match one of them
+        olr_prefixes: olr_code prefixes; the olr_code must start with one of them
+        bbox: (min_lon, min_lat, max_lon, max_lat); requires 'network' (NetworkStreets)
+    
+    Args:
+        columns: Street traffic of one snapshot
+        filters: Dictionary containing filter criteria
+        
+    Returns:
+        Boolean mask of the matching streets
+    """
+    mask = np.ones(len(columns), dtype=bool)
+    
+    if filters.get('min_speed') is not None:
+        mask &= columns.speeds >= filters['min_speed']
+    if filters.get('max_speed') is not None:
+        mask &= columns.speeds <= filters['max_speed']
+    if filters.get('speed_ranges'):
+        in_range = np.zeros(len(columns), dtype=bool)
+        for low, high in filters['speed_ranges']:
+            in_range |= (columns.speeds >= low) & (columns.speeds <= high)
+        mask &= in_range
+    
+    street_ids = filters.get('street_ids')
+    street_keys = filters.get('street_keys')
+    if street_ids or street_keys:
+        selected = np.zeros(len(columns), dtype=bool)
+        if street_ids:
+            # ids typed at a prompt arrive as strings
+            selected |= np.isin(columns.ids, np.array([int(i) for i in street_ids], dtype=np.int64))
+        if street_keys:
+            keys = make_street_keys(columns.ids, columns.from_node_ids)
+            wanted = np.array([(street_id << 32) | (from_node_id & 0xFFFFFFFF)
+                               for street_id, from_node_id in street_keys], dtype=np.int64)
+            selected |= np.isin(keys, wanted)
+        mask &= selected
+    
+    if filters.get('olr_prefixes'):
+        if columns.olr_index is None:
+            raise ValueError("olr_code filter needs the olr_code column")
+        prefixes = tuple(filters['olr_prefixes'])
+        # Test each distinct code once, then map the result to the streets
+        matching_codes = np.fromiter((code.startswith(prefixes) for code in columns.olr_codes),
+                                     dtype=bool, count=len(columns.olr_codes))
+        mask &= matching_codes[columns.olr_index]
+    
+    if filters.get('bbox'):
+        network = filters.get('network')
+        if network is None:
+            raise ValueError("Bounding box filter needs the network (see NetworkStreets)")
+        keys = make_street_keys(columns.ids, columns.from_node_ids)
+        mask &= np.isin(keys, network.keys_in_bbox(filters['bbox']))
+    
+    return mask
+
+
+def filter_traffic_data(message, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Filters and extracts traffic data based on provided filters.
+    
+    Args:
+        message: Parsed protobuf message, or TrafficColumns with all fields decoded
+        filters: Dictionary containing filter criteria (see build_filter_mask)
+        
+    Returns:
+        List of filtered street traffic data
+    """
+    columns = message if isinstance(message, TrafficColumns) else extract_traffic_columns(message)
+    
+    logger.info(f"Processing {len(columns)} street records")
+    
+    street_data = columns.take(build_filter_mask(columns, filters)).to_records()
     
     logger.info(f"Filtered to {len(street_data)} records")
     return street_data
@@ -216,10 +817,198 @@ def save_to_json(data: List[Dict[str, Any]], output_path: str):
         raise
 
 
-def get_filtering_options() -> Dict[str, Any]:
+EXPORT_COLUMNS = ['street_id', 'from_node_id', 'speed_kmh', 'olr_code', 'timestamp', 'timezone', 'probe_count']
+EXPORT_CHUNK_SIZE = 65536
+
+
+def _export_chunks(columns: TrafficColumns, chunk_size: int):
+    """Yields (start, stop) row ranges of at most chunk_size streets."""
+    for start in range(0, len(columns), chunk_size):
+        yield start, min(start + chunk_size, len(columns))
+
+
+def _speed_text(speeds: np.ndarray, missing: str) -> np.ndarray:
+    """float32 speeds as shortest decimal strings (43.7 stays 43.7); NaN becomes `missing`."""
+    text = speeds.astype(str)
+    text[np.isnan(speeds)] = missing
+    return text
+
+
+def _csv_field(value: str) -> str:
+    """Quotes a CSV field the way csv.writer does (QUOTE_MINIMAL)."""
+    if any(char in value for char in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def write_csv_stream(columns: TrafficColumns, output_path: str, chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """
+    Writes traffic columns to CSV in chunks, without building a record per street.
+    
+    Produces the same columns as save_to_csv. Memory use is bounded by chunk_size.
+    
+    Args:
+        columns: Traffic columns with all fields decoded
+        output_path: Output file path
+        chunk_size: Streets converted to text at a time
+        
+    Returns:
+        Number of rows written
+    """
+    # Strings are quoted once per distinct value; rows are then joined like csv.writer would
+    olr_codes = np.array([_csv_field(code) for code in columns.olr_codes], dtype=object)
+    suffix = ',' + _csv_field(columns.snapshot_time.isoformat() if columns.snapshot_time else '') \
+             + ',' + _csv_field(columns.timezone or '') + ','
+    with open(output_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as csvfile:
+        csvfile.write(','.join(EXPORT_COLUMNS) + '\r\n')
+        for start, stop in _export_chunks(columns, chunk_size):
+            csvfile.writelines(
+                f'{street_id},{from_node_id},{speed},{olr}{suffix}{probe_count}\r\n'
+                for street_id, from_node_id, speed, olr, probe_count in zip(
+                    columns.ids[start:stop].tolist(), columns.from_node_ids[start:stop].tolist(),
+                    _speed_text(columns.speeds[start:stop], '').tolist(),
+                    olr_codes[columns.olr_index[start:stop]].tolist(),
+                    columns.probe_counts[start:stop].tolist()))
+    logger.info(f"Saved {len(columns)} records to {output_path}")
+    return len(columns)
+
+
+def write_ndjson_stream(columns: TrafficColumns, output_path: str, chunk_size: int = EXPORT_CHUNK_SIZE,
+                        as_array: bool = False) -> int:
+    """
+    Writes traffic columns as newline-delimited JSON (one record per line) in chunks.
+    
+    Strings are JSON-encoded once per distinct value (olr_code dictionary, timestamp,
+    timezone) instead of once per street.
+    
+    Args:
+        columns: Traffic columns with all fields decoded
+        output_path: Output file path
+        chunk_size: Streets converted to text at a time
+        as_array: Wrap the records in a JSON array (a regular .json file) instead of NDJSON
+        
+    Returns:
+        Number of records written
+    """
+    olr_json = np.array([json.dumps(code, ensure_ascii=False) for code in columns.olr_codes], dtype=object)
+    suffix = (', "timestamp": ' + json.dumps(columns.snapshot_time.isoformat() if columns.snapshot_time else None)
+              + ', "timezone": ' + json.dumps(columns.timezone, ensure_ascii=False) + ', "probe_count": ')
+    separator = ',\n' if as_array else '\n'
+    
+    with open(output_path, 'w', encoding='utf-8', buffering=1 << 20) as jsonfile:
+        if as_array:
+            jsonfile.write('[\n')
+        for start, stop in _export_chunks(columns, chunk_size):
+            lines = [
+                f'{{"street_id": {street_id}, "from_node_id": {from_node_id}, "speed_kmh": {speed}, '
+                f'"olr_code": {olr}{suffix}{probe_count}}}'
+                for street_id, from_node_id, speed, olr, probe_count in zip(
+                    columns.ids[start:stop].tolist(), columns.from_node_ids[start:stop].tolist(),
+                    _speed_text(columns.speeds[start:stop], 'null').tolist(),
+                    olr_json[columns.olr_index[start:stop]].tolist(),
+                    columns.probe_counts[start:stop].tolist())
+            ]
+            if start:
+                jsonfile.write(separator)
+            jsonfile.write(separator.join(lines))
+        jsonfile.write('\n]\n' if as_array else '\n')
+    logger.info(f"Saved {len(columns)} records to {output_path}")
+    return len(columns)
+
+
+def write_parquet_stream(columns: TrafficColumns, output_path: str, chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """
+    Writes traffic columns to Parquet, one row group per chunk (requires pyarrow).
+    
+    olr_code is written dictionary-encoded straight from the column's code dictionary,
+    so every distinct code is stored once per row group.
+    
+    Args:
+        columns: Traffic columns with all fields decoded
+        output_path: Output file path
+        chunk_size: Streets per row group
+        
+    Returns:
+        Number of rows written
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow: pip install pyarrow")
+    
+    schema = pa.schema([
+        ('street_id', pa.int32()),
+        ('from_node_id', pa.int32()),
+        ('speed_kmh', pa.float32()),
+        ('olr_code', pa.dictionary(pa.int32(), pa.string())),
+        ('timestamp', pa.timestamp('s', tz='UTC')),
+        ('timezone', pa.dictionary(pa.int8(), pa.string())),
+        ('probe_count', pa.int16()),
+    ])
+    olr_dictionary = pa.array(columns.olr_codes, type=pa.string())
+    timezone_dictionary = pa.array([columns.timezone], type=pa.string())
+    timestamp = np.datetime64(columns.snapshot_time, 's') if columns.snapshot_time else np.datetime64('NaT', 's')
+    
+    with pq.ParquetWriter(output_path, schema, use_dictionary=['olr_code', 'timezone'],
+                          compression='zstd') as writer:
+        for start, stop in _export_chunks(columns, chunk_size):
+            count = stop - start
+            batch = pa.record_batch([
+                pa.array(columns.ids[start:stop], type=pa.int32()),
+                pa.array(columns.from_node_ids[start:stop], type=pa.int32()),
+                pa.array(columns.speeds[start:stop], type=pa.float32()),
+                pa.DictionaryArray.from_arrays(pa.array(columns.olr_index[start:stop], type=pa.int32()),
+                                               olr_dictionary),
+                pa.array(np.full(count, timestamp), type=pa.timestamp('s', tz='UTC')),
+                pa.DictionaryArray.from_arrays(pa.array(np.zeros(count, dtype=np.int8)), timezone_dictionary),
+                pa.array(columns.probe_counts[start:stop], type=pa.int16()),
+            ], schema=schema)
+            writer.write_batch(batch)
+    logger.info(f"Saved {len(columns)} records to {output_path}")
+    return len(columns)
+
+
+def write_json_stream(columns: TrafficColumns, output_path: str, chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """Writes traffic columns as a JSON array of records (one per line), in chunks."""
+    return write_ndjson_stream(columns, output_path, chunk_size, as_array=True)
+
+
+# Streaming writer per export format (the format is also the file extension)
+EXPORT_WRITERS = {
+    'csv': write_csv_stream,
+    'json': write_json_stream,
+    'ndjson': write_ndjson_stream,
+    'parquet': write_parquet_stream,
+}
+
+
+def parse_bbox(text: str) -> Tuple[float, float, float, float]:
+    """Parses "min_lon,min_lat,max_lon,max_lat"."""
+    coords = [float(value) for value in text.split(',')]
+    if len(coords) != 4:
+        raise ValueError('Expected 4 comma-separated numeric values: min_lon,min_lat,max_lon,max_lat')
+    min_lon, min_lat, max_lon, max_lat = coords
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise ValueError('min values must be strictly less than max values')
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_speed_range(text: str) -> Tuple[float, float]:
+    """Parses "MIN-MAX" (km/h); either side may be empty."""
+    low, sep, high = text.partition('-')
+    if not sep:
+        raise ValueError(f"Invalid speed range '{text}', expected MIN-MAX")
+    return float(low) if low.strip() else float('-inf'), float(high) if high.strip() else float('inf')
+
+
+def get_filtering_options(with_bbox: bool = False) -> Dict[str, Any]:
     """
     Prompts user for filtering options.
     
+    Args:
+        with_bbox: Also ask for a bounding box (needs the network)
+        
     Returns:
         Dictionary containing filter criteria
     """
@@ -239,9 +1028,18 @@ def get_filtering_options() -> Dict[str, Any]:
             filters['max_speed'] = float(max_speed_input)
             
         # Street ID filter
-        street_ids_input = input("Street IDs (comma-separated): ").strip()
+        street_ids_input = input("Street IDs or id:from_node_id pairs (comma-separated): ").strip()
         if street_ids_input:
-            filters['street_ids'] = [id.strip() for id in street_ids_input.split(',')]
+            filters['street_ids'], filters['street_keys'] = parse_street_selection(street_ids_input)
+        
+        olr_input = input("OpenLR code prefixes (comma-separated): ").strip()
+        if olr_input:
+            filters['olr_prefixes'] = [prefix.strip() for prefix in olr_input.split(',') if prefix.strip()]
+        
+        if with_bbox:
+            bbox_input = input("Bounding box (min_lon,min_lat,max_lon,max_lat): ").strip()
+            if bbox_input:
+                filters['bbox'] = parse_bbox(bbox_input)
             
         if filters:
             logger.info(f"Applied filters: {filters}")
@@ -263,70 +1061,122 @@ def main():
                        help='API endpoint URL (if not provided, will prompt user)')
     parser.add_argument('--output-dir', type=str, default='.',
                        help='Output directory for files (default: current directory)')
-    parser.add_argument('--format', type=str, choices=['csv', 'json', 'both'], default='both',
-                       help='Output format (default: both)')
+    parser.add_argument('--format', type=str, choices=['csv', 'json', 'ndjson', 'parquet', 'both'], default='both',
+                       help='Output format; both = csv and json (default: both)')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                       help=f'Streets serialized at a time when exporting (default: {EXPORT_CHUNK_SIZE})')
     parser.add_argument('--debug', action='store_true',
                        help='Enable debug mode (saves raw downloaded data)')
+    parser.add_argument('--replay', type=str,
+                       help='Export recorded payloads (a realtime_data_raw_*.bin file or a directory of them, '
+                            'see --debug) instead of downloading')
+    parser.add_argument('--replay-speed', type=parse_replay_speed, default=float('inf'),
+                       help='Replay pace: 1 = as recorded, 10 = ten times faster, max = no waiting (default: max)')
     parser.add_argument('--no-filter', action='store_true',
                        help='Skip interactive filtering options')
+    parser.add_argument('--speed-range', type=str, action='append',
+                       help='Keep speeds in MIN-MAX km/h, e.g. 0-30 (repeatable; skips interactive filtering)')
+    parser.add_argument('--streets', type=str,
+                       help='Street IDs and/or id:from_node_id pairs, comma-separated (skips interactive filtering)')
+    parser.add_argument('--olr-prefix', type=str, action='append',
+                       help='Keep streets whose olr_code starts with this prefix (repeatable)')
+    parser.add_argument('--bbox', type=str,
+                       help='Bounding box min_lon,min_lat,max_lon,max_lat (requires --network)')
+    parser.add_argument('--network', type=str,
+                       help='Network CSV exported by ptv_flows_downloader.py (for --bbox)')
     
     args = parser.parse_args()
     
-    # Handle API key
-    default_api_key = "change_me_to_your_api_key"
-    api_key = args.api_key or default_api_key
-    
-    if api_key == default_api_key:
-        logger.warning("Using default placeholder API key. Please provide your actual API key using --api-key")
-        logger.warning("Get your API key from: https://ptvgroup.tech/flows/")
+    # Filters given on the command line replace the interactive prompt
+    cli_filters: Dict[str, Any] = {}
+    try:
+        if args.speed_range:
+            cli_filters['speed_ranges'] = [parse_speed_range(value) for value in args.speed_range]
+        if args.streets:
+            cli_filters['street_ids'], cli_filters['street_keys'] = parse_street_selection(args.streets)
+        if args.olr_prefix:
+            cli_filters['olr_prefixes'] = args.olr_prefix
+        if args.bbox:
+            if not args.network:
+                parser.error('--bbox requires --network')
+            cli_filters['bbox'] = parse_bbox(args.bbox)
+    except ValueError as e:
+        parser.error(str(e))
     
-    # Handle endpoint
-    endpoint = args.endpoint or get_api_endpoint_from_user()
+    # Handle API key and endpoint (not needed when replaying recordings)
+    if not args.replay:
+        default_api_key = "change_me_to_your_api_key"
+        api_key = args.api_key or default_api_key
+        
+        if api_key == default_api_key:
+            logger.warning("Using default placeholder API key. Please provide your actual API key using --api-key")
+            logger.warning("Get your API key from: https://ptvgroup.tech/flows/")
+        
+        endpoint = args.endpoint or get_api_endpoint_from_user()
     
     # Create output directory
     os.makedirs(args.output_dir, exist_ok=True)
     
     try:
-        # Fetch real-time data
-        logger.info("Fetching real-time traffic data...")
-        data = fetch_realtime_data(api_key, endpoint, debug=args.debug)
-        
-        # Parse protobuf data
-        logger.info("Parsing protobuf data...")
-        message = parse_protobuf_data(data)
-        
-        # Get filtering options
-        filters = {} if args.no_filter else get_filtering_options()
-        
-        # Filter and extract data
-        logger.info("Processing traffic data...")
-        traffic_data = filter_traffic_data(message, filters)
-        
-        if not traffic_data:
-            logger.error("No traffic data found matching the criteria. Exiting.")
-            sys.exit(1)
-        
-        # Generate output file names
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Save in requested formats
-        if args.format in ['csv', 'both']:
-            csv_path = os.path.join(args.output_dir, f"ptv_flows_realtime_{timestamp}.csv")
-            logger.info("Saving to CSV...")
-            save_to_csv(traffic_data, csv_path)
-        
-        if args.format in ['json', 'both']:
-            json_path = os.path.join(args.output_dir, f"ptv_flows_realtime_{timestamp}.json")
-            logger.info("Saving to JSON...")
-            save_to_json(traffic_data, json_path)
+        if args.replay:
+            # Recorded payloads (--debug) instead of a download; files are named after the recording time
+            source = ReplaySource(args.replay, args.replay_speed)
+            payloads = ((recorded_at.strftime("%Y%m%d_%H%M%S"), data) for recorded_at, data in source)
+        else:
+            # Fetch real-time data
+            logger.info("Fetching real-time traffic data...")
+            data = fetch_realtime_data(api_key, endpoint, debug=args.debug)
+            payloads = [(datetime.now().strftime("%Y%m%d_%H%M%S"), data)]
         
-        logger.info("Processing completed successfully!")
-        logger.info(f"Processed {len(traffic_data)} traffic records")
+        filters = None
+        exported = 0
+        for timestamp, data in payloads:
+            # Decode the street traffic straight into columns (no protobuf objects per street)
+            logger.info("Parsing protobuf data...")
+            columns = scan_traffic_columns(data, fields=tuple(STREET_FIELDS))
+            
+            # Get filtering options (once, also when replaying several payloads)
+            if filters is None:
+                if args.no_filter:
+                    filters = {}
+                elif cli_filters:
+                    filters = cli_filters
+                    logger.info(f"Applied filters: {filters}")
+                else:
+                    filters = get_filtering_options(with_bbox=bool(args.network))
+                if filters.get('bbox'):
+                    filters['network'] = NetworkStreets.from_csv(args.network)
+            
+            # Filter the columns; records are only built while writing, chunk by chunk
+            logger.info("Processing traffic data...")
+            logger.info(f"Processing {len(columns)} street records")
+            traffic_data = columns.take(build_filter_mask(columns, filters))
+            logger.info(f"Filtered to {len(traffic_data)} records")
+            
+            if not len(traffic_data):
+                if args.replay:
+                    logger.warning(f"No traffic data matching the criteria in the payload recorded {timestamp}")
+                    continue
+                logger.error("No traffic data found matching the criteria. Exiting.")
+                sys.exit(1)
+            
+            # Save in requested formats
+            formats = ['csv', 'json'] if args.format == 'both' else [args.format]
+            for output_format in formats:
+                output_path = os.path.join(args.output_dir, f"ptv_flows_realtime_{timestamp}.{output_format}")
+                logger.info(f"Saving to {output_format.upper()}...")
+                EXPORT_WRITERS[output_format](traffic_data, output_path, chunk_size=args.chunk_size)
+            exported += 1
+            
+            logger.info("Processing completed successfully!")
+            logger.info(f"Processed {len(traffic_data)} traffic records")
+            
+            # Display summary statistics
+            speeds = traffic_data.speeds
+            logger.info(f"Speed statistics - Min: {np.nanmin(speeds):.1f} km/h, Max: {np.nanmax(speeds):.1f} km/h, Avg: {np.nanmean(speeds):.1f} km/h")
         
-        # Display summary statistics
-        if traffic_data:
-            speeds = [record['speed_kmh'] for record in traffic_data]
-            logger.info(f"Speed statistics - Min: {min(speeds):.1f} km/h, Max: {max(speeds):.1f} km/h, Avg: {sum(speeds)/len(speeds):.1f} km/h")
+        if args.replay:
+            logger.info(f"Exported {exported} of {len(source)} recorded payloads")
         
     except KeyboardInterrupt:
         logger.info("Operation cancelled by user")
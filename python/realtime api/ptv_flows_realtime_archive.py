@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""
+PTV Flows Realtime Snapshot Archive
+
+Append-only, columnar storage for the speeds of consecutive realtime snapshots, used by
+ptv_flows_realtime_monitor.py (--archive). Street keys are stored once; every snapshot adds
+one speed row. Rows are grouped into chunks, and a full chunk is compressed in blocks of
+streets so one street can be read without decompressing the whole network.
+
+Layout of an archive directory:
+    keys.i64            street keys (see make_street_keys), append-only
+    times.i64           snapshot times (UTC epoch seconds), one per snapshot, append-only
+    open.f32            rows of the chunk that is being filled (uncompressed)
+    chunk_NNNNNN.bin    sealed chunks: zlib-compressed street blocks
+    index.json          chunk directory (time range, width and block offsets per chunk)
+
+Usage:
+    python ptv_flows_realtime_archive.py ARCHIVE_DIR street ID:FROM_NODE_ID [--hours 3]
+    python ptv_flows_realtime_archive.py ARCHIVE_DIR network [--at 2025-10-09T08:54:00] [--output FILE]
+"""
+
+import argparse
+import bisect
+import csv
+import json
+import os
+import sys
+import time
+import zlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from ptv_flows_realtime import make_street_keys, split_street_keys, parse_street_key
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SPEED_DTYPE = np.dtype('<f4')
+KEY_DTYPE = np.dtype('<i8')
+
+
+def to_epoch(moment: datetime) -> int:
+    """Converts a datetime (naive = UTC, as returned by Timestamp.ToDatetime) to epoch seconds."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def from_epoch(seconds: int) -> datetime:
+    """Converts epoch seconds to a naive UTC datetime."""
+    return datetime.fromtimestamp(int(seconds), tz=timezone.utc).replace(tzinfo=None)
+
+
+def _memmap(path: str, dtype: np.dtype) -> np.ndarray:
+    """Memory-maps a raw array file (only whole items); empty files give an empty array."""
+    count = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def _shuffle(block: np.ndarray) -> bytes:
+    """Groups the bytes of float32 values by significance before compression (like blosc's shuffle)."""
+    return np.ascontiguousarray(block.view(np.uint8).reshape(-1, SPEED_DTYPE.itemsize).T).tobytes()
+
+
+def _unshuffle(data: bytes, shape: Tuple[int, int]) -> np.ndarray:
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(SPEED_DTYPE.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(SPEED_DTYPE).reshape(shape)
+
+
+class SnapshotArchive:
+    """
+    Append-only columnar archive of realtime speeds.
+
+    Speeds are float32 km/h; NaN means the street was not in the snapshot. A chunk has a
+    fixed width (number of known streets); when a snapshot contains new streets, their keys
+    are appended and a new, wider chunk is started.
+    """
+
+    def __init__(self, directory: str, chunk_snapshots: int = 60, block_streets: int = 8192,
+                 compression_level: int = 6):
+        self.directory = directory
+        self.chunk_snapshots = chunk_snapshots
+        self.block_streets = block_streets
+        self.compression_level = compression_level
+        os.makedirs(directory, exist_ok=True)
+
+        self._keys_path = os.path.join(directory, 'keys.i64')
+        self._times_path = os.path.join(directory, 'times.i64')
+        self._open_path = os.path.join(directory, 'open.f32')
+        self._index_path = os.path.join(directory, 'index.json')
+
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding='utf-8') as f:
+                self._index = json.load(f)
+        else:
+            self._index = {'chunks': [], 'open': {'first_row': 0, 'width': 0}}
+
+        self._keys = np.array(_memmap(self._keys_path, KEY_DTYPE))
+        self._sort_keys()
+        self._repair_open_chunk()
+        self._last_keys = None
+        self._last_positions = None
+        self._block_cache: Dict[Tuple[int, int], np.ndarray] = {}
+
+    # Writing ---------------------------------------------------------------
+
+    def _sort_keys(self):
+        self._key_order = np.argsort(self._keys, kind='stable')
+        self._sorted_keys = self._keys[self._key_order]
+
+    def _repair_open_chunk(self):
+        """Drops a partially written row, or a row without its time, after an interrupted append."""
+        width = self._index['open']['width']
+        row_bytes = width * SPEED_DTYPE.itemsize
+        open_rows = os.path.getsize(self._open_path) // row_bytes if width and os.path.exists(self._open_path) else 0
+        times = os.path.getsize(self._times_path) // KEY_DTYPE.itemsize if os.path.exists(self._times_path) else 0
+        rows = min(self._index['open']['first_row'] + open_rows, times)
+        if os.path.exists(self._open_path):
+            os.truncate(self._open_path, (rows - self._index['open']['first_row']) * row_bytes)
+        if os.path.exists(self._times_path):
+            os.truncate(self._times_path, rows * KEY_DTYPE.itemsize)
+
+    def _open_rows(self) -> int:
+        width = self._index['open']['width']
+        if not width or not os.path.exists(self._open_path):
+            return 0
+        return os.path.getsize(self._open_path) // (width * SPEED_DTYPE.itemsize)
+
+    def _save_index(self):
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        """Returns the archive column of every key, adding unknown keys (starts a new chunk)."""
+        if self._last_keys is not None and np.array_equal(keys, self._last_keys):
+            return self._last_positions
+
+        found = np.searchsorted(self._sorted_keys, keys)
+        found[found == len(self._sorted_keys)] = 0
+        known = self._sorted_keys[found] == keys if len(self._sorted_keys) else np.zeros(len(keys), dtype=bool)
+        positions = np.where(known, self._key_order[found] if len(self._key_order) else 0, -1)
+
+        if not known.all():
+            new_keys = np.unique(keys[~known])
+            self.seal()
+            with open(self._keys_path, 'ab') as f:
+                f.write(new_keys.astype(KEY_DTYPE).tobytes())
+            first = len(self._keys)
+            self._keys = np.concatenate([self._keys, new_keys.astype(KEY_DTYPE)])
+            self._sort_keys()
+            positions[~known] = first + np.searchsorted(new_keys, keys[~known])
+            self._index['open']['width'] = len(self._keys)
+            self._save_index()
+
+        self._last_keys = keys.copy()
+        self._last_positions = positions
+        return positions
+
+    def append(self, snapshot_time: datetime, keys: np.ndarray, speeds: np.ndarray) -> bool:
+        """
+        Appends one snapshot.
+
+        Args:
+            snapshot_time: snapshot_date_time of the snapshot
+            keys: Street keys (make_street_keys)
+            speeds: Speed of every street in keys, km/h
+
+        Returns:
+            False if the snapshot was skipped because it is not newer than the last one
+        """
+        times = self.times()
+        if len(times) and to_epoch(snapshot_time) <= times[-1]:
+            logger.warning(f"Snapshot {snapshot_time.isoformat()} is not newer than the archive, skipped")
+            return False
+
+        positions = self._positions(keys)
+        row = np.full(len(self._keys), np.nan, dtype=SPEED_DTYPE)
+        row[positions] = speeds
+
+        # Speeds first: a row without its time is dropped again by _repair_open_chunk
+        with open(self._open_path, 'ab') as f:
+            f.write(row.tobytes())
+        with open(self._times_path, 'ab') as f:
+            f.write(np.array([to_epoch(snapshot_time)], dtype=KEY_DTYPE).tobytes())
+
+        if self._open_rows() >= self.chunk_snapshots:
+            self.seal()
+        return True
+
+    def seal(self):
+        """Compresses the open chunk into a chunk file (no-op when it is empty)."""
+        rows = self._open_rows()
+        open_info = self._index['open']
+        if rows:
+            width = open_info['width']
+            matrix = np.fromfile(self._open_path, dtype=SPEED_DTYPE, count=rows * width).reshape(rows, width)
+            path = f"chunk_{len(self._index['chunks']):06d}.bin"
+            offsets = [0]
+            with open(os.path.join(self.directory, path), 'wb') as f:
+                for start in range(0, width, self.block_streets):
+                    block = np.ascontiguousarray(matrix[:, start:start + self.block_streets])
+                    data = zlib.compress(_shuffle(block), self.compression_level)
+                    f.write(data)
+                    offsets.append(offsets[-1] + len(data))
+            times = _memmap(self._times_path, KEY_DTYPE)
+            first_row = open_info['first_row']
+            self._index['chunks'].append({
+                'file': path, 'first_row': first_row, 'rows': rows, 'width': width,
+                'first_time': int(times[first_row]), 'last_time': int(times[first_row + rows - 1]),
+                'block_streets': self.block_streets, 'offsets': offsets,
+            })
+            open_info['first_row'] = first_row + rows
+        open_info['width'] = len(self._keys)
+        self._save_index()
+        if os.path.exists(self._open_path):
+            os.truncate(self._open_path, 0)
+
+    # Reading ---------------------------------------------------------------
+
+    @property
+    def keys(self) -> np.ndarray:
+        return self._keys
+
+    def times(self) -> np.ndarray:
+        """Snapshot times (epoch seconds) of all rows, memory-mapped."""
+        return _memmap(self._times_path, KEY_DTYPE)
+
+    def _read_block(self, chunk_number: int, block: int) -> np.ndarray:
+        cached = self._block_cache.get((chunk_number, block))
+        if cached is not None:
+            return cached
+        chunk = self._index['chunks'][chunk_number]
+        data = np.memmap(os.path.join(self.directory, chunk['file']), dtype=np.uint8, mode='r')
+        start, end = chunk['offsets'][block], chunk['offsets'][block + 1]
+        width = min(chunk['block_streets'], chunk['width'] - block * chunk['block_streets'])
+        matrix = _unshuffle(zlib.decompress(data[start:end]), (chunk['rows'], width))
+        if len(self._block_cache) > 64:
+            self._block_cache.clear()
+        self._block_cache[(chunk_number, block)] = matrix
+        return matrix
+
+    def _open_matrix(self) -> np.ndarray:
+        rows, width = self._open_rows(), self._index['open']['width']
+        if not rows:
+            return np.zeros((0, width), dtype=SPEED_DTYPE)
+        return np.memmap(self._open_path, dtype=SPEED_DTYPE, mode='r', shape=(rows, width))
+
+    def _rows_between(self, start: int, end: int) -> Tuple[int, int]:
+        times = self.times()
+        return int(np.searchsorted(times, start, side='left')), int(np.searchsorted(times, end, side='right'))
+
+    def _column(self, position: int, first_row: int, last_row: int) -> np.ndarray:
+        """Speeds of one archive column for rows [first_row, last_row)."""
+        values = np.full(last_row - first_row, np.nan, dtype=SPEED_DTYPE)
+        chunks = self._index['chunks']
+        chunk_starts = [chunk['first_row'] for chunk in chunks]
+        first_chunk = max(bisect.bisect_right(chunk_starts, first_row) - 1, 0)
+        for number in range(first_chunk, bisect.bisect_left(chunk_starts, last_row)):
+            chunk = chunks[number]
+            lo = max(first_row, chunk['first_row'])
+            hi = min(last_row, chunk['first_row'] + chunk['rows'])
+            if lo >= hi or position >= chunk['width']:
+                continue
+            block, offset = divmod(position, chunk['block_streets'])
+            matrix = self._read_block(number, block)
+            values[lo - first_row:hi - first_row] = matrix[lo - chunk['first_row']:hi - chunk['first_row'], offset]
+        open_first = self._index['open']['first_row']
+        open_matrix = self._open_matrix()
+        lo, hi = max(first_row, open_first), min(last_row, open_first + len(open_matrix))
+        if lo < hi and position < open_matrix.shape[1]:
+            values[lo - first_row:hi - first_row] = open_matrix[lo - open_first:hi - open_first, position]
+        return values
+
+    def street_history(self, street_id: int, from_node_id: int, hours: Optional[float] = None,
+                       start: Optional[datetime] = None, end: Optional[datetime] = None
+                       ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Speed of one street over time.
+
+        Args:
+            street_id, from_node_id: The street
+            hours: Only the last N hours up to the newest snapshot (ignored if start is given)
+            start, end: Time range (naive = UTC)
+
+        Returns:
+            (snapshot times as datetime64[s], speeds; NaN where the street was missing)
+        """
+        times = self.times()
+        if not len(times):
+            return np.zeros(0, dtype='datetime64[s]'), np.zeros(0, dtype=SPEED_DTYPE)
+        end_s = to_epoch(end) if end else int(times[-1])
+        if start is not None:
+            start_s = to_epoch(start)
+        elif hours is not None:
+            start_s = end_s - int(hours * 3600)
+        else:
+            start_s = int(times[0])
+        first_row, last_row = self._rows_between(start_s, end_s)
+
+        key = make_street_keys(np.array([street_id]), np.array([from_node_id]))[0]
+        index = np.searchsorted(self._sorted_keys, key)
+        if index == len(self._sorted_keys) or self._sorted_keys[index] != key:
+            raise KeyError(f"Street {street_id}:{from_node_id} is not in the archive")
+        speeds = self._column(int(self._key_order[index]), first_row, last_row)
+        return np.array(times[first_row:last_row]).astype('datetime64[s]'), speeds
+
+    def network_at(self, moment: Optional[datetime] = None) -> Tuple[datetime, np.ndarray, np.ndarray]:
+        """
+        The whole network as of a point in time.
+
+        Args:
+            moment: Point in time (naive = UTC); the newest snapshot at or before it is used.
+                Default: the newest snapshot.
+
+        Returns:
+            (snapshot time, street keys, speeds) for the streets present in that snapshot
+        """
+        times = self.times()
+        row = len(times) - 1 if moment is None else int(np.searchsorted(times, to_epoch(moment), side='right')) - 1
+        if row < 0:
+            raise KeyError("No snapshot at or before the requested time")
+
+        open_first = self._index['open']['first_row']
+        if row >= open_first:
+            values = np.array(self._open_matrix()[row - open_first])
+        else:
+            number = bisect.bisect_right([chunk['first_row'] for chunk in self._index['chunks']], row) - 1
+            chunk = self._index['chunks'][number]
+            blocks = range(len(chunk['offsets']) - 1)
+            values = np.concatenate([self._read_block(number, block)[row - chunk['first_row']] for block in blocks])
+
+        present = ~np.isnan(values)
+        keys = self._keys[:len(values)]
+        return from_epoch(times[row]), keys[present], values[present]
+
+
+class DeltaSnapshotStore:
+    """
+    Delta-encoded snapshot store: a full keyframe every keyframe_interval snapshots and,
+    in between, only the (index, speed) pairs of streets whose speed changed.
+
+    A snapshot is rebuilt by applying the deltas after the nearest keyframe. A new
+    keyframe is also written whenever the set of streets changes.
+
+    Layout of a store directory:
+        delta_index.bin     one DELTA_INDEX_DTYPE record per snapshot
+        delta_data.bin      zlib-compressed keyframes (float32 speeds) and deltas
+                            (uint32 indices followed by float32 speeds)
+        keys_NNNNNN.i64     street key sets referenced by the keyframes
+    """
+
+    KEYFRAME, DELTA = 0, 1
+    DELTA_INDEX_DTYPE = np.dtype([('time', '<i8'), ('kind', '<i4'), ('keyset', '<i4'),
+                                  ('offset', '<i8'), ('length', '<i8'), ('changed', '<i8')])
+
+    def __init__(self, directory: str, keyframe_interval: int = 30, compression_level: int = 6):
+        self.directory = directory
+        self.keyframe_interval = keyframe_interval
+        self.compression_level = compression_level
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, 'delta_index.bin')
+        self._data_path = os.path.join(directory, 'delta_data.bin')
+        self._repair()
+
+        self._keys = None            # keys and speeds of the last appended snapshot
+        self._speeds = None
+        self._keyset = -1
+        self._since_keyframe = 0
+        self._keyset_cache: Dict[int, np.ndarray] = {}
+        self._keyframe_cache: Tuple[int, Optional[np.ndarray]] = (-1, None)
+
+    def _repair(self):
+        """Drops index records whose data was not completely written, and data without a record."""
+        index = self.index()
+        data_size = os.path.getsize(self._data_path) if os.path.exists(self._data_path) else 0
+        complete = index['offset'] + index['length'] <= data_size
+        rows = int(np.argmin(complete)) if not complete.all() else len(index)
+        if os.path.exists(self._index_path):
+            os.truncate(self._index_path, rows * self.DELTA_INDEX_DTYPE.itemsize)
+        if os.path.exists(self._data_path):
+            os.truncate(self._data_path, int(index['offset'][rows - 1] + index['length'][rows - 1]) if rows else 0)
+
+    def index(self) -> np.ndarray:
+        """Index records of all snapshots, memory-mapped."""
+        return _memmap(self._index_path, self.DELTA_INDEX_DTYPE)
+
+    def times(self) -> np.ndarray:
+        """Snapshot times (epoch seconds) of all rows (same as SnapshotArchive.times)."""
+        return self.index()['time']
+
+    def _keyset_keys(self, keyset: int) -> np.ndarray:
+        keys = self._keyset_cache.get(keyset)
+        if keys is None:
+            keys = np.fromfile(os.path.join(self.directory, f'keys_{keyset:06d}.i64'), dtype=KEY_DTYPE)
+            self._keyset_cache = {keyset: keys}
+        return keys
+
+    def _restore(self):
+        """Loads the state of the last snapshot when appending to an existing store."""
+        index = self.index()
+        if self._keys is None and len(index):
+            _, self._keys, self._speeds = self.reconstruct_row(len(index) - 1)
+            self._keyset = int(index['keyset'][-1])
+            keyframes = np.flatnonzero(index['kind'] == self.KEYFRAME)
+            self._since_keyframe = len(index) - 1 - int(keyframes[-1])
+
+    def _write(self, time_s: int, kind: int, keyset: int, payload: bytes, changed: int):
+        offset = os.path.getsize(self._data_path) if os.path.exists(self._data_path) else 0
+        data = zlib.compress(payload, self.compression_level)
+        with open(self._data_path, 'ab') as f:
+            f.write(data)
+        record = np.array([(time_s, kind, keyset, offset, len(data), changed)], dtype=self.DELTA_INDEX_DTYPE)
+        with open(self._index_path, 'ab') as f:
+            f.write(record.tobytes())
+
+    def append(self, snapshot_time: datetime, keys: np.ndarray, speeds: np.ndarray) -> bool:
+        """
+        Appends one snapshot.
+
+        Args:
+            snapshot_time: snapshot_date_time of the snapshot
+            keys: Sorted street keys (make_street_keys)
+            speeds: Speed of every street in keys, km/h
+
+        Returns:
+            False if the snapshot was skipped because it is not newer than the last one
+        """
+        self._restore()
+        time_s = to_epoch(snapshot_time)
+        index = self.index()
+        if len(index) and time_s <= index['time'][-1]:
+            logger.warning(f"Snapshot {snapshot_time.isoformat()} is not newer than the store, skipped")
+            return False
+
+        speeds = np.asarray(speeds, dtype=SPEED_DTYPE)
+        if len(speeds) != len(keys):
+            raise ValueError(f"Got {len(speeds)} speeds for {len(keys)} street keys")
+        same_streets = self._keys is not None and np.array_equal(keys, self._keys)
+        if same_streets and self._since_keyframe + 1 < self.keyframe_interval:
+            # NaN != NaN would count as a change on every snapshot
+            changed = np.flatnonzero((speeds != self._speeds) & ~(np.isnan(speeds) & np.isnan(self._speeds)))
+            payload = changed.astype('<u4').tobytes() + speeds[changed].astype(SPEED_DTYPE).tobytes()
+            self._write(time_s, self.DELTA, self._keyset, payload, len(changed))
+            self._since_keyframe += 1
+        else:
+            if not same_streets:
+                self._keyset += 1
+                np.asarray(keys, dtype=KEY_DTYPE).tofile(os.path.join(self.directory, f'keys_{self._keyset:06d}.i64'))
+            self._write(time_s, self.KEYFRAME, self._keyset, _shuffle(speeds), len(speeds))
+            self._since_keyframe = 0
+            self._keys = np.array(keys, dtype=KEY_DTYPE)
+        self._speeds = speeds.copy()
+        return True
+
+    def _payload(self, record) -> bytes:
+        with open(self._data_path, 'rb') as f:
+            f.seek(int(record['offset']))
+            return zlib.decompress(f.read(int(record['length'])))
+
+    def reconstruct_row(self, row: int) -> Tuple[datetime, np.ndarray, np.ndarray]:
+        """Rebuilds snapshot number row: its keyframe plus the deltas up to row."""
+        index = self.index()
+        keyframes = np.flatnonzero(index['kind'][:row + 1] == self.KEYFRAME)
+        if not len(keyframes):
+            raise KeyError("Store has no keyframe before the requested snapshot")
+        first = int(keyframes[-1])
+        record = index[first]
+
+        cached_row, cached_speeds = self._keyframe_cache
+        if cached_row == first:
+            speeds = cached_speeds.copy()
+        else:
+            speeds = _unshuffle(self._payload(record), (1, -1)).ravel()
+            self._keyframe_cache = (first, speeds.copy())
+
+        with open(self._data_path, 'rb') as f:
+            for delta in index[first + 1:row + 1]:
+                f.seek(int(delta['offset']))
+                payload = zlib.decompress(f.read(int(delta['length'])))
+                count = int(delta['changed'])
+                positions = np.frombuffer(payload, dtype='<u4', count=count)
+                speeds[positions] = np.frombuffer(payload, dtype=SPEED_DTYPE, offset=4 * count)
+        return from_epoch(index['time'][row]), self._keyset_keys(int(record['keyset'])), speeds
+
+    def network_at(self, moment: Optional[datetime] = None) -> Tuple[datetime, np.ndarray, np.ndarray]:
+        """
+        The whole network as of a point in time (same result as SnapshotArchive.network_at).
+
+        Args:
+            moment: Point in time (naive = UTC); the newest snapshot at or before it is used.
+                Default: the newest snapshot.
+        """
+        times = self.index()['time']
+        row = len(times) - 1 if moment is None else int(np.searchsorted(times, to_epoch(moment), side='right')) - 1
+        if row < 0:
+            raise KeyError("No snapshot at or before the requested time")
+        snapshot_time, keys, speeds = self.reconstruct_row(row)
+        present = ~np.isnan(speeds)
+        return snapshot_time, keys[present], speeds[present]
+
+    def stats(self, samples: int = 20) -> Dict[str, float]:
+        """
+        Compression ratio and reconstruction latency of the store.
+
+        The ratio compares the stored bytes with full float32 speed copies of every snapshot
+        (keys not included). Latency is measured by rebuilding up to `samples` snapshots
+        spread over the store.
+        """
+        index = self.index()
+        if not len(index):
+            return {'snapshots': 0}
+        streets = {}
+        for keyset in np.unique(index['keyset']).tolist():
+            streets[keyset] = len(self._keyset_keys(keyset))
+        raw_bytes = float(sum(streets[keyset] for keyset in index['keyset'].tolist()) * SPEED_DTYPE.itemsize)
+        stored_bytes = float(index['length'].sum())
+        latencies = []
+        for row in np.unique(np.linspace(0, len(index) - 1, min(samples, len(index))).astype(int)).tolist():
+            self._keyframe_cache = (-1, None)
+            started = time.perf_counter()
+            self.reconstruct_row(row)
+            latencies.append(time.perf_counter() - started)
+        deltas = index['kind'] == self.DELTA
+        return {
+            'snapshots': len(index),
+            'keyframes': int((~deltas).sum()),
+            'mean_changed_per_delta': float(index['changed'][deltas].mean()) if deltas.any() else 0.0,
+            'raw_mb': raw_bytes / 1e6,
+            'stored_mb': stored_bytes / 1e6,
+            'compression_ratio': raw_bytes / stored_bytes if stored_bytes else 0.0,
+            'reconstruct_ms_mean': 1000 * float(np.mean(latencies)),
+            'reconstruct_ms_max': 1000 * float(np.max(latencies)),
+        }
+
+
+def open_store(directory: str):
+    """Opens the archive or delta store in directory, whichever it contains."""
+    if os.path.exists(os.path.join(directory, 'delta_index.bin')):
+        return DeltaSnapshotStore(directory)
+    return SnapshotArchive(directory)
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Query a realtime snapshot archive written by the monitor')
+    parser.add_argument('archive', help='Archive or delta store directory (--archive or --delta-store of '
+                                        'ptv_flows_realtime_monitor.py)')
+    subparsers = parser.add_subparsers(dest='query', required=True)
+    street = subparsers.add_parser('street', help='Speed of one street over time')
+    street.add_argument('street', help='Street as ID:FROM_NODE_ID (both are required)')
+    street.add_argument('--hours', type=float, default=24, help='Last N hours (default: 24)')
+    network = subparsers.add_parser('network', help='All streets at one point in time')
+    network.add_argument('--at', type=datetime.fromisoformat, help='UTC time (default: newest snapshot)')
+    network.add_argument('--output', help='CSV file (default: stdout)')
+    subparsers.add_parser('stats', help='Compression ratio and reconstruction latency of a delta store')
+
+    args = parser.parse_args()
+    if args.query == 'street':
+        try:
+            street_id, from_node_id = parse_street_key(args.street)
+        except ValueError as e:
+            parser.error(str(e))
+    archive = open_store(args.archive)
+
+    try:
+        if args.query == 'stats':
+            if not isinstance(archive, DeltaSnapshotStore):
+                parser.error('stats is only available for delta stores (--delta-store)')
+            for name, value in archive.stats().items():
+                print(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}")
+        elif args.query == 'street':
+            if not isinstance(archive, SnapshotArchive):
+                parser.error('street history needs an archive (--archive); use network --at with a delta store')
+            times, speeds = archive.street_history(street_id, from_node_id, hours=args.hours)
+            for moment, speed in zip(times, speeds):
+                print(f"{moment}, {'' if np.isnan(speed) else f'{speed:.1f}'}")
+        else:
+            moment, keys, speeds = archive.network_at(args.at)
+            output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+            writer = csv.writer(output)
+            writer.writerow(['snapshot_time', 'id', 'from_node_id', 'speed_kmh'])
+            ids, from_node_ids = split_street_keys(keys)
+            for street_id, from_node_id, speed in zip(ids.tolist(), from_node_ids.tolist(), speeds.tolist()):
+                writer.writerow([moment.isoformat(), street_id, from_node_id, round(speed, 2)])
+            if args.output:
+                output.close()
+                logger.info(f"Saved {len(keys)} streets at {moment.isoformat()} to {args.output}")
+    except KeyError as e:
+        logger.error(e.args[0])
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
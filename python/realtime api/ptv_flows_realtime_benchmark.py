@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+PTV Flows Realtime Benchmark Suite
+
+Generates synthetic DataprvTrafficRealtimeDataProto payloads and times every processing
+stage of the realtime tools on them. No API key is needed.
+
+Stages:
+    parse           protobuf ParseFromString
+    extract         extract_traffic_columns on the parsed message
+    scan            wire-level scan_traffic_columns (all fields)
+    filter          build_filter_mask (speed ranges + olr_code prefix)
+    hash            payload_hash of the raw bytes
+    canonicalize    canonical_snapshot (sort by street key + content hash)
+    diff            diff_snapshots against the previous snapshot
+    export_csv, export_ndjson, export_parquet   streaming writers (Parquet needs pyarrow)
+
+For every payload size and stage the suite reports throughput (streets/s at the median),
+latency percentiles over --repeat runs, the peak memory allocated by the stage and the
+peak RSS of the process. Results can be stored as a baseline and compared later.
+
+Usage:
+    python ptv_flows_realtime_benchmark.py [--streets 10000 100000 1000000] [--churn 0.1] [--olr-length 28]
+                                           [--stages scan diff] [--repeat 5]
+                                           [--save-baseline baseline.json] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import dataprv_traffic_realtime_data_pb2
+from ptv_flows_realtime import (extract_traffic_columns, scan_traffic_columns, build_filter_mask,
+                                EXPORT_WRITERS, STREET_FIELDS)
+from ptv_flows_realtime_monitor import payload_hash, canonical_snapshot, diff_snapshots
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STAGES = ['parse', 'extract', 'scan', 'filter', 'hash', 'canonicalize', 'diff',
+          'export_csv', 'export_ndjson', 'export_parquet']
+
+# Characters of the synthetic olr_code strings (OpenLR codes are base64)
+_OLR_ALPHABET = np.frombuffer(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/', dtype=np.uint8)
+
+_STREET_TAG = 3 << 3 | 2     # street_traffic: field 3, length-delimited
+
+
+def _varint_columns(values: np.ndarray):
+    """Encodes non-negative integers as varints: (bytes, one row per value, 10 wide) and byte counts."""
+    values = values.astype(np.uint64)
+    shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    lengths = 1 + (values[:, None] >= (np.uint64(1) << shifts[1:])).sum(axis=1)
+    groups = ((values[:, None] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+    groups[np.arange(10) < (lengths - 1)[:, None]] |= 0x80
+    return groups, lengths
+
+
+def _assemble(pieces) -> bytes:
+    """Concatenates per-street pieces [(matrix, lengths), ...] row by row, keeping `lengths` bytes of each."""
+    matrix = np.hstack([piece for piece, _ in pieces])
+    keep = np.hstack([np.arange(piece.shape[1]) < np.asarray(lengths)[:, None] if np.ndim(lengths)
+                      else np.full(piece.shape, lengths > 0) for piece, lengths in pieces])
+    return matrix[keep].tobytes()
+
+
+def encode_payload(ids: np.ndarray, from_node_ids: np.ndarray, speeds: np.ndarray, probe_counts: np.ndarray,
+                   olr_codes: Optional[np.ndarray], snapshot_seconds: int,
+                   timezone: str = "Europe/Berlin") -> bytes:
+    """
+    Serializes street columns to the protobuf wire format with NumPy (no message objects).
+
+    The output is byte-identical to DataprvTrafficRealtimeDataProto.SerializeToString():
+    fields in number order, zero values omitted (proto3).
+
+    Args:
+        ids, from_node_ids, probe_counts: Non-negative integers per street
+        speeds: Speeds (km/h) per street
+        olr_codes: uint8 matrix with one ASCII olr_code per row (all the same length), or None
+        snapshot_seconds: snapshot_date_time (UTC epoch seconds)
+        timezone: Timezone name
+
+    Returns:
+        Serialized DataprvTrafficRealtimeDataProto
+    """
+    header = dataprv_traffic_realtime_data_pb2.DataprvTrafficRealtimeDataProto()
+    header.timezone = timezone
+    header.snapshot_date_time.seconds = snapshot_seconds
+    count = len(ids)
+
+    def tag(field: int, wire_type: int, present: np.ndarray):
+        return np.full((count, 1), field << 3 | wire_type, dtype=np.uint8), present.astype(np.int64)
+
+    body = []
+    for field, values in ((1, ids), (2, from_node_ids)):
+        encoded, lengths = _varint_columns(values)
+        present = values != 0
+        body += [tag(field, 0, present), (encoded, np.where(present, lengths, 0))]
+    speeds = np.asarray(speeds, dtype='<f8')
+    present = speeds != 0
+    body += [tag(3, 1, present), (speeds.view(np.uint8).reshape(count, 8), np.where(present, 8, 0))]
+    encoded, lengths = _varint_columns(probe_counts)
+    present = probe_counts != 0
+    body += [tag(5, 0, present), (encoded, np.where(present, lengths, 0))]
+    if olr_codes is not None and olr_codes.shape[1]:
+        length = olr_codes.shape[1]
+        olr_length, olr_length_bytes = _varint_columns(np.full(count, length))
+        body += [tag(6, 2, np.ones(count, dtype=bool)), (olr_length, olr_length_bytes),
+                 (olr_codes, np.full(count, length))]
+
+    body_lengths = sum(np.asarray(lengths) for _, lengths in body)
+    street_length, street_length_bytes = _varint_columns(body_lengths)
+    pieces = [(np.full((count, 1), _STREET_TAG, dtype=np.uint8), np.ones(count, dtype=np.int64)),
+              (street_length, street_length_bytes)] + body
+    return header.SerializeToString() + _assemble(pieces)
+
+
+def make_olr_codes(count: int, olr_length: int, seed: int = 0) -> np.ndarray:
+    """Unique-looking base64 olr_codes: a random per-street prefix followed by the street index."""
+    rng = np.random.default_rng(seed)
+    codes = _OLR_ALPHABET[rng.integers(0, 64, size=(count, olr_length))]
+    index = np.arange(count, dtype=np.int64)
+    for position in range(min(olr_length, 5)):
+        codes[:, olr_length - 1 - position] = _OLR_ALPHABET[(index >> (6 * position)) & 63]
+    return codes
+
+
+class SyntheticNetwork:
+    """
+    A synthetic network whose speeds change between snapshots.
+
+    Args:
+        streets: Number of StreetTraffic records (e.g. 10,000 to 2,000,000)
+        churn: Share of the streets whose speed changes from one snapshot to the next
+        olr_length: Length of the olr_code strings (0 = no olr_code)
+        seed: Random seed
+    """
+
+    def __init__(self, streets: int, churn: float = 0.1, olr_length: int = 28, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        index = np.arange(streets, dtype=np.int64)
+        self.ids = index // 2 + 1
+        self.from_node_ids = 1_000_000 + index
+        self.speeds = np.round(self.rng.uniform(5.0, 130.0, streets), 1)
+        self.probe_counts = self.rng.integers(0, 21, streets)
+        self.olr_codes = make_olr_codes(streets, olr_length, seed) if olr_length else None
+        self.churn = churn
+        self.snapshot_seconds = 1_760_000_000
+
+    def payload(self) -> bytes:
+        """The current snapshot, serialized."""
+        return encode_payload(self.ids, self.from_node_ids, self.speeds, self.probe_counts,
+                              self.olr_codes, self.snapshot_seconds)
+
+    def advance(self, seconds: int = 60):
+        """Moves to the next snapshot: `churn` of the streets get a new speed."""
+        changed = self.rng.random(len(self.speeds)) < self.churn
+        self.speeds[changed] = np.round(self.rng.uniform(5.0, 130.0, int(changed.sum())), 1)
+        self.snapshot_seconds += seconds
+
+
+def make_synthetic_payload(streets: int, seed: int = 0, olr_length: int = 28) -> bytes:
+    """
+    Builds a serialized realtime snapshot with random speeds.
+
+    Args:
+        streets: Number of StreetTraffic records
+        seed: Random seed
+        olr_length: Length of the generated olr_code strings
+
+    Returns:
+        Serialized DataprvTrafficRealtimeDataProto
+    """
+    return SyntheticNetwork(streets, olr_length=olr_length, seed=seed).payload()
+
+
+def parse_only(data: bytes):
+    message = dataprv_traffic_realtime_data_pb2.DataprvTrafficRealtimeDataProto()
+    message.ParseFromString(data)
+    return message
+
+
+def parse_and_extract(data: bytes):
+    return extract_traffic_columns(parse_only(data))
+
+
+def check_decoders(data: bytes):
+    """Asserts that scan_traffic_columns and ParseFromString + extract_traffic_columns decode the same streets."""
+    scanned = scan_traffic_columns(data, fields=tuple(STREET_FIELDS))
+    extracted = parse_and_extract(data)
+    for name in ('ids', 'from_node_ids', 'speeds', 'probe_counts'):
+        assert np.array_equal(getattr(scanned, name), getattr(extracted, name)), f"Decoders disagree on {name}"
+    assert [scanned.olr_codes[i] for i in scanned.olr_index.tolist()] == \
+           [extracted.olr_codes[i] for i in extracted.olr_index.tolist()], "Decoders disagree on olr_code"
+
+
+def make_edge_case_payload() -> bytes:
+    """A small payload with all-default (empty) StreetTraffic records in the middle and at the end."""
+    message = dataprv_traffic_realtime_data_pb2.DataprvTrafficRealtimeDataProto()
+    message.timezone = "Europe/Berlin"
+    message.snapshot_date_time.seconds = 1_760_000_000
+    for index in range(4):
+        street = message.street_traffic.add()
+        if index % 2 == 0:
+            street.id = index + 1
+            street.from_node_id = 1_000_000 + index
+            street.speed_kmh = 42.5
+            street.probe_count = 3
+            street.olr_code = "CwRbWyNG9RpsCQCaAL4AEw=="
+    return message.SerializeToString()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB (None where unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3   # bytes on macOS, KB on Linux
+
+
+def measure(function: Callable, repeat: int) -> Dict[str, float]:
+    """
+    Runs function once under tracemalloc (peak allocation, not timed) and repeat times timed.
+
+    Returns:
+        Latency percentiles (seconds) and the peak memory allocated during one run (MB)
+    """
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    timings = np.array(timings)
+    return {'p50_s': float(np.percentile(timings, 50)), 'p90_s': float(np.percentile(timings, 90)),
+            'max_s': float(timings.max()), 'peak_alloc_mb': peak / 1e6}
+
+
+def prepare_stages(network: SyntheticNetwork, stages: List[str], output_dir: str) -> Tuple[Dict[str, Callable], int]:
+    """Builds the inputs of every stage once; returns a callable per stage and the payload size in bytes."""
+    previous = network.payload()
+    network.advance()
+    data = network.payload()
+    message = parse_only(data)
+    columns = scan_traffic_columns(data, fields=tuple(STREET_FIELDS))
+    previous_keys, previous_columns, _ = canonical_snapshot(scan_traffic_columns(previous))
+    keys, sorted_columns, _ = canonical_snapshot(scan_traffic_columns(data))
+    olr_prefix = columns.olr_codes[0][:4] if columns.olr_codes else ''
+    filters = {'speed_ranges': [(0.0, 30.0), (100.0, float('inf'))], 'olr_prefixes': [olr_prefix]}
+
+    # Both decoders must agree before their timings are compared
+    check_decoders(data)
+    check_decoders(make_edge_case_payload())
+
+    available = {
+        'parse': lambda: parse_only(data),
+        'extract': lambda: extract_traffic_columns(message),
+        'scan': lambda: scan_traffic_columns(data, fields=tuple(STREET_FIELDS)),
+        'filter': lambda: build_filter_mask(columns, filters),
+        'hash': lambda: payload_hash(data),
+        'canonicalize': lambda: canonical_snapshot(columns),
+        'diff': lambda: diff_snapshots(previous_keys, previous_columns.speeds, keys, sorted_columns.speeds),
+    }
+    for output_format in ('csv', 'ndjson', 'parquet'):
+        path = os.path.join(output_dir, f"benchmark.{output_format}")
+        available[f"export_{output_format}"] = \
+            lambda writer=EXPORT_WRITERS[output_format], path=path: writer(columns, path)
+    return {stage: available[stage] for stage in stages}, len(data)
+
+
+def run_suite(street_counts: List[int], stages: List[str], repeat: int = 5, churn: float = 0.1,
+              olr_length: int = 28) -> List[Dict]:
+    """
+    Times the selected stages on synthetic payloads of the given sizes.
+
+    Returns:
+        One result per (streets, stage)
+    """
+    results = []
+    # The writers log every file; keep the benchmark output readable
+    logging.getLogger('ptv_flows_realtime').setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as output_dir:
+        for streets in street_counts:
+            logger.info(f"Generating payloads with {streets} streets (churn {churn:.0%})...")
+            network = SyntheticNetwork(streets, churn=churn, olr_length=olr_length)
+            functions, payload_bytes = prepare_stages(network, stages, output_dir)
+            for stage, function in functions.items():
+                try:
+                    timing = measure(function, repeat)
+                except ImportError as e:
+                    logger.warning(f"Skipping {stage}: {e}")
+                    continue
+                results.append({'streets': streets, 'stage': stage, 'payload_mb': payload_bytes / 1e6,
+                                'streets_per_second': streets / timing['p50_s'],
+                                'peak_rss_mb': peak_rss_mb(), **timing})
+    return results
+
+
+def save_baseline(results: List[Dict], path: str, settings: Dict):
+    """Stores results with the versions they were measured with."""
+    import google.protobuf
+    baseline = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'protobuf': google.protobuf.__version__,
+        'machine': platform.machine(),
+        'settings': settings,
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2)
+    logger.info(f"Saved baseline to {path}")
+
+
+# Settings that change the work done per stage; results measured with other values are not comparable
+COMPARABLE_SETTINGS = ('churn', 'olr_length')
+
+
+def load_baseline(path: str, settings: Dict) -> Dict:
+    """
+    Loads a baseline and checks that it was measured with the same payload settings.
+
+    Raises:
+        ValueError: If churn or olr_length differ from settings
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    stored = baseline.get('settings', {})
+    different = [f"{name} {stored.get(name)} (now {settings[name]})" for name in COMPARABLE_SETTINGS
+                 if stored.get(name) != settings[name]]
+    if different:
+        raise ValueError(f"measured with other settings: {', '.join(different)}")
+    if stored.get('repeat') != settings['repeat']:
+        logger.warning(f"Baseline used --repeat {stored.get('repeat')}, this run uses {settings['repeat']}")
+    return baseline
+
+
+def compare_with_baseline(results: List[Dict], baseline: Dict, tolerance: float) -> List[Dict]:
+    """
+    Adds the median latency relative to the baseline ('vs_baseline') to every result.
+
+    Returns:
+        Results that are slower than the baseline by more than tolerance
+    """
+    reference = {(row['streets'], row['stage']): row for row in baseline['results']}
+    regressions = []
+    for row in results:
+        previous = reference.get((row['streets'], row['stage']))
+        if previous is None:
+            continue
+        row['vs_baseline'] = row['p50_s'] / previous['p50_s']
+        if row['vs_baseline'] > 1 + tolerance:
+            regressions.append(row)
+    return regressions
+
+
+def print_results(results: List[Dict]):
+    print()
+    print(f"{'streets':>9} {'MB':>6}  {'stage':<15} {'streets/s':>13} {'p50 ms':>9} {'p90 ms':>9} "
+          f"{'max ms':>9} {'alloc MB':>9} {'RSS MB':>8} {'vs base':>8}")
+    for row in results:
+        rss = f"{row['peak_rss_mb']:>8.0f}" if row['peak_rss_mb'] is not None else f"{'n/a':>8}"
+        versus = f"{row['vs_baseline']:>7.2f}x" if 'vs_baseline' in row else f"{'':>8}"
+        print(f"{row['streets']:>9} {row['payload_mb']:>6.1f}  {row['stage']:<15} "
+              f"{row['streets_per_second']:>13,.0f} {row['p50_s'] * 1e3:>9.1f} {row['p90_s'] * 1e3:>9.1f} "
+              f"{row['max_s'] * 1e3:>9.1f} {row['peak_alloc_mb']:>9.1f} {rss} {versus}")
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Benchmark the processing stages of PTV Flows realtime payloads')
+    parser.add_argument('--streets', type=int, nargs='+', default=[10000, 100000, 500000],
+                       help='Street counts of the synthetic payloads (default: 10000 100000 500000)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                       help='Stages to run (default: all)')
+    parser.add_argument('--churn', type=float, default=0.1,
+                       help='Share of streets whose speed changes between snapshots (default: 0.1)')
+    parser.add_argument('--olr-length', type=int, default=28,
+                       help='Length of the synthetic olr_code strings, 0 for none (default: 28)')
+    parser.add_argument('--repeat', type=int, default=5,
+                       help='Timed runs per stage for the latency percentiles (default: 5)')
+    parser.add_argument('--save-baseline', type=str,
+                       help='Store the results as a baseline JSON file')
+    parser.add_argument('--compare', type=str,
+                       help='Compare the median latencies with a baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                       help='Allowed slowdown against the baseline before a stage counts as a regression '
+                            '(default: 0.25 = 25%%)')
+
+    args = parser.parse_args()
+    if not 0 <= args.churn <= 1:
+        parser.error('--churn must be between 0 and 1')
+
+    settings = {'churn': args.churn, 'olr_length': args.olr_length, 'repeat': args.repeat}
+    baseline = None
+    if args.compare:
+        # Checked before the run, so a mismatch does not waste the measurements
+        try:
+            baseline = load_baseline(args.compare, settings)
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot compare with baseline {args.compare}: {e}")
+            sys.exit(1)
+
+    results = run_suite(args.streets, args.stages, args.repeat, args.churn, args.olr_length)
+
+    regressions = []
+    if baseline is not None:
+        try:
+            regressions = compare_with_baseline(results, baseline, args.tolerance)
+        except KeyError as e:
+            logger.error(f"Invalid baseline {args.compare}: missing {e}")
+            sys.exit(1)
+    print_results(results)
+
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline, settings)
+    if regressions:
+        print()
+        for row in regressions:
+            logger.warning(f"Regression: {row['stage']} with {row['streets']} streets is "
+                           f"{row['vs_baseline']:.2f}x slower than the baseline")
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
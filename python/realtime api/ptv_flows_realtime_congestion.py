@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+PTV Flows Realtime Congestion Events
+
+Detects congestion events from the realtime speeds and the free-flow speeds of the network
+(free_flow_speed_kmph in the CSV written by ptv_flows_downloader.py). For each street the
+ratio speed / free-flow speed is tracked:
+
+- an event opens when the ratio drops below the enter threshold (default: 0.5),
+- it closes when the ratio is back at or above the exit threshold (default: 0.7),
+- it is reported only if it lasted at least the minimum duration (default: 5 minutes).
+
+The gap between both thresholds (hysteresis) keeps a street hovering around one value from
+opening and closing events on every snapshot. Only streets whose speed changed have to be
+passed to update(): an unchanged speed cannot open or close an event or lower its minimum
+ratio, so the cost per snapshot is linear in the number of changed streets.
+
+Used by ptv_flows_realtime_monitor.py (--network, --congestion-events). It can also run over a
+recorded archive or delta store:
+
+Usage:
+    python ptv_flows_realtime_congestion.py ARCHIVE_DIR --network streets.csv [--output events.csv]
+"""
+
+import argparse
+import csv
+import os
+import sys
+import logging
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from ptv_flows_realtime import NetworkStreets, split_street_keys
+from ptv_flows_realtime_archive import to_epoch, from_epoch, open_store
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# One congestion event: street key (make_street_keys), start/end (UTC epoch seconds), lowest ratio
+EVENT_DTYPE = np.dtype([('key', '<i8'), ('start', '<i8'), ('end', '<i8'), ('min_ratio', '<f4')])
+
+EVENT_COLUMNS = ['street_id', 'from_node_id', 'start', 'end', 'duration_s', 'min_ratio']
+
+
+class CongestionDetector:
+    """Opens and closes per-street congestion events from speed / free-flow speed ratios."""
+
+    def __init__(self, network: NetworkStreets, enter_ratio: float = 0.5, exit_ratio: float = 0.7,
+                 min_duration: int = 300):
+        """
+        Args:
+            network: Street keys and free-flow speeds
+            enter_ratio: An event opens when speed / free-flow speed drops below this
+            exit_ratio: An open event closes when the ratio is back at or above this
+            min_duration: Events shorter than this (seconds) are not reported
+        """
+        if not 0 < enter_ratio <= exit_ratio:
+            raise ValueError("Expected 0 < enter_ratio <= exit_ratio")
+        self.network = network
+        self.enter_ratio = np.float32(enter_ratio)
+        self.exit_ratio = np.float32(exit_ratio)
+        self.min_duration = min_duration
+        size = len(network)
+        # State per network street
+        self.ratio = np.full(size, np.nan, dtype=np.float32)        # latest speed / free-flow speed
+        self.start = np.full(size, -1, dtype=np.int64)              # start of the open event, -1 if none
+        self.min_ratio = np.full(size, np.nan, dtype=np.float32)    # lowest ratio of the open event
+        self.snapshot_time = None
+        self.events_reported = 0
+
+    @property
+    def open_count(self) -> int:
+        return int((self.start >= 0).sum())
+
+    def update(self, snapshot_time: datetime, keys: np.ndarray, speeds: np.ndarray) -> np.ndarray:
+        """
+        Processes the streets of one snapshot whose speed changed (or all of them).
+
+        Args:
+            snapshot_time: Snapshot time (naive UTC)
+            keys: Street keys (make_street_keys)
+            speeds: Current speed per key (km/h)
+
+        Returns:
+            Events closed by this snapshot (EVENT_DTYPE), at least min_duration long
+        """
+        now = to_epoch(snapshot_time)
+        if self.snapshot_time is not None and now <= self.snapshot_time:
+            logger.warning(f"Snapshot {snapshot_time} is not newer than the congestion detector, skipped")
+            return np.empty(0, dtype=EVENT_DTYPE)
+        self.snapshot_time = now
+
+        index = self.network.lookup(keys)
+        free_flow = self.network.free_flow_speeds[np.maximum(index, 0)]
+        usable = (index >= 0) & (free_flow > 0) & ~np.isnan(speeds)
+        index = index[usable]
+        ratio = (speeds[usable] / free_flow[usable]).astype(np.float32)
+        self.ratio[index] = ratio
+
+        in_event = self.start[index] >= 0
+        continuing = index[in_event]
+        self.min_ratio[continuing] = np.fmin(self.min_ratio[continuing], ratio[in_event])
+
+        opening = ~in_event & (ratio < self.enter_ratio)
+        self.start[index[opening]] = now
+        self.min_ratio[index[opening]] = ratio[opening]
+
+        closing = index[in_event & (ratio >= self.exit_ratio)]
+        long_enough = closing[now - self.start[closing] >= self.min_duration]
+        events = np.empty(len(long_enough), dtype=EVENT_DTYPE)
+        events['key'] = self.network.keys[long_enough]
+        events['start'] = self.start[long_enough]
+        events['end'] = now
+        events['min_ratio'] = self.min_ratio[long_enough]
+        self.start[closing] = -1
+        self.min_ratio[closing] = np.nan
+        self.events_reported += len(events)
+        return events
+
+    def open_events(self) -> np.ndarray:
+        """Events that are still open (end = -1)."""
+        index = np.flatnonzero(self.start >= 0)
+        events = np.empty(len(index), dtype=EVENT_DTYPE)
+        events['key'] = self.network.keys[index]
+        events['start'] = self.start[index]
+        events['end'] = -1
+        events['min_ratio'] = self.min_ratio[index]
+        return events
+
+
+def write_congestion_events(events: np.ndarray, output_path: str):
+    """Appends events to a CSV file (the header is written when the file is new)."""
+    new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+    ids, from_node_ids = split_street_keys(events['key'])
+    with open(output_path, 'a', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        if new_file:
+            writer.writerow(EVENT_COLUMNS)
+        for street_id, from_node_id, start, end, min_ratio in zip(
+                ids.tolist(), from_node_ids.tolist(), events['start'].tolist(), events['end'].tolist(),
+                events['min_ratio'].tolist()):
+            writer.writerow([street_id, from_node_id, from_epoch(start).isoformat(),
+                             from_epoch(end).isoformat() if end >= 0 else '',
+                             end - start if end >= 0 else '', round(min_ratio, 3)])
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Detect congestion events in a recorded realtime archive')
+    parser.add_argument('archive', help='Archive or delta store directory (--archive or --delta-store of '
+                                        'ptv_flows_realtime_monitor.py)')
+    parser.add_argument('--network', type=str, required=True,
+                       help='Network CSV exported by ptv_flows_downloader.py (free-flow speeds)')
+    parser.add_argument('--enter-ratio', type=float, default=0.5,
+                       help='Speed / free-flow speed below which an event opens (default: 0.5)')
+    parser.add_argument('--exit-ratio', type=float, default=0.7,
+                       help='Ratio at or above which an event closes (default: 0.7)')
+    parser.add_argument('--min-duration', type=int, default=300,
+                       help='Shortest reported event in seconds (default: 300)')
+    parser.add_argument('--output', type=str, default='congestion_events.csv',
+                       help='Events CSV (default: congestion_events.csv)')
+
+    args = parser.parse_args()
+    try:
+        detector = CongestionDetector(NetworkStreets.from_csv(args.network), args.enter_ratio,
+                                      args.exit_ratio, args.min_duration)
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot set up the detector: {e}")
+        sys.exit(1)
+    store = open_store(args.archive)
+
+    if os.path.exists(args.output):
+        os.remove(args.output)
+    previous_keys: Optional[np.ndarray] = None
+    previous_speeds: Optional[np.ndarray] = None
+    for seconds in store.times().tolist():
+        snapshot_time, keys, speeds = store.network_at(from_epoch(seconds))
+        if previous_keys is not None and np.array_equal(keys, previous_keys):
+            changed = speeds != previous_speeds
+            keys_changed, speeds_changed = keys[changed], speeds[changed]
+        else:
+            keys_changed, speeds_changed = keys, speeds
+        events = detector.update(snapshot_time, keys_changed, speeds_changed)
+        if len(events):
+            write_congestion_events(events, args.output)
+        previous_keys, previous_speeds = keys, speeds
+
+    still_open = detector.open_events()
+    if len(still_open):
+        write_congestion_events(still_open, args.output)
+    logger.info(f"{detector.events_reported} congestion events, {len(still_open)} still open -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
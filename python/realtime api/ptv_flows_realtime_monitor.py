@@ -18,30 +18,254 @@ import json
 import csv
 import time
 import hashlib
-from typing import Optional, List, Dict, Any, Tuple
+import queue
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, Tuple
 import logging
 from datetime import datetime
 
+import numpy as np
 import requests
-import dataprv_traffic_realtime_data_pb2
-from google.protobuf.timestamp_pb2 import Timestamp
+from ptv_flows_realtime import (TrafficColumns, NetworkStreets, ReplaySource, scan_traffic_columns,
+                                make_street_keys, read_snapshot_time, parse_replay_speed, STREET_FIELDS)
+from ptv_flows_realtime_archive import SnapshotArchive, DeltaSnapshotStore, to_epoch
+from ptv_flows_realtime_stats import StreetRollingStats, parse_window
+from ptv_flows_realtime_congestion import CongestionDetector, write_congestion_events
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+# Fields decoded for change detection; olr_code is only decoded when snapshots are saved
+CHANGE_FIELDS = ('id', 'from_node_id', 'speed_kmh', 'probe_count')
+
+LOG_FIELDS = ['timestamp', 'snapshot_time', 'total_records', 'changes_detected',
+              'new_records', 'updated_records', 'removed_records', 'data_hash']
+
+
+def payload_hash(data: bytes) -> str:
+    """Short hash of raw payload bytes (identical downloads are detected without decoding)."""
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def canonical_snapshot(columns: TrafficColumns) -> Tuple[np.ndarray, TrafficColumns, str]:
+    """
+    Sorts the streets of a snapshot by street key and hashes the sorted columns.
+    
+    The hash only depends on the street keys, speeds and probe counts, not on the order
+    of the streets in the payload. A street that appears more than once keeps its last
+    record, so the keys are unique (as diff_snapshots requires).
+    
+    Returns:
+        (sorted unique street keys, columns in key order, data hash)
+    """
+    keys = make_street_keys(columns.ids, columns.from_node_ids)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    # The stable sort keeps payload order within equal keys: the last of each run is the last record
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+    if not last.all():
+        logger.warning(f"Ignoring {int((~last).sum())} duplicate street record(s) in the snapshot")
+        order, keys = order[last], keys[last]
+    columns = columns.take(order)
+    
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(keys.tobytes())
+    digest.update(columns.speeds.tobytes())
+    if columns.probe_counts is not None:
+        digest.update(columns.probe_counts.tobytes())
+    return keys, columns, digest.hexdigest()
+
+
+def diff_snapshots(previous_keys: np.ndarray, previous_speeds: np.ndarray,
+                   keys: np.ndarray, speeds: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Compares two snapshots with sorted, unique street keys.
+    
+    Returns:
+        Dictionary with the street keys that are new and removed, and 'changed' and
+        'previous_index': the positions of the streets with a different speed in the
+        current and in the previous snapshot
+    """
+    _, current_index, previous_index = np.intersect1d(keys, previous_keys, assume_unique=True,
+                                                      return_indices=True)
+    differs = speeds[current_index] != previous_speeds[previous_index]
+    new = np.ones(len(keys), dtype=bool)
+    new[current_index] = False
+    removed = np.ones(len(previous_keys), dtype=bool)
+    removed[previous_index] = False
+    return {
+        'new': keys[new],
+        'removed': previous_keys[removed],
+        'changed': current_index[differs],
+        'previous_index': previous_index[differs],
+    }
+
+
+class PollScheduler:
+    """
+    Plans poll times on the monotonic clock, aligned with the snapshot publishing cadence.
+    
+    Until the cadence is known, polls run every `interval` seconds measured from the start
+    of the previous poll (not from the end of its processing), so the period does not drift.
+    Once two new snapshots have been seen, the cadence is the median step between recent
+    snapshot_date_time values and the publishing delay is the smallest observed gap between
+    a snapshot's time and the moment it was first downloaded. The next poll is then planned
+    `lead` seconds after the next snapshot is expected. If it has not appeared yet, or a
+    poll failed or returned no snapshot time, the scheduler retries with a growing backoff,
+    capped at the cadence.
+    """
+    
+    def __init__(self, interval: float, lead: float = 2.0, adaptive: bool = True, history: int = 10):
+        self.interval = interval
+        self.lead = lead
+        self.adaptive = adaptive
+        self.snapshot_times = deque(maxlen=history)   # epoch seconds of the distinct snapshots seen
+        self.publish_delays = deque(maxlen=history)   # first download time - snapshot time, seconds
+        self.misses = 0                               # polls since the last new snapshot
+        self.next_poll = time.monotonic()
+    
+    def cadence(self) -> Optional[float]:
+        """Estimated seconds between published snapshots, or None while unknown."""
+        if len(self.snapshot_times) < 2:
+            return None
+        steps = np.diff(np.array(self.snapshot_times, dtype=np.float64))
+        return float(np.median(steps))
+    
+    def observe(self, snapshot_time: Optional[datetime], fetched_at: float) -> bool:
+        """
+        Records the snapshot time of a download.
+        
+        Args:
+            snapshot_time: snapshot_date_time of the payload (naive UTC), None if unknown
+            fetched_at: Wall-clock time (time.time()) when the download completed
+            
+        Returns:
+            True if the snapshot is newer than every snapshot seen before
+        """
+        if snapshot_time is None:
+            self.miss()
+            return True
+        seconds = to_epoch(snapshot_time)
+        if self.snapshot_times and seconds <= self.snapshot_times[-1]:
+            self.misses += 1
+            return False
+        self.snapshot_times.append(seconds)
+        self.publish_delays.append(fetched_at - seconds)
+        self.misses = 0
+        return True
+    
+    def miss(self):
+        """Records a poll that failed or did not reveal a snapshot time."""
+        self.misses += 1
+    
+    def plan(self) -> float:
+        """Plans the next poll and returns its monotonic deadline."""
+        now = time.monotonic()
+        cadence = self.cadence() if self.adaptive else None
+        if cadence is None or cadence <= 0:
+            # Fixed period; ticks that were missed while processing are skipped, not bunched up
+            self.next_poll += self.interval
+            if self.next_poll < now:
+                missed = np.ceil((now - self.next_poll) / self.interval) if self.interval > 0 else 0
+                self.next_poll += missed * self.interval
+        elif self.misses:
+            # Expected snapshot is late: back off, but never wait longer than one cadence
+            retry = max(1.0, 0.05 * cadence) * 2 ** (self.misses - 1)
+            self.next_poll = now + min(retry, cadence)
+        else:
+            expected = self.snapshot_times[-1] + cadence + min(self.publish_delays) + self.lead
+            self.next_poll = now + max(0.0, expected - time.time())
+        return self.next_poll
+    
+    def wait(self):
+        """Sleeps until the planned poll time."""
+        remaining = self.next_poll - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+class MonitoringStats:
+    """Running aggregates of the monitoring log, updated per call in O(1)."""
+    
+    def __init__(self):
+        self.calls = 0
+        self.changes = 0
+        self.records_sum = 0
+        self.min_records = None
+        self.max_records = None
+        self.new_records = 0
+        self.updated_records = 0
+        self.removed_records = 0
+    
+    def update(self, changes: Dict[str, Any]):
+        """Adds one monitoring call (the result of detect_changes)."""
+        total = changes['total_records']
+        self.calls += 1
+        self.changes += bool(changes['has_changes'])
+        self.records_sum += total
+        self.min_records = total if self.min_records is None else min(self.min_records, total)
+        self.max_records = total if self.max_records is None else max(self.max_records, total)
+        self.new_records += changes['new_records']
+        self.updated_records += changes['updated_records']
+        self.removed_records += changes['removed_records']
+    
+    @property
+    def mean_records(self) -> float:
+        return self.records_sum / self.calls if self.calls else 0.0
+    
+    @property
+    def change_rate(self) -> float:
+        """Share of calls that detected changes."""
+        return self.changes / self.calls if self.calls else 0.0
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {'calls': self.calls, 'calls_with_changes': self.changes, 'change_rate': self.change_rate,
+                'mean_records': self.mean_records, 'min_records': self.min_records,
+                'max_records': self.max_records, 'new_records': self.new_records,
+                'updated_records': self.updated_records, 'removed_records': self.removed_records}
+
+
 class RealtimeTrafficMonitor:
     """Monitors real-time traffic data and tracks changes."""
     
-    def __init__(self, api_key: str, endpoint: str, output_dir: str = "."):
+    def __init__(self, api_key: str, endpoint: str, output_dir: str = ".", archive_dir: Optional[str] = None,
+                 delta_store_dir: Optional[str] = None, keyframe_interval: int = 30,
+                 session: Optional[requests.Session] = None, flush_interval: float = 10.0,
+                 rolling_stats_path: Optional[str] = None, stats_windows=(900, 3600), checkpoint_interval: int = 10,
+                 congestion: Optional[CongestionDetector] = None, congestion_events_path: Optional[str] = None,
+                 source: Optional[ReplaySource] = None):
         self.api_key = api_key
         self.endpoint = endpoint
+        self.session = session         # shared connection pool (see ptv_flows_realtime_supervisor.py)
+        self.source = source           # recorded payloads replayed instead of downloading (offline runs)
         self.output_dir = output_dir
-        self.previous_data = None
+        self.previous_keys = None      # sorted street keys of the previous snapshot
+        self.previous_speeds = None    # speeds in previous_keys order
         self.previous_hash = None
+        self.previous_payload_hash = None
         self.previous_snapshot_time = None
         self.difference_info = []
+        self.scan_fields = CHANGE_FIELDS
+        self.dropped_snapshots = 0
+        self.started = datetime.now()
+        self.stats = MonitoringStats()      # summary of the log, available while monitoring
+        self.flush_interval = flush_interval
+        # Speeds of every new snapshot (see ptv_flows_realtime_archive.py)
+        self.archive = SnapshotArchive(archive_dir) if archive_dir else None
+        # Keyframes plus changed speeds only (see DeltaSnapshotStore)
+        self.delta_store = DeltaSnapshotStore(delta_store_dir, keyframe_interval) if delta_store_dir else None
+        # Per-street EWMA, spread, min/max and percentiles, checkpointed every checkpoint_interval snapshots
+        self.rolling_stats_path = rolling_stats_path
+        self.rolling_stats = StreetRollingStats.open(rolling_stats_path, stats_windows) if rolling_stats_path else None
+        self.checkpoint_interval = checkpoint_interval
+        self._updates_since_checkpoint = 0
+        # Congestion events from speed / free-flow speed, fed with the changed streets only
+        self.congestion = congestion
+        self.congestion_events_path = congestion_events_path or os.path.join(output_dir, "congestion_events.csv")
         
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
@@ -51,136 +275,150 @@ class RealtimeTrafficMonitor:
         self._init_log_file()
     
     def _init_log_file(self):
-        """Initialize the monitoring log CSV file."""
+        """Open the monitoring log CSV file; it stays open until close()."""
+        self._log_handle = None
         try:
-            with open(self.log_file, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['timestamp', 'snapshot_time', 'total_records', 'changes_detected', 
-                             'new_records', 'updated_records', 'data_hash']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
+            self._log_handle = open(self.log_file, 'w', newline='', encoding='utf-8')
+            self._log_writer = csv.DictWriter(self._log_handle, fieldnames=LOG_FIELDS)
+            self._log_writer.writeheader()
+            self._log_handle.flush()
+            self._last_flush = time.monotonic()
             logger.info(f"Initialized monitoring log: {self.log_file}")
         except Exception as e:
             logger.error(f"Error initializing log file: {e}")
     
+    def flush_log(self):
+        """Write buffered log rows to disk."""
+        if self._log_handle is not None:
+            self._log_handle.flush()
+            self._last_flush = time.monotonic()
+    
+    def detect_congestion(self, snapshot_time: datetime, keys: np.ndarray, speeds: np.ndarray,
+                          diff: Optional[Dict[str, np.ndarray]]):
+        """Feed the streets that changed (all streets on the first snapshot) to the congestion detector."""
+        if diff is not None:
+            positions = np.concatenate([diff['changed'], np.searchsorted(keys, diff['new'])])
+            keys, speeds = keys[positions], speeds[positions]
+        events = self.congestion.update(snapshot_time, keys, speeds)
+        if len(events):
+            write_congestion_events(events, self.congestion_events_path)
+            logger.info(f"{len(events)} congestion event(s) ended, {self.congestion.open_count} open")
+    
+    def save_rolling_stats(self):
+        """Checkpoint the rolling street statistics."""
+        try:
+            self.rolling_stats.save(self.rolling_stats_path)
+            self._updates_since_checkpoint = 0
+        except Exception as e:
+            logger.error(f"Error saving rolling statistics: {e}")
+    
+    def close(self):
+        """Flush and close the monitoring log and write a final statistics checkpoint."""
+        if self._log_handle is not None:
+            self._log_handle.close()
+            self._log_handle = None
+        if self.rolling_stats is not None and self._updates_since_checkpoint:
+            self.save_rolling_stats()
+        if self.congestion is not None:
+            # Events still in progress are written without an end
+            still_open = self.congestion.open_events()
+            if len(still_open):
+                write_congestion_events(still_open, self.congestion_events_path)
+    
     def fetch_data(self) -> Optional[bytes]:
         """Fetch real-time data from the API."""
+        if self.source is not None:
+            return self.source.fetch()
         headers = {'apiKey': self.api_key}
         
         try:
-            response = requests.get(self.endpoint, headers=headers)
+            response = (self.session or requests).get(self.endpoint, headers=headers)
             response.raise_for_status()
             return response.content
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching data: {e}")
-            if hasattr(response, 'status_code'):
+            response = e.response
+            if response is not None:
                 if response.status_code == 401:
                     logger.error("Authentication failed. Please check your API key.")
                 elif response.status_code == 403:
                     logger.error("Access forbidden. Please check your API key permissions.")
             return None
     
-    def parse_data(self, data: bytes) -> Optional[dataprv_traffic_realtime_data_pb2.DataprvTrafficRealtimeDataProto]:
-        """Parse protobuf data."""
+    def decode_snapshot(self, data: bytes) -> Optional[Tuple[np.ndarray, TrafficColumns, str]]:
+        """Decode raw protobuf data into key-sorted columns (see canonical_snapshot)."""
         try:
-            message = dataprv_traffic_realtime_data_pb2.DataprvTrafficRealtimeDataProto()
-            message.ParseFromString(data)
-            return message
+            return canonical_snapshot(scan_traffic_columns(data, fields=self.scan_fields))
         except Exception as e:
             logger.error(f"Error parsing protobuf data: {e}")
             return None
     
-    def extract_traffic_data(self, message) -> Tuple[List[Dict], str]:
-        """Extract and normalize traffic data."""
-        snapshot_time = message.snapshot_date_time.ToDatetime()
-        
-        # Sort by olr_code for consistent ordering
-        street_traffic_list = sorted(message.street_traffic, key=lambda x: x.olr_code)
-        
-        # Create normalized data structure
-        traffic_data = []
-        for street in street_traffic_list:
-            street_record = {
-                'id': street.id,
-                'from_node_id': street.from_node_id,
-                'speed_kmh': street.speed_kmh,
-                'olr_code': street.olr_code
-            }
-            
-            # Add probe count if available
-            if hasattr(street, 'probe_count'):
-                street_record['probe_count'] = street.probe_count
-                
-            traffic_data.append(street_record)
-        
-        # Create hash for change detection
-        data_string = json.dumps(traffic_data, sort_keys=True)
-        data_hash = hashlib.sha256(data_string.encode()).hexdigest()[:16]
-        
-        return traffic_data, data_hash
-    
-    def detect_changes(self, current_data: List[Dict], current_hash: str) -> Dict[str, Any]:
+    def detect_changes(self, keys: np.ndarray, speeds: np.ndarray, current_hash: str) -> Dict[str, Any]:
         """Detect changes between current and previous data."""
         changes = {
             'has_changes': False,
             'new_records': 0,
             'updated_records': 0,
-            'total_records': len(current_data)
+            'removed_records': 0,
+            'total_records': len(keys),
+            'diff': None
         }
         
-        if self.previous_data is None:
+        if self.previous_keys is None:
             changes['has_changes'] = True
-            changes['new_records'] = len(current_data)
+            changes['new_records'] = len(keys)
             logger.info("First data collection - all records are new")
         elif current_hash != self.previous_hash:
             changes['has_changes'] = True
             
-            # Create lookup dictionaries for comparison
-            prev_by_id = {record['id']: record for record in self.previous_data}
-            curr_by_id = {record['id']: record for record in current_data}
-            
-            # Count new records
-            new_ids = set(curr_by_id.keys()) - set(prev_by_id.keys())
-            changes['new_records'] = len(new_ids)
-            
-            # Count updated records (same ID but different data)
-            for record_id in curr_by_id:
-                if record_id in prev_by_id:
-                    curr_record = curr_by_id[record_id]
-                    prev_record = prev_by_id[record_id]
-                    
-                    # Compare speed (main changing attribute)
-                    if curr_record['speed_kmh'] != prev_record['speed_kmh']:
-                        changes['updated_records'] += 1
+            # Streets are matched on (id, from_node_id); speed is the main changing attribute
+            diff = diff_snapshots(self.previous_keys, self.previous_speeds, keys, speeds)
+            changes['new_records'] = len(diff['new'])
+            changes['removed_records'] = len(diff['removed'])
+            changes['updated_records'] = len(diff['changed'])
+            changes['diff'] = diff
             
-            logger.info(f"Changes detected: {changes['new_records']} new, {changes['updated_records']} updated")
+            logger.info(f"Changes detected: {changes['new_records']} new, {changes['updated_records']} updated, "
+                        f"{changes['removed_records']} removed")
         
         return changes
     
     def log_monitoring_data(self, snapshot_time: datetime, changes: Dict[str, Any], data_hash: str):
-        """Log monitoring information to CSV file."""
+        """Log monitoring information to CSV file and update the running statistics."""
+        self.stats.update(changes)
+        if self._log_handle is None:
+            return
         try:
-            with open(self.log_file, 'a', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['timestamp', 'snapshot_time', 'total_records', 'changes_detected', 
-                             'new_records', 'updated_records', 'data_hash']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                
-                writer.writerow({
-                    'timestamp': datetime.now().isoformat(),
-                    'snapshot_time': snapshot_time.isoformat() if snapshot_time else None,
-                    'total_records': changes['total_records'],
-                    'changes_detected': changes['has_changes'],
-                    'new_records': changes['new_records'],
-                    'updated_records': changes['updated_records'],
-                    'data_hash': data_hash
-                })
+            self._log_writer.writerow({
+                'timestamp': datetime.now().isoformat(),
+                'snapshot_time': snapshot_time.isoformat() if snapshot_time else None,
+                'total_records': changes['total_records'],
+                'changes_detected': changes['has_changes'],
+                'new_records': changes['new_records'],
+                'updated_records': changes['updated_records'],
+                'removed_records': changes['removed_records'],
+                'data_hash': data_hash
+            })
+            # Rows are buffered; flush at most every flush_interval seconds
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush_log()
         except Exception as e:
             logger.error(f"Error logging monitoring data: {e}")
     
-    def save_snapshot(self, data: List[Dict], snapshot_time: datetime, call_number: int):
+    def save_snapshot(self, columns: TrafficColumns, snapshot_time: datetime, call_number: int):
         """Save data snapshot when changes are detected."""
-        if not data:
+        if not len(columns):
             return
+        
+        data = [
+            {'id': street_id, 'from_node_id': from_node_id, 'speed_kmh': speed,
+             'olr_code': olr_code, 'probe_count': probe_count}
+            for street_id, from_node_id, speed, olr_code, probe_count in zip(
+                columns.ids.tolist(), columns.from_node_ids.tolist(),
+                columns.speeds.astype(str).astype(np.float64).tolist(),
+                columns.olr_code_array().tolist(), columns.probe_counts.tolist())
+        ]
             
         timestamp_str = snapshot_time.strftime('%Y%m%d_%H%M%S') if snapshot_time else datetime.now().strftime('%Y%m%d_%H%M%S')
         
@@ -198,63 +436,193 @@ class RealtimeTrafficMonitor:
         except Exception as e:
             logger.error(f"Error saving snapshot: {e}")
     
-    def monitor(self, max_calls: int = 100, interval: int = 60, save_snapshots: bool = False):
-        """Main monitoring loop."""
+    def analyze(self, call_number: int, raw_data: bytes,
+                snapshot_time: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        """
+        Decode one download and compare it with the previous snapshot (analyze stage).
+        
+        Args:
+            call_number: Monitoring call that downloaded the data
+            raw_data: Raw protobuf data
+            snapshot_time: snapshot_date_time read by the fetch stage, if known
+            
+        Returns:
+            Work item for the write stage, or None if the data could not be parsed
+        """
+        raw_hash = payload_hash(raw_data)
+        same_snapshot = snapshot_time is not None and snapshot_time == self.previous_snapshot_time
+        if raw_hash == self.previous_payload_hash or same_snapshot:
+            # Byte-identical download or snapshot already seen: nothing to decode or compare
+            changes = {'has_changes': False, 'new_records': 0, 'updated_records': 0,
+                       'removed_records': 0, 'total_records': len(self.previous_keys), 'diff': None}
+            return {'call_number': call_number, 'snapshot_time': self.previous_snapshot_time,
+                    'changes': changes, 'data_hash': self.previous_hash, 'keys': None, 'columns': None}
+        
+        decoded = self.decode_snapshot(raw_data)
+        if decoded is None:
+            return None
+        keys, columns, current_hash = decoded
+        snapshot_time = columns.snapshot_time
+        
+        # Detect changes
+        changes = self.detect_changes(keys, columns.speeds, current_hash)
+        
+        # Update previous data
+        self.previous_keys = keys
+        self.previous_speeds = columns.speeds
+        self.previous_hash = current_hash
+        self.previous_payload_hash = raw_hash
+        self.previous_snapshot_time = snapshot_time
+        
+        return {'call_number': call_number, 'snapshot_time': snapshot_time, 'changes': changes,
+                'data_hash': current_hash, 'keys': keys, 'columns': columns}
+    
+    def write(self, item: Dict[str, Any], save_snapshots: bool):
+        """Log one analyzed snapshot and store it if it changed (write stage)."""
+        changes = item['changes']
+        snapshot_time = item['snapshot_time']
+        
+        # Log monitoring information
+        self.log_monitoring_data(snapshot_time, changes, item['data_hash'])
+        
+        if changes['has_changes'] and item['columns'] is not None:
+            # Save snapshot if changes detected and snapshots enabled
+            if save_snapshots:
+                self.save_snapshot(item['columns'], snapshot_time, item['call_number'])
+            if snapshot_time is not None:
+                if self.archive is not None:
+                    self.archive.append(snapshot_time, item['keys'], item['columns'].speeds)
+                if self.delta_store is not None:
+                    self.delta_store.append(snapshot_time, item['keys'], item['columns'].speeds)
+                if self.rolling_stats is not None:
+                    if self.rolling_stats.update(snapshot_time, item['keys'], item['columns'].speeds):
+                        self._updates_since_checkpoint += 1
+                    if self._updates_since_checkpoint >= self.checkpoint_interval:
+                        self.save_rolling_stats()
+                if self.congestion is not None:
+                    self.detect_congestion(snapshot_time, item['keys'], item['columns'].speeds, changes['diff'])
+        
+        # Display progress
+        logger.info(f"Call {item['call_number']}: {changes['total_records']} records, "
+                   f"Changes: {'Yes' if changes['has_changes'] else 'No'} "
+                   f"(change rate {self.stats.change_rate:.0%})")
+    
+    def _put_latest(self, work_queue: queue.Queue, item):
+        """Put without blocking; if the queue is full, the oldest (stale) download is dropped."""
+        while True:
+            try:
+                work_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    stale = work_queue.get_nowait()
+                    self.dropped_snapshots += 1
+                    logger.warning(f"Processing is behind, dropped download of call {stale[0]}")
+                except queue.Empty:
+                    pass
+    
+    def _analyze_stage(self, parse_queue: queue.Queue, write_queue: queue.Queue):
+        while True:
+            work = parse_queue.get()
+            if work is None:
+                write_queue.put(None)
+                return
+            call_number, raw_data, snapshot_time = work
+            try:
+                item = self.analyze(call_number, raw_data, snapshot_time)
+                if item is None:
+                    logger.error(f"Failed to parse data of call {call_number}, skipping it")
+                else:
+                    # Blocks while the writer is behind, which makes the fetch stage drop stale downloads
+                    write_queue.put(item)
+            except Exception as e:
+                logger.error(f"Error analyzing call {call_number}: {e}")
+    
+    def _write_stage(self, write_queue: queue.Queue, save_snapshots: bool):
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            try:
+                self.write(item, save_snapshots)
+            except Exception as e:
+                logger.error(f"Error writing call {item['call_number']}: {e}")
+    
+    def monitor(self, max_calls: int = 100, interval: int = 60, save_snapshots: bool = False,
+                queue_size: int = 2, adaptive: bool = True, poll_lead: float = 2.0, drop_stale: bool = True):
+        """
+        Main monitoring loop.
+        
+        Fetching, analyzing (decode + change detection) and writing (log, snapshots, archives)
+        run in separate threads connected by bounded queues, so a slow write does not delay
+        the next download. If analysis falls behind, the oldest queued download is dropped
+        in favour of the newest one.
+        
+        Polls are planned by a PollScheduler: every `interval` seconds until the publishing
+        cadence has been learned from snapshot_date_time, then shortly after each expected
+        new snapshot (unless adaptive is False).
+        
+        With drop_stale=False no download is dropped: the fetch stage waits for the analysis
+        instead (used when replaying recordings, where every payload must be processed).
+        """
         logger.info(f"Starting traffic monitoring - Max calls: {max_calls}, Interval: {interval}s")
         logger.info(f"Endpoint: {self.endpoint}")
         logger.info(f"Output directory: {self.output_dir}")
+        self.scan_fields = tuple(STREET_FIELDS) if save_snapshots else CHANGE_FIELDS
         
-        for call_number in range(1, max_calls + 1):
-            logger.info(f"Monitoring call {call_number}/{max_calls}")
-            
-            try:
-                # Fetch and parse data
+        parse_queue = queue.Queue(maxsize=queue_size)
+        write_queue = queue.Queue(maxsize=queue_size)
+        stages = [
+            threading.Thread(target=self._analyze_stage, args=(parse_queue, write_queue), name='analyze', daemon=True),
+            threading.Thread(target=self._write_stage, args=(write_queue, save_snapshots), name='write', daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        scheduler = PollScheduler(interval, lead=poll_lead, adaptive=adaptive)
+        
+        try:
+            for call_number in range(1, max_calls + 1):
+                logger.info(f"Monitoring call {call_number}/{max_calls}")
+                
                 raw_data = self.fetch_data()
+                if raw_data is None and self.source is not None:
+                    logger.info("All recorded payloads have been replayed")
+                    break
                 if raw_data is None:
                     logger.error("Failed to fetch data, skipping this iteration")
-                    continue
-                
-                message = self.parse_data(raw_data)
-                if message is None:
-                    logger.error("Failed to parse data, skipping this iteration")
-                    continue
-                
-                # Extract traffic data
-                current_data, current_hash = self.extract_traffic_data(message)
-                snapshot_time = message.snapshot_date_time.ToDatetime() if message.snapshot_date_time else None
-                
-                # Detect changes
-                changes = self.detect_changes(current_data, current_hash)
-                
-                # Log monitoring information
-                self.log_monitoring_data(snapshot_time, changes, current_hash)
-                
-                # Save snapshot if changes detected and snapshots enabled
-                if changes['has_changes'] and save_snapshots:
-                    self.save_snapshot(current_data, snapshot_time, call_number)
-                
-                # Update previous data
-                self.previous_data = current_data
-                self.previous_hash = current_hash
-                self.previous_snapshot_time = snapshot_time
-                
-                # Display progress
-                logger.info(f"Call {call_number}: {changes['total_records']} records, "
-                           f"Changes: {'Yes' if changes['has_changes'] else 'No'}")
+                    scheduler.miss()
+                else:
+                    try:
+                        snapshot_time = read_snapshot_time(raw_data)
+                    except Exception:
+                        snapshot_time = None   # left to the analyze stage to report
+                    if not scheduler.observe(snapshot_time, time.time()):
+                        logger.info(f"Snapshot {snapshot_time.isoformat()} was already seen")
+                    if drop_stale:
+                        self._put_latest(parse_queue, (call_number, raw_data, snapshot_time))
+                    else:
+                        parse_queue.put((call_number, raw_data, snapshot_time))
                 
                 # Wait for next iteration (except for last call)
                 if call_number < max_calls:
-                    logger.info(f"Waiting {interval} seconds...")
-                    time.sleep(interval)
-                    
-            except KeyboardInterrupt:
-                logger.info("Monitoring interrupted by user")
-                break
-            except Exception as e:
-                logger.error(f"Error in monitoring iteration {call_number}: {e}")
-                continue
+                    wait = scheduler.plan() - time.monotonic()
+                    cadence = scheduler.cadence()
+                    logger.info(f"Waiting {max(wait, 0):.1f} seconds..."
+                                + (f" (snapshot cadence {cadence:.0f}s)" if adaptive and cadence else ""))
+                    scheduler.wait()
+        except KeyboardInterrupt:
+            logger.info("Monitoring interrupted by user")
+        finally:
+            # Let the stages finish the queued work
+            parse_queue.put(None)
+            for stage in stages:
+                stage.join()
+        
+        if self.dropped_snapshots:
+            logger.warning(f"Dropped {self.dropped_snapshots} stale download(s) because processing was behind")
         
         # Generate monitoring summary
+        self.close()
         self.generate_summary()
         logger.info("Monitoring completed")
     
@@ -266,26 +634,35 @@ class RealtimeTrafficMonitor:
             with open(summary_path, 'w', encoding='utf-8') as f:
                 f.write("PTV Flows Real-time Traffic Monitoring Summary\n")
                 f.write("=" * 50 + "\n\n")
-                f.write(f"Monitoring started: {datetime.now().isoformat()}\n")
+                f.write(f"Monitoring started: {self.started.isoformat()}\n")
                 f.write(f"Endpoint: {self.endpoint}\n")
                 f.write(f"Log file: {self.log_file}\n\n")
                 
-                # Read and analyze log data
-                if os.path.exists(self.log_file):
-                    try:
-                        import pandas as pd
-                        df = pd.read_csv(self.log_file)
-                        
-                        f.write(f"Total monitoring calls: {len(df)}\n")
-                        f.write(f"Calls with changes: {df['changes_detected'].sum()}\n")
-                        f.write(f"Average records per call: {df['total_records'].mean():.1f}\n")
-                        f.write(f"Max records in a call: {df['total_records'].max()}\n")
-                        f.write(f"Min records in a call: {df['total_records'].min()}\n")
-                        
-                    except ImportError:
-                        f.write("Pandas not available for detailed statistics\n")
-                    except Exception as e:
-                        f.write(f"Error analyzing log data: {e}\n")
+                # Running aggregates of the log (see MonitoringStats)
+                stats = self.stats
+                f.write(f"Total monitoring calls: {stats.calls}\n")
+                f.write(f"Calls with changes: {stats.changes} ({stats.change_rate:.1%})\n")
+                if stats.calls:
+                    f.write(f"Average records per call: {stats.mean_records:.1f}\n")
+                    f.write(f"Max records in a call: {stats.max_records}\n")
+                    f.write(f"Min records in a call: {stats.min_records}\n")
+                    f.write(f"Streets new/updated/removed: {stats.new_records}/{stats.updated_records}/"
+                            f"{stats.removed_records}\n")
+                if self.dropped_snapshots:
+                    f.write(f"Dropped stale downloads: {self.dropped_snapshots}\n")
+                if self.congestion is not None:
+                    f.write(f"Congestion events: {self.congestion.events_reported} ended, "
+                            f"{self.congestion.open_count} still open ({self.congestion_events_path})\n")
+                
+                if self.delta_store is not None:
+                    stats = self.delta_store.stats()
+                    if stats['snapshots']:
+                        f.write(f"\nDelta store: {self.delta_store.directory}\n")
+                        f.write(f"Stored snapshots: {stats['snapshots']} ({stats['keyframes']} keyframes)\n")
+                        f.write(f"Compression ratio: {stats['compression_ratio']:.1f}x "
+                                f"({stats['raw_mb']:.1f} MB -> {stats['stored_mb']:.1f} MB)\n")
+                        f.write(f"Reconstruction latency: {stats['reconstruct_ms_mean']:.1f} ms mean, "
+                                f"{stats['reconstruct_ms_max']:.1f} ms max\n")
             
             logger.info(f"Generated monitoring summary: {summary_path}")
             
@@ -340,12 +717,49 @@ def main():
                        help='API endpoint URL (if not provided, will prompt user)')
     parser.add_argument('--output-dir', type=str, default='./monitoring_output',
                        help='Output directory for monitoring files (default: ./monitoring_output)')
-    parser.add_argument('--max-calls', type=int, default=100,
-                       help='Maximum number of API calls (default: 100)')
+    parser.add_argument('--max-calls', type=int,
+                       help='Maximum number of API calls (default: 100, with --replay: every recording)')
     parser.add_argument('--interval', type=int, default=60,
                        help='Interval between calls in seconds (default: 60)')
     parser.add_argument('--save-snapshots', action='store_true',
                        help='Save data snapshots when changes are detected')
+    parser.add_argument('--archive', type=str,
+                       help='Append the speeds of every changed snapshot to this archive directory '
+                            '(query it with ptv_flows_realtime_archive.py)')
+    parser.add_argument('--delta-store', type=str,
+                       help='Store changed snapshots as keyframes plus changed speeds in this directory')
+    parser.add_argument('--keyframe-interval', type=int, default=30,
+                       help='Snapshots per keyframe in the delta store (default: 30)')
+    parser.add_argument('--rolling-stats', type=str,
+                       help='Keep rolling per-street statistics and checkpoint them to this .npz file '
+                            '(inspect it with ptv_flows_realtime_stats.py)')
+    parser.add_argument('--stats-windows', type=str, default='15m,1h',
+                       help='Comma-separated windows for --rolling-stats (default: 15m,1h)')
+    parser.add_argument('--checkpoint-interval', type=int, default=10,
+                       help='Snapshots between rolling statistics checkpoints (default: 10)')
+    parser.add_argument('--network', type=str,
+                       help='Network CSV exported by ptv_flows_downloader.py; enables congestion event detection')
+    parser.add_argument('--congestion-events', type=str,
+                       help='Congestion events CSV (default: congestion_events.csv in the output directory)')
+    parser.add_argument('--congestion-enter', type=float, default=0.5,
+                       help='Speed / free-flow speed below which a congestion event opens (default: 0.5)')
+    parser.add_argument('--congestion-exit', type=float, default=0.7,
+                       help='Ratio at or above which a congestion event closes (default: 0.7)')
+    parser.add_argument('--congestion-min-duration', type=int, default=300,
+                       help='Shortest reported congestion event in seconds (default: 300)')
+    parser.add_argument('--queue-size', type=int, default=2,
+                       help='Downloads/results buffered between pipeline stages (default: 2)')
+    parser.add_argument('--flush-interval', type=float, default=10.0,
+                       help='Seconds between flushes of the monitoring log (default: 10)')
+    parser.add_argument('--fixed-interval', action='store_true',
+                       help='Always poll every --interval seconds instead of following the snapshot cadence')
+    parser.add_argument('--poll-lead', type=float, default=2.0,
+                       help='Seconds after the expected next snapshot to poll (default: 2)')
+    parser.add_argument('--replay', type=str,
+                       help='Monitor recorded payloads (a directory of realtime_data_raw_*.bin files) '
+                            'instead of the API; implies --no-interactive')
+    parser.add_argument('--replay-speed', type=parse_replay_speed, default=1.0,
+                       help='Replay pace: 1 = as recorded, 10 = ten times faster, max = no waiting (default: 1)')
     parser.add_argument('--no-interactive', action='store_true',
                        help='Skip interactive configuration prompts')
     
@@ -355,14 +769,26 @@ def main():
     default_api_key = "change_me_to_your_api_key"
     api_key = args.api_key or default_api_key
     
-    if api_key == default_api_key:
+    if api_key == default_api_key and not args.replay:
         logger.warning("Using default placeholder API key. Please provide your actual API key using --api-key")
         logger.warning("Get your API key from: https://ptvgroup.tech/flows/")
     
     # Get configuration
-    if args.no_interactive:
+    source = None
+    if args.replay:
+        # Recorded payloads are processed one by one at the recorded pace (scaled by --replay-speed)
+        try:
+            source = ReplaySource(args.replay, args.replay_speed)
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot replay {args.replay}: {e}")
+            sys.exit(1)
+        endpoint = f"replay of {args.replay}"
+        max_calls = len(source) if args.max_calls is None else min(args.max_calls, len(source))
+        interval = 0
+        save_snapshots = args.save_snapshots
+    elif args.no_interactive:
         endpoint = args.endpoint or "https://api.ptvgroup.tech/flows/realtime-traffic/v1/realtime/traffic"
-        max_calls = args.max_calls
+        max_calls = args.max_calls if args.max_calls is not None else 100
         interval = args.interval
         save_snapshots = args.save_snapshots
     else:
@@ -370,7 +796,7 @@ def main():
         # Override with command line arguments if provided
         if args.endpoint:
             endpoint = args.endpoint
-        if args.max_calls != 100:
+        if args.max_calls is not None:
             max_calls = args.max_calls
         if args.interval != 60:
             interval = args.interval
@@ -378,11 +804,31 @@ def main():
             save_snapshots = True
     
     try:
+        congestion = None
+        if args.network:
+            congestion = CongestionDetector(NetworkStreets.from_csv(args.network), args.congestion_enter,
+                                            args.congestion_exit, args.congestion_min_duration)
+        
         # Initialize monitor
-        monitor = RealtimeTrafficMonitor(api_key, endpoint, args.output_dir)
+        monitor = RealtimeTrafficMonitor(api_key, endpoint, args.output_dir, archive_dir=args.archive,
+                                         delta_store_dir=args.delta_store,
+                                         keyframe_interval=args.keyframe_interval,
+                                         flush_interval=args.flush_interval,
+                                         rolling_stats_path=args.rolling_stats,
+                                         stats_windows=[parse_window(w) for w in args.stats_windows.split(',')],
+                                         checkpoint_interval=args.checkpoint_interval,
+                                         congestion=congestion, congestion_events_path=args.congestion_events,
+                                         source=source)
         
         # Start monitoring
-        monitor.monitor(max_calls, interval, save_snapshots)
+        started = time.perf_counter()
+        monitor.monitor(max_calls, interval, save_snapshots, queue_size=args.queue_size,
+                        adaptive=not args.fixed_interval and source is None, poll_lead=args.poll_lead,
+                        drop_stale=source is None)
+        if source is not None:
+            elapsed = time.perf_counter() - started
+            logger.info(f"Replayed {monitor.stats.calls} payloads ({monitor.stats.records_sum} streets) "
+                        f"in {elapsed:.2f}s: {monitor.stats.records_sum / elapsed:,.0f} streets/s")
         
     except KeyboardInterrupt:
         logger.info("Monitoring cancelled by user")
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+PTV Flows Realtime Rolling Street Statistics
+
+Per-street statistics of the realtime speeds, maintained incrementally as snapshots arrive
+(ptv_flows_realtime_monitor.py --rolling-stats). For every configured window (e.g. 15
+minutes and 1 hour) each street has:
+
+    ewma        exponentially weighted mean speed (time constant = window)
+    std         exponentially weighted standard deviation
+    min / max   minimum and maximum speed over roughly the last window
+    p15/p50/p85 approximate percentiles
+
+All state lives in NumPy arrays aligned with the sorted street keys, a few dozen bytes per
+street and window, independent of how many snapshots have been seen:
+
+- EWMA and variance use the time since the street's previous sample, so irregular
+  snapshots and streets missing from some snapshots are weighted correctly.
+- Rolling min/max keep one row per bucket of window / buckets seconds; the result covers
+  between (buckets - 1) / buckets of the window and the full window.
+- Percentiles are stochastic-approximation estimates: every sample moves the estimate by a
+  step proportional to the street's spread, up for samples above it and down for samples
+  below it, weighted so that it settles where the requested share of samples is lower.
+
+The state is checkpointed to a .npz file, so a restarted monitor continues where it stopped.
+
+Usage:
+    python ptv_flows_realtime_stats.py CHECKPOINT.npz [--window 1h] [--street ID:FROM_NODE_ID] [--output FILE]
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import logging
+from datetime import datetime
+from typing import Dict, Sequence
+
+import numpy as np
+from ptv_flows_realtime import make_street_keys, split_street_keys, parse_street_key
+from ptv_flows_realtime_archive import to_epoch, from_epoch
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (0.15, 0.50, 0.85)
+# Percentile step per sample, in standard deviations times the EWMA weight
+QUANTILE_GAIN = 3.0
+# Smallest spread (km/h) used for the percentile step, so constant speeds can still move
+MIN_SPREAD = 1.0
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_window(text: str) -> int:
+    """Parses a window such as "900", "15m", "1h" or "1d" into seconds."""
+    text = text.strip().lower()
+    unit = _UNITS.get(text[-1:])
+    seconds = float(text[:-1]) * unit if unit else float(text)
+    if seconds <= 0:
+        raise ValueError(f"Window must be positive: {text}")
+    return int(seconds)
+
+
+def format_window(seconds: int) -> str:
+    """Formats seconds as the shortest whole unit, e.g. 3600 -> "1h"."""
+    for unit in ('d', 'h', 'm'):
+        if seconds % _UNITS[unit] == 0:
+            return f"{seconds // _UNITS[unit]}{unit}"
+    return f"{seconds}s"
+
+
+class StreetRollingStats:
+    """Incremental per-street speed statistics over one or more time windows."""
+
+    def __init__(self, windows: Sequence[int] = (900, 3600), buckets: int = 4):
+        """
+        Args:
+            windows: Window lengths in seconds
+            buckets: Buckets per window for the rolling min/max
+        """
+        self.windows = [int(window) for window in windows]
+        self.buckets = buckets
+        self.keys = np.empty(0, dtype=np.int64)
+        self.last_time = np.empty(0, dtype=np.int64)     # epoch seconds of each street's last sample
+        self.samples = np.empty(0, dtype=np.int32)
+        self.snapshot_time = None                        # epoch seconds of the newest snapshot
+        self.state = {window: self._empty_window(0) for window in self.windows}
+        # Absolute bucket number held by each min/max row, per window
+        self.bucket_ids = {window: np.full(buckets, -1, dtype=np.int64) for window in self.windows}
+
+    def _empty_window(self, size: int) -> Dict[str, np.ndarray]:
+        state = {name: np.full(size, np.nan, dtype=np.float32)
+                 for name in ('ewma', 'var') + tuple(_percentile_name(q) for q in PERCENTILES)}
+        state['min'] = np.full((self.buckets, size), np.inf, dtype=np.float32)
+        state['max'] = np.full((self.buckets, size), -np.inf, dtype=np.float32)
+        return state
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _add_streets(self, new_keys: np.ndarray):
+        """Widens the state for streets seen for the first time (rare; keeps keys sorted)."""
+        keys = np.union1d(self.keys, new_keys)
+        old = np.searchsorted(keys, self.keys)
+        last_time = np.zeros(len(keys), dtype=np.int64)
+        last_time[old] = self.last_time
+        samples = np.zeros(len(keys), dtype=np.int32)
+        samples[old] = self.samples
+        for window in self.windows:
+            widened = self._empty_window(len(keys))
+            for name, values in self.state[window].items():
+                widened[name][..., old] = values
+            self.state[window] = widened
+        self.keys, self.last_time, self.samples = keys, last_time, samples
+
+    def update(self, snapshot_time: datetime, keys: np.ndarray, speeds: np.ndarray) -> bool:
+        """
+        Adds one snapshot.
+
+        Args:
+            snapshot_time: Snapshot time (naive UTC)
+            keys: Street keys (make_street_keys), any order
+            speeds: Speed per key (km/h); NaN speeds are ignored
+
+        Returns:
+            False if the snapshot is not newer than the last one and was skipped
+        """
+        now = to_epoch(snapshot_time)
+        if self.snapshot_time is not None and now <= self.snapshot_time:
+            logger.warning(f"Snapshot {snapshot_time} is not newer than the rolling statistics, skipped")
+            return False
+        valid = ~np.isnan(speeds)
+        keys = keys[valid]
+        speeds = speeds[valid].astype(np.float32)
+
+        index = np.searchsorted(self.keys, keys)
+        index[index == len(self.keys)] = 0
+        unknown = self.keys[index] != keys if len(self.keys) else np.ones(len(keys), dtype=bool)
+        if unknown.any():
+            self._add_streets(keys[unknown])
+            index = np.searchsorted(self.keys, keys)
+        if len(index) == len(self.keys) and np.array_equal(keys, self.keys):
+            index = slice(None)   # usual case: the snapshot has every street, in key order
+
+        first = self.samples[index] == 0
+        elapsed = (now - self.last_time[index]).astype(np.float32)
+        for window in self.windows:
+            self._update_window(window, now, index, speeds, elapsed, first)
+        self.last_time[index] = now
+        self.samples[index] += 1
+        self.snapshot_time = now
+        return True
+
+    def _update_window(self, window: int, now: int, index: np.ndarray, speeds: np.ndarray,
+                       elapsed: np.ndarray, first: np.ndarray):
+        state = self.state[window]
+        # Weight of the new sample: 1 - exp(-dt / window), 1 for a street's first sample
+        alpha = np.where(first, np.float32(1), -np.expm1(-elapsed / np.float32(window))).astype(np.float32)
+
+        mean = state['ewma'][index]
+        var = state['var'][index]
+        mean = np.where(first, speeds, mean)
+        var = np.where(first, np.float32(0), var)
+        diff = speeds - mean
+        increment = alpha * diff
+        mean_new = mean + increment
+        var_new = (1 - alpha) * (var + diff * increment)
+        state['ewma'][index] = mean_new
+        state['var'][index] = var_new
+
+        # Percentiles: move up by step * q when the sample is above, down by step * (1 - q) below
+        step = QUANTILE_GAIN * np.maximum(alpha, np.float32(1 / 64)) * np.maximum(np.sqrt(var_new), MIN_SPREAD)
+        for q in PERCENTILES:
+            name = _percentile_name(q)
+            estimate = state[name][index]
+            estimate = np.where(first, speeds, estimate + step * (np.float32(q) - (speeds < estimate)))
+            state[name][index] = estimate
+
+        # Rolling min/max: reset the bucket row when a new bucket starts
+        span = max(window // self.buckets, 1)
+        bucket = now // span
+        row = bucket % self.buckets
+        if self.bucket_ids[window][row] != bucket:
+            state['min'][row] = np.inf
+            state['max'][row] = -np.inf
+            self.bucket_ids[window][row] = bucket
+        state['min'][row, index] = np.minimum(state['min'][row, index], speeds)
+        state['max'][row, index] = np.maximum(state['max'][row, index], speeds)
+
+    def window_stats(self, window: int) -> Dict[str, np.ndarray]:
+        """
+        Current statistics of every street for one window.
+
+        Returns:
+            Dictionary of arrays aligned with self.keys: ewma, std, min, max, p15, p50, p85
+            (NaN for streets without a sample in the window)
+        """
+        state = self.state[window]
+        span = max(window // self.buckets, 1)
+        current = self.snapshot_time // span if self.snapshot_time is not None else 0
+        live = self.bucket_ids[window] > current - self.buckets
+        with np.errstate(invalid='ignore'):
+            minimum = state['min'][live].min(axis=0) if live.any() else np.full(len(self), np.inf, np.float32)
+            maximum = state['max'][live].max(axis=0) if live.any() else np.full(len(self), -np.inf, np.float32)
+        if self.snapshot_time is None:
+            stale = np.ones(len(self), dtype=bool)
+        else:
+            stale = self.last_time <= self.snapshot_time - window
+        stats = {'ewma': state['ewma'].copy(), 'std': np.sqrt(state['var']),
+                 'min': np.where(np.isinf(minimum), np.nan, minimum),
+                 'max': np.where(np.isinf(maximum), np.nan, maximum)}
+        for q in PERCENTILES:
+            stats[_percentile_name(q)] = state[_percentile_name(q)].copy()
+        for values in stats.values():
+            values[stale] = np.nan
+        return stats
+
+    def street(self, street_id: int, from_node_id: int) -> Dict[str, Dict[str, float]]:
+        """Statistics of one street per window (empty if the street was never seen)."""
+        key = make_street_keys(np.array([street_id]), np.array([from_node_id]))[0]
+        position = np.searchsorted(self.keys, key)
+        if position == len(self.keys) or self.keys[position] != key:
+            return {}
+        return {format_window(window): {name: float(values[position])
+                                        for name, values in self.window_stats(window).items()}
+                for window in self.windows}
+
+    def save(self, path: str):
+        """Writes a checkpoint (atomically replaces an existing one)."""
+        arrays = {'keys': self.keys, 'last_time': self.last_time, 'samples': self.samples}
+        for window in self.windows:
+            for name, values in self.state[window].items():
+                arrays[f"{window}_{name}"] = values
+            arrays[f"{window}_bucket_ids"] = self.bucket_ids[window]
+        meta = {'windows': self.windows, 'buckets': self.buckets, 'snapshot_time': self.snapshot_time}
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'StreetRollingStats':
+        """Restores the statistics from a checkpoint written by save()."""
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            stats = cls(meta['windows'], meta['buckets'])
+            stats.snapshot_time = meta['snapshot_time']
+            stats.keys, stats.last_time, stats.samples = data['keys'], data['last_time'], data['samples']
+            for window in stats.windows:
+                for name in stats.state[window]:
+                    stats.state[window][name] = data[f"{window}_{name}"]
+                stats.bucket_ids[window] = data[f"{window}_bucket_ids"]
+        return stats
+
+    @classmethod
+    def open(cls, path: str, windows: Sequence[int], buckets: int = 4) -> 'StreetRollingStats':
+        """Loads the checkpoint at path if it exists and matches the windows, otherwise starts empty."""
+        if os.path.exists(path):
+            stats = cls.load(path)
+            if stats.windows == [int(window) for window in windows]:
+                logger.info(f"Resumed rolling statistics of {len(stats)} streets from {path}")
+                return stats
+            logger.warning(f"Checkpoint {path} has windows {stats.windows}, starting from scratch")
+        return cls(windows, buckets)
+
+
+def _percentile_name(q: float) -> str:
+    return f"p{round(q * 100)}"
+
+
+def export_window_stats(stats: StreetRollingStats, window: int, output) -> int:
+    """Writes one window's statistics of every street with a recent sample as CSV rows."""
+    values = stats.window_stats(window)
+    ids, from_node_ids = split_street_keys(stats.keys)
+    recent = ~np.isnan(values['ewma'])
+    names = list(values)
+    writer = csv.writer(output)
+    writer.writerow(['street_id', 'from_node_id'] + [f"{name}_kmh" for name in names])
+    rows = zip(ids[recent].tolist(), from_node_ids[recent].tolist(),
+               *(np.round(values[name][recent].astype(np.float64), 1).tolist() for name in names))
+    writer.writerows(rows)
+    return int(recent.sum())
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Show rolling street statistics written by the monitor')
+    parser.add_argument('checkpoint', help='Checkpoint file (--rolling-stats of ptv_flows_realtime_monitor.py)')
+    parser.add_argument('--window', type=str, help='Window to export, e.g. 1h (default: the first window)')
+    parser.add_argument('--street', type=str, help='Only this street (ID:FROM_NODE_ID), all windows')
+    parser.add_argument('--output', type=str, help='CSV file (default: stdout)')
+
+    args = parser.parse_args()
+    try:
+        stats = StreetRollingStats.load(args.checkpoint)
+    except (OSError, KeyError, ValueError) as e:
+        logger.error(f"Cannot read checkpoint: {e}")
+        sys.exit(1)
+    logger.info(f"{len(stats)} streets, last snapshot "
+                f"{from_epoch(stats.snapshot_time) if stats.snapshot_time is not None else '-'}")
+
+    if args.street:
+        try:
+            street_id, from_node_id = parse_street_key(args.street)
+        except ValueError as e:
+            parser.error(str(e))
+        history = stats.street(street_id, from_node_id)
+        if not history:
+            logger.error(f"Street {street_id}:{from_node_id} is not in the checkpoint")
+            sys.exit(1)
+        for window, values in history.items():
+            print(window + ': ' + ', '.join(f"{name} {value:.1f}" for name, value in values.items()))
+        return
+
+    window = parse_window(args.window) if args.window else stats.windows[0]
+    if window not in stats.windows:
+        parser.error(f"Window {args.window} not in checkpoint "
+                     f"({', '.join(format_window(w) for w in stats.windows)})")
+    if args.output:
+        with open(args.output, 'w', newline='', encoding='utf-8') as output:
+            count = export_window_stats(stats, window, output)
+        logger.info(f"Saved statistics of {count} streets to {args.output}")
+    else:
+        export_window_stats(stats, window, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
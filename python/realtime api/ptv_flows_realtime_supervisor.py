@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+PTV Flows Realtime Monitor Supervisor
+
+Monitors several PTV Flows instances (API key + endpoint) from one process. Every tenant
+gets its own RealtimeTrafficMonitor, output directory, log file and poll schedule; all of
+them share one asyncio event loop and one HTTP connection pool. Downloads run in a thread
+pool with one thread per tenant, so a slow endpoint never delays another tenant's poll;
+decoding and writing share --workers threads.
+
+Tenants are read from a JSON file:
+
+    {
+        "output_dir": "./monitoring_output",
+        "tenants": [
+            {"name": "berlin", "api_key_env": "PTV_API_KEY_BERLIN", "interval": 60},
+            {"name": "paris", "api_key": "...", "endpoint": "https://...", "save_snapshots": true,
+             "delta_store": "./paris_deltas"}
+        ]
+    }
+
+Per tenant: name (required), api_key or api_key_env, endpoint, output_dir (default:
+<output_dir>/<name>), max_calls, interval, fixed_interval, poll_lead, save_snapshots,
+archive, delta_store, keyframe_interval, rolling_stats, stats_windows (e.g. "15m,1h"),
+checkpoint_interval, network (enables congestion events), congestion_events, congestion_enter,
+congestion_exit, congestion_min_duration. Missing values fall back to the command line.
+
+Usage:
+    python ptv_flows_realtime_supervisor.py TENANTS.json [--max-calls 100] [--interval 60] [--workers 4]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from ptv_flows_realtime import NetworkStreets, read_snapshot_time, STREET_FIELDS
+from ptv_flows_realtime_congestion import CongestionDetector
+from ptv_flows_realtime_monitor import RealtimeTrafficMonitor, PollScheduler, CHANGE_FIELDS
+from ptv_flows_realtime_stats import parse_window
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINT = "https://api.ptvgroup.tech/flows/realtime-traffic/v1/realtime/traffic"
+
+# Name of the tenant whose work is running; asyncio.to_thread carries it into the worker threads
+current_tenant = contextvars.ContextVar('current_tenant', default=None)
+
+
+class TenantFilter(logging.Filter):
+    """Tags log records with the current tenant and optionally keeps only one tenant's records."""
+
+    def __init__(self, tenant: str = None):
+        super().__init__()
+        self.tenant = tenant
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.tenant = current_tenant.get() or '-'
+        return self.tenant is None or record.tenant == self.tenant
+
+
+def load_tenants(path: str, defaults: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Load the tenant list and fill in defaults.
+
+    Args:
+        path: Path to the tenants JSON file
+        defaults: Values used when a tenant does not set them (max_calls, interval, ...)
+
+    Returns:
+        List of complete tenant settings
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    output_dir = config.get('output_dir', defaults['output_dir'])
+    tenants = []
+    names = set()
+    for entry in config.get('tenants', []):
+        tenant = dict(defaults)
+        tenant.update(entry)
+        name = tenant.get('name')
+        if not name:
+            raise ValueError("Every tenant needs a name")
+        if name in names:
+            raise ValueError(f"Duplicate tenant name: {name}")
+        names.add(name)
+
+        if 'api_key' not in entry and entry.get('api_key_env'):
+            tenant['api_key'] = os.environ.get(entry['api_key_env'])
+        if not tenant.get('api_key'):
+            raise ValueError(f"No API key for tenant {name} (set api_key or api_key_env)")
+        tenant.setdefault('endpoint', DEFAULT_ENDPOINT)
+        tenant['output_dir'] = entry.get('output_dir', os.path.join(output_dir, name))
+        tenants.append(tenant)
+
+    if not tenants:
+        raise ValueError(f"No tenants defined in {path}")
+    return tenants
+
+
+class MonitorSupervisor:
+    """Runs one RealtimeTrafficMonitor per tenant on a shared event loop and connection pool."""
+
+    def __init__(self, tenants: List[Dict[str, Any]], workers: int = 4):
+        self.tenants = tenants
+        self.workers = workers
+        # One pool of keep-alive connections for all tenants; every tenant can download at the same time
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(tenants), pool_maxsize=max(len(tenants), 1))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.monitors = {}
+        self.handlers = []
+        self.fetch_executor = None
+
+    def _create_monitor(self, tenant: Dict[str, Any]) -> RealtimeTrafficMonitor:
+        # Per-tenant log file next to the tenant's monitoring CSV, attached first so it also gets the setup lines
+        os.makedirs(tenant['output_dir'], exist_ok=True)
+        handler = logging.FileHandler(os.path.join(tenant['output_dir'], 'monitor.log'), encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        handler.addFilter(TenantFilter(tenant['name']))
+        logging.getLogger().addHandler(handler)
+        self.handlers.append(handler)
+
+        congestion = None
+        if tenant.get('network'):
+            congestion = CongestionDetector(NetworkStreets.from_csv(tenant['network']),
+                                            tenant.get('congestion_enter', 0.5), tenant.get('congestion_exit', 0.7),
+                                            tenant.get('congestion_min_duration', 300))
+        monitor = RealtimeTrafficMonitor(tenant['api_key'], tenant['endpoint'], tenant['output_dir'],
+                                         archive_dir=tenant.get('archive'),
+                                         delta_store_dir=tenant.get('delta_store'),
+                                         keyframe_interval=tenant.get('keyframe_interval', 30),
+                                         session=self.session,
+                                         rolling_stats_path=tenant.get('rolling_stats'),
+                                         stats_windows=[parse_window(window) for window in
+                                                        tenant.get('stats_windows', '15m,1h').split(',')],
+                                         checkpoint_interval=tenant.get('checkpoint_interval', 10),
+                                         congestion=congestion,
+                                         congestion_events_path=tenant.get('congestion_events'))
+        monitor.scan_fields = tuple(STREET_FIELDS) if tenant.get('save_snapshots') else CHANGE_FIELDS
+        return monitor
+
+    async def _fetch(self, monitor: RealtimeTrafficMonitor):
+        """Downloads in the fetch pool (like asyncio.to_thread, the tenant context goes along)."""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.fetch_executor, context.run,
+                                                                monitor.fetch_data)
+
+    async def _run_tenant(self, tenant: Dict[str, Any]):
+        """Poll loop of one tenant; processing runs in the worker pool, waiting on the event loop."""
+        name = tenant['name']
+        current_tenant.set(name)
+        monitor = await asyncio.to_thread(self._create_monitor, tenant)
+        self.monitors[name] = monitor
+        scheduler = PollScheduler(tenant['interval'], lead=tenant.get('poll_lead', 2.0),
+                                  adaptive=not tenant.get('fixed_interval', False))
+        max_calls = tenant['max_calls']
+        save_snapshots = tenant.get('save_snapshots', False)
+        logger.info(f"Monitoring {tenant['endpoint']} -> {tenant['output_dir']}")
+
+        try:
+            for call_number in range(1, max_calls + 1):
+                raw_data = await self._fetch(monitor)
+                if raw_data is None:
+                    logger.error("Failed to fetch data, skipping this iteration")
+                    scheduler.miss()
+                else:
+                    try:
+                        snapshot_time = read_snapshot_time(raw_data)
+                    except Exception:
+                        snapshot_time = None
+                    scheduler.observe(snapshot_time, time.time())
+                    item = await asyncio.to_thread(monitor.analyze, call_number, raw_data, snapshot_time)
+                    if item is None:
+                        logger.error(f"Failed to parse data of call {call_number}, skipping it")
+                    else:
+                        await asyncio.to_thread(monitor.write, item, save_snapshots)
+
+                if call_number < max_calls:
+                    await asyncio.sleep(max(0.0, scheduler.plan() - time.monotonic()))
+        finally:
+            monitor.close()
+            await asyncio.to_thread(monitor.generate_summary)
+            logger.info("Monitoring completed")
+
+    async def run_async(self):
+        """Monitor all tenants concurrently; a failing tenant does not stop the others."""
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='monitor'))
+        self.fetch_executor = ThreadPoolExecutor(max_workers=len(self.tenants), thread_name_prefix='fetch')
+        try:
+            results = await asyncio.gather(*(self._run_tenant(tenant) for tenant in self.tenants),
+                                           return_exceptions=True)
+        finally:
+            self.fetch_executor.shutdown(wait=False)
+        for tenant, result in zip(self.tenants, results):
+            if isinstance(result, Exception):
+                logger.error(f"Monitoring of tenant {tenant['name']} failed: {result}")
+
+    def run(self):
+        """Run the supervisor until every tenant has made its calls."""
+        try:
+            asyncio.run(self.run_async())
+        finally:
+            for handler in self.handlers:
+                logging.getLogger().removeHandler(handler)
+                handler.close()
+            self.session.close()
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Monitor several PTV Flows instances from one process')
+    parser.add_argument('tenants', help='JSON file with the tenants to monitor')
+    parser.add_argument('--output-dir', type=str, default='./monitoring_output',
+                       help='Parent of the per-tenant output directories (default: ./monitoring_output)')
+    parser.add_argument('--max-calls', type=int, default=100,
+                       help='Default number of API calls per tenant (default: 100)')
+    parser.add_argument('--interval', type=int, default=60,
+                       help='Default interval between calls in seconds (default: 60)')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Threads for snapshot processing; downloads get one thread per tenant (default: 4)')
+
+    args = parser.parse_args()
+    # Prefix console output with the tenant it belongs to
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(tenant)s] %(message)s'))
+        handler.addFilter(TenantFilter())
+    defaults = {'output_dir': args.output_dir, 'max_calls': args.max_calls, 'interval': args.interval}
+
+    try:
+        tenants = load_tenants(args.tenants, defaults)
+    except (OSError, ValueError) as e:
+        logger.error(f"Invalid tenants file: {e}")
+        sys.exit(1)
+
+    try:
+        MonitorSupervisor(tenants, workers=args.workers).run()
+    except KeyboardInterrupt:
+        logger.info("Monitoring cancelled by user")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()